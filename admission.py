@@ -0,0 +1,72 @@
+import os
+import threading
+
+import metrics
+
+# Per worker process: queries and inline uploads served at once, how many may
+# wait for a turn and for how long before the client gets a 503
+ADMISSION_MAX_ACTIVE = int(os.getenv('ADMISSION_MAX_ACTIVE', '16'))
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', '32'))
+ADMISSION_TIMEOUT = float(os.getenv('ADMISSION_TIMEOUT', '30'))
+
+
+class Overloaded(Exception):
+    """The admission queue is full, or a request waited longer than ADMISSION_TIMEOUT."""
+
+
+class AdmissionGate:
+    """
+    Bounded admission for expensive requests. At most `max_active` run at
+    once; up to `queue_size` more wait, first come first served, for at
+    most `timeout` seconds. Anything beyond that is refused straight away,
+    so an overloaded server answers 503 quickly instead of letting requests
+    pile up until every client times out.
+    """
+
+    def __init__(self, max_active=ADMISSION_MAX_ACTIVE, queue_size=ADMISSION_QUEUE_SIZE, timeout=ADMISSION_TIMEOUT):
+        self.max_active = max(1, max_active)
+        self.queue_size = max(0, queue_size)
+        self.timeout = timeout
+        self.active = 0
+        self._waiting = []
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            if self.active < self.max_active and not self._waiting:
+                self._admit()
+                return
+            if len(self._waiting) >= self.queue_size:
+                metrics.ADMISSION_REJECTED.labels("queue_full").inc()
+                raise Overloaded("Server busy: admission queue is full")
+            ticket = object()
+            self._waiting.append(ticket)
+            metrics.ADMISSION_QUEUED.inc()
+            try:
+                admitted = self._cond.wait_for(
+                    lambda: self.active < self.max_active and self._waiting[0] is ticket, timeout=self.timeout
+                )
+            finally:
+                self._waiting.remove(ticket)
+                metrics.ADMISSION_QUEUED.dec()
+                # The next in line may be admissible now that this ticket is gone
+                self._cond.notify_all()
+            if not admitted:
+                metrics.ADMISSION_REJECTED.labels("timeout").inc()
+                raise Overloaded(f"Server busy: no slot free after {self.timeout:.0f}s")
+            self._admit()
+
+    def _admit(self):
+        self.active += 1
+        metrics.ADMISSION_ACTIVE.inc()
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            metrics.ADMISSION_ACTIVE.dec()
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {"active": self.active, "queued": len(self._waiting),
+                    "max_active": self.max_active, "queue_size": self.queue_size}
@@ -0,0 +1,133 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from embedding_cache import normalize_text
+from catalog import get_catalog, GROUP_FILENAME, GROUP_DOMAIN
+
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'true').lower() == 'true'
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '1000'))
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', '3600'))  # seconds
+ANSWER_CACHE_SEMANTIC = os.getenv('ANSWER_CACHE_SEMANTIC', 'true').lower() == 'true'
+ANSWER_CACHE_SIMILARITY = float(os.getenv('ANSWER_CACHE_SIMILARITY', '0.95'))  # cosine threshold
+
+
+def source_token(doc_type, doc_name):
+    """
+    Fingerprint of the data an answer was built from. Answers scoped to one
+    file or domain depend on that group's last ingest; "All Documents"
+    answers depend on the catalog version. The catalog is shared between
+    processes, so a re-ingest anywhere invalidates cached answers everywhere.
+    """
+    catalog = get_catalog()
+    if doc_type == "pdf" and doc_name:
+        return ("group", GROUP_FILENAME, doc_name, catalog.group_version(GROUP_FILENAME, doc_name))
+    if doc_type == "scraped_domain" and doc_name:
+        return ("group", GROUP_DOMAIN, doc_name, catalog.group_version(GROUP_DOMAIN, doc_name))
+    return ("all", catalog.version())
+
+
+class AnswerCache:
+    """
+    LRU + TTL cache of final answers keyed by (normalized query, doc_type,
+    doc_name, model, query mode). On an exact miss, an optional semantic
+    path compares the query's embedding with cached queries of the same
+    scope (everything but the query) and reuses an answer above
+    ANSWER_CACHE_SIMILARITY.
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL,
+                 semantic=ANSWER_CACHE_SEMANTIC, similarity=ANSWER_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic = semantic
+        self.similarity = similarity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def _key(user_query, doc_type, doc_name, model, mode):
+        return (normalize_text(user_query).lower(), doc_type or "", doc_name or "", model, mode)
+
+    def _fresh(self, entry, token, now):
+        return entry["token"] == token and now - entry["created"] <= self.ttl
+
+    def lookup(self, user_query, doc_type, doc_name, model, mode, token, embed_query=None):
+        """
+        Return (answer, query_embedding). answer is None on a miss; the
+        embedding (if the semantic path computed one) can be handed to store().
+        """
+        now = time.time()
+        key = self._key(user_query, doc_type, doc_name, model, mode)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._fresh(entry, token, now):
+                    self._entries.move_to_end(key)
+                    self.exact_hits += 1
+                    self.saved_seconds += entry["latency"]
+                    return entry["answer"], None
+                del self._entries[key]
+
+        if not (self.semantic and embed_query):
+            with self._lock:
+                self.misses += 1
+            return None, None
+
+        vector = np.asarray(embed_query(key[0]), dtype=np.float32)
+        vector /= (np.linalg.norm(vector) or 1.0)
+        with self._lock:
+            candidates = [
+                (k, e) for k, e in self._entries.items()
+                if k[1:] == key[1:] and e["embedding"] is not None and self._fresh(e, token, now)
+            ]
+            if candidates:
+                matrix = np.stack([e["embedding"] for _, e in candidates])
+                scores = matrix @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity:
+                    best_key, best_entry = candidates[best]
+                    self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                    self.saved_seconds += best_entry["latency"]
+                    return best_entry["answer"], vector
+            self.misses += 1
+        return None, vector
+
+    def store(self, user_query, doc_type, doc_name, model, mode, token, answer, latency, embedding=None):
+        key = self._key(user_query, doc_type, doc_name, model, mode)
+        with self._lock:
+            self._entries[key] = {
+                "answer": answer,
+                "token": token,
+                "created": time.time(),
+                "latency": latency,
+                "embedding": embedding,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            total = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (hits / total) if total else 0.0,
+                "saved_seconds": self.saved_seconds,
+            }
+
+
+answer_cache = AnswerCache()
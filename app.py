@@ -1,26 +1,188 @@
 import os
-import io
-import pandas as pd
+import csv
+import json
+import atexit
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from flask import Flask, request, jsonify
-from langchain.docstore.document import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from flask import Flask, Response, request, jsonify, g
 
-from embed import embed_any_file
-from query import query
-from get_vector_db import get_vector_db
+from embed import (
+    allowed_file, is_fast_path, embed_text_upload, save_upload, spool_to_temp,
+    sweep_temp_folder, embed_file_path, parser_pool, TempQuotaExceeded
+)
+from pipeline import run_ingest_pipeline
+from query import query, stream_query, QUERY_MODE, QUERY_MODES
+from answer_cache import answer_cache
+from rotating_user_agent import iter_crawl, SITEMAP_INCREMENTAL
+from get_vector_db import stream_chat, chat, warm_up, close_clients, LLMBusy, LLMTimeout
+from jobs import JobManager
+from catalog import get_catalog, GROUP_FILENAME, GROUP_DOMAIN
+from page_cache import get_page_cache
+from admission import AdmissionGate, Overloaded
+import metrics
 
-from langchain.schema import HumanMessage
-from langchain_community.chat_models import ChatOllama
+
+# Scraped pages routinely exceed the csv module's default 128 KiB field limit
+csv.field_size_limit(64 * 1024 * 1024)
+
+# Seconds a refused client is told to wait before retrying
+RETRY_AFTER_SECONDS = int(os.getenv('RETRY_AFTER_SECONDS', '5'))
 
 app = Flask(__name__)
+atexit.register(close_clients)
+atexit.register(parser_pool.shutdown)
+
+# Endpoints that embed or generate inline; everything else (job status, listings, metrics) is never queued
+ADMITTED_ENDPOINTS = {"route_query", "route_query_stream", "route_no_rag_query", "route_no_rag_query_stream", "route_embed"}
+admission = AdmissionGate()
+
+def overloaded(message):
+    response = jsonify({"error": message})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(RETRY_AFTER_SECONDS)
+    return response
+
+@app.before_request
+def start_trace():
+    # Honour an ID set by a proxy or client so logs can be correlated across hops
+    request_id = request.headers.get("X-Request-ID", "")[:64] or None
+    g.trace, g.trace_token = metrics.begin_trace(request_id)
+
+@app.before_request
+def admit():
+    if request.endpoint not in ADMITTED_ENDPOINTS:
+        return None
+    try:
+        with metrics.stage("request", "admission"):
+            admission.acquire()
+    except Overloaded as e:
+        return overloaded(str(e))
+    g.admitted = True
+    return None
+
+@app.after_request
+def hand_over_admission(response):
+    if g.pop("admitted", False):
+        if response.is_streamed:
+            # Held until the body is fully sent, so a streamed answer keeps its slot
+            response.call_on_close(admission.release)
+        else:
+            admission.release()
+    return response
+
+@app.after_request
+def finish_trace(response):
+    trace = g.pop("trace", None)
+    if trace is None:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.REQUEST_SECONDS.labels(endpoint, request.method, response.status_code).observe(trace.elapsed())
+    response.headers["X-Request-ID"] = trace.request_id
+    # A streamed body is still being produced: sse() reports its timings when it ends
+    if not response.is_streamed:
+        if metrics.TRACE_HEADERS:
+            response.headers["Server-Timing"] = trace.server_timing()
+        metrics.log_if_slow(trace, f"{request.method} {request.path} -> {response.status_code}")
+    return response
+
+@app.teardown_request
+def reset_trace(exc):
+    token = g.pop("trace_token", None)
+    if token is not None:
+        metrics.end_trace(token)
+    # Only still set if no response was produced
+    if g.pop("admitted", False):
+        admission.release()
+
+def discard_input(job, path):
+    """Remove a job's spooled input, unless a shutdown interrupted the job and will resume it."""
+    if not job.is_interrupted() and os.path.exists(path):
+        os.remove(path)
+
+def run_file_job(job, file_path, filename):
+    try:
+        with metrics.stage("embed_file", "job"):
+            embed_file_path(file_path, filename, on_progress=job.update)
+    finally:
+        discard_input(job, file_path)
+
+def run_csv_job(job, csv_path):
+    try:
+        with open(csv_path, encoding="utf-8", errors="replace", newline="") as f:
+            reader = csv.DictReader(f)
+            job.update("embedding")
+            with metrics.stage("embed_csv", "job"):
+                result = run_ingest_pipeline(
+                    ((row["URL"], row["Content"]) for row in reader),
+                    on_batch=lambda stats: job.update("embedding", **stats),
+                    should_stop=job.is_cancelled
+                )
+        job.update("done", **result)
+    finally:
+        discard_input(job, csv_path)
+
+def run_sitemap_job(job, sitemap_url, incremental=SITEMAP_INCREMENTAL):
+    job.update("crawling")
+    # Incremental recrawls skip pages whose sitemap lastmod predates their last
+    # ingest, and re-fetch the rest conditionally through the page cache
+    catalog = get_catalog()
+    last_ingested = (lambda url: catalog.ingested_at("url", url)) if incremental else None
+    crawl_stats = {}
+    with metrics.stage("embed_sitemap", "job"):
+        result = run_ingest_pipeline(
+            iter_crawl(sitemap_url, last_ingested=last_ingested, page_cache=get_page_cache(), stats=crawl_stats),
+            on_batch=lambda stats: job.update("crawling", **stats, **crawl_stats),
+            should_stop=job.is_cancelled
+        )
+    job.update("done", **result, **crawl_stats)
+
+jobs = JobManager()
+jobs.register("embed_file", run_file_job)
+jobs.register("embed_csv", run_csv_job)
+jobs.register("embed_sitemap", run_sitemap_job)
+
+def sse(events):
+    """
+    Wrap a generator of (event, data) pairs as a Server-Sent Events response.
+    If the client disconnects, the server closes the generator, which in turn
+    stops the upstream Ollama generation.
+    """
+    # The body is sent after the request hooks have run, so carry the trace over
+    trace = metrics.current_trace()
+    request_endpoint = request.url_rule.rule if request.url_rule else request.path
+
+    def body():
+        token = metrics.resume_trace(trace)
+        try:
+            for event, data in events:
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+        finally:
+            events.close()
+            metrics.end_trace(token)
+            if trace is not None:
+                metrics.STREAM_SECONDS.labels(request_endpoint).observe(trace.elapsed())
+                metrics.log_if_slow(trace, f"stream {request_endpoint}")
+
+    return Response(body(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # keep reverse proxies from buffering the stream
+    })
+
+def job_accepted(job_id, message):
+    return jsonify({"job_id": job_id, "status_url": f"/jobs/{job_id}", "message": message}), 202
 
 @app.route('/embed', methods=['POST'])
 def route_embed():
-    """Embed a file (pdf, docx, txt, md, etc.) into the vector database."""
+    """
+    Embed a file (pdf, docx, txt, md, etc.) into the vector database.
+    Small txt/md files are embedded inline from memory and answered with 200;
+    everything else is queued and answered with 202 and a job ID to poll at
+    /jobs/<job_id>.
+    """
     if 'file' not in request.files:
         return jsonify({"error": "No file part"}), 400
 
@@ -28,41 +190,69 @@ def route_embed():
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
 
+    if not allowed_file(file.filename):
+        return jsonify({"error": "File type not allowed"}), 400
+
     try:
-        embedded = embed_any_file(file)
-        if embedded:
-            return jsonify({"message": "File embedded successfully"}), 200
-        else:
-            return jsonify({"error": "File embedding failed"}), 400
+        if is_fast_path(file):
+            result = embed_text_upload(file)
+            return jsonify({"message": "File embedded successfully", **result}), 200
+
+        file_path = save_upload(file)
+        job_id = jobs.submit("embed_file", file_path=file_path, filename=file.filename)
+        return job_accepted(job_id, "File queued for embedding")
+    except TempQuotaExceeded as e:
+        return jsonify({"error": str(e)}), 507
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def route_job_status(job_id):
+    """Stage, chunk counts, throughput and error of an ingestion job."""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job), 200
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def route_job_cancel(job_id):
+    if jobs.cancel(job_id):
+        return jsonify({"message": "Cancellation requested"}), 202
+    if jobs.get(job_id) is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify({"error": "Job already finished"}), 409
+
 @app.route('/list_documents', methods=['GET'])
 def list_documents():
     """
-    Return a unified list of docs from the vector store:
+    Return a unified list of docs from the document catalog:
       - PDFs / file-based docs have metadata['filename'].
       - Scraped domain-based docs have metadata['domain'].
-    We'll return two lists: 'pdfDocs' and 'scrapedDomains'.
+    We'll return two lists: 'pdfDocs' and 'scrapedDomains', plus per-entry
+    details (chunk count, byte size, embedding model, last ingest time).
+    Optional ?limit=&offset= page both lists. Responses carry an ETag and
+    If-None-Match is answered with 304 while nothing has been ingested.
     """
     try:
-        db = get_vector_db()
-        raw = db._collection.get()
-        all_metadata = raw.get("metadatas", [])
-
-        pdf_docs = set()
-        scraped_domains = set()
-
-        for meta in all_metadata:
-            if "filename" in meta:
-                pdf_docs.add(meta["filename"])
-            elif "domain" in meta:
-                scraped_domains.add(meta["domain"])
-
-        return jsonify({
-            "pdfDocs": sorted(list(pdf_docs)),
-            "scrapedDomains": sorted(list(scraped_domains))
-        }), 200
+        limit = request.args.get('limit', type=int)
+        offset = request.args.get('offset', default=0, type=int)
+
+        catalog = get_catalog()
+        etag = f"{catalog.version()}-{limit}-{offset}"
+        if request.if_none_match.contains(etag):
+            return "", 304, {"ETag": f'"{etag}"'}
+
+        pdf_docs, pdf_total = catalog.list_groups(GROUP_FILENAME, limit=limit, offset=offset)
+        domains, domain_total = catalog.list_groups(GROUP_DOMAIN, limit=limit, offset=offset)
+
+        response = jsonify({
+            "pdfDocs": [d["name"] for d in pdf_docs],
+            "scrapedDomains": [d["name"] for d in domains],
+            "details": {"pdfDocs": pdf_docs, "scrapedDomains": domains},
+            "totals": {"pdfDocs": pdf_total, "scrapedDomains": domain_total},
+        })
+        response.set_etag(etag)
+        return response, 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -74,9 +264,10 @@ def route_query():
       {
         "query": "...",
         "doc_type": "pdf" or "scraped_domain",
-        "doc_name": "my.pdf or example.com"
+        "doc_name": "my.pdf or example.com",
+        "mode": "fast" | "multi" | "auto"
       }
-    or nothing => "All Documents".
+    or nothing => "All Documents". mode defaults to QUERY_MODE.
     """
     data = request.get_json()
     user_query = data.get('query', '').strip()
@@ -85,16 +276,45 @@ def route_query():
 
     doc_type = data.get('doc_type')  # "pdf" or "scraped_domain"
     doc_name = data.get('doc_name')
+    mode = data.get('mode') or QUERY_MODE
+    if mode not in QUERY_MODES:
+        return jsonify({"error": f"mode must be one of {', '.join(QUERY_MODES)}"}), 400
 
     try:
-        response = query(user_query, doc_type=doc_type, doc_name=doc_name)
+        response = query(user_query, doc_type=doc_type, doc_name=doc_name, mode=mode)
         if response:
             return jsonify({"message": response}), 200
         else:
             return jsonify({"error": "Something went wrong"}), 400
+    except LLMBusy as e:
+        return overloaded(str(e))
+    except LLMTimeout as e:
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/query/stream', methods=['POST'])
+def route_query_stream():
+    """
+    Same body as /query, answered as Server-Sent Events: a "sources" event
+    with the retrieved chunks' metadata, "token" events as the answer is
+    generated, then "done" (or "error").
+    """
+    data = request.get_json()
+    user_query = data.get('query', '').strip()
+    if not user_query:
+        return jsonify({"error": "No query provided"}), 400
+    mode = data.get('mode') or QUERY_MODE
+    if mode not in QUERY_MODES:
+        return jsonify({"error": f"mode must be one of {', '.join(QUERY_MODES)}"}), 400
+
+    return sse(stream_query(user_query, data.get('doc_type'), data.get('doc_name'), mode))
+
+@app.route('/query/cache_stats', methods=['GET'])
+def route_query_cache_stats():
+    """Hit rate and generation time saved by the /query answer cache."""
+    return jsonify(answer_cache.stats()), 200
+
 @app.route('/no_rag_query', methods=['POST'])
 def route_no_rag_query():
     """Directly query the LLM (NO RAG)."""
@@ -103,63 +323,109 @@ def route_no_rag_query():
     if not prompt:
         return jsonify({"error": "No prompt provided"}), 400
 
-    model_name = os.getenv('LLM_MODEL', 'mistral')
-    llm = ChatOllama(model=model_name)
-
     try:
-        messages = [HumanMessage(content=prompt)]
-        response = llm(messages)
-        return jsonify({"message": response.content}), 200
+        with metrics.stage("no_rag_query", "generate"):
+            response = chat([{"role": "user", "content": prompt}])
+        return jsonify({"message": response}), 200
+    except LLMBusy as e:
+        return overloaded(str(e))
+    except LLMTimeout as e:
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/no_rag_query/stream', methods=['POST'])
+def route_no_rag_query_stream():
+    """Same body as /no_rag_query, answered as "token" Server-Sent Events followed by "done"."""
+    data = request.get_json()
+    prompt = data.get('prompt', '')
+    if not prompt:
+        return jsonify({"error": "No prompt provided"}), 400
+
+    def events():
+        tokens = stream_chat([{"role": "user", "content": prompt}])
+        try:
+            for piece in tokens:
+                yield "token", piece
+        finally:
+            tokens.close()
+        yield "done", {}
+
+    return sse(events())
+
 @app.route('/embed_csv', methods=['POST'])
 def route_embed_csv():
     """
-    Embed CSV data with columns 'URL' and 'Content' into the vector store.
+    Queue CSV data with columns 'URL' and 'Content' for embedding into the vector store.
     Each row is chunked => metadata={"url": row["URL"], "domain": <parsed domain>}.
+    The body is spooled to disk and streamed through the ingest pipeline by a
+    background job; returns 202 with a job ID.
     """
-    from urllib.parse import urlparse
-
     try:
-        csv_text = request.data.decode("utf-8", errors="replace")
-        if not csv_text.strip():
-            return jsonify({"error": "No CSV data provided"}), 400
-
-        df = pd.read_csv(io.StringIO(csv_text))
-        if "URL" not in df.columns or "Content" not in df.columns:
-            return jsonify({"error": "CSV must have 'URL' and 'Content' columns"}), 400
-
-        db = get_vector_db()
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=100)
-        docs_to_add = []
-
-        for _, row in df.iterrows():
-            url = str(row["URL"])
-            content = str(row["Content"])
-
-            # parse domain from the URL
-            parsed = urlparse(url)
-            domain = parsed.netloc  # e.g. "example.com"
-
-            chunks = text_splitter.split_text(content)
-            for chunk in chunks:
-                doc = Document(
-                    page_content=chunk,
-                    metadata={"url": url, "domain": domain}
-                )
-                docs_to_add.append(doc)
+        with metrics.stage("embed_csv", "spool"):
+            csv_path = spool_to_temp(request.stream, "scrape.csv")
+
+        with open(csv_path, encoding="utf-8", errors="replace", newline="") as f:
+            fieldnames = csv.DictReader(f).fieldnames
+        error = None
+        if not fieldnames:
+            error = "No CSV data provided"
+        elif "URL" not in fieldnames or "Content" not in fieldnames:
+            error = "CSV must have 'URL' and 'Content' columns"
+        if error:
+            os.remove(csv_path)
+            return jsonify({"error": error}), 400
+
+        job_id = jobs.submit("embed_csv", csv_path=csv_path)
+        return job_accepted(job_id, "CSV queued for embedding")
+    except TempQuotaExceeded as e:
+        return jsonify({"error": str(e)}), 507
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        if not docs_to_add:
-            return jsonify({"error": "No documents found in CSV"}), 400
+@app.route('/metrics', methods=['GET'])
+def route_metrics():
+    """Prometheus exposition of request, stage, Ollama and crawler metrics."""
+    body, content_type = metrics.render()
+    return Response(body, mimetype=content_type.split(";")[0], headers={"Content-Type": content_type})
 
-        db.add_documents(docs_to_add)
-        db.persist()
+@app.route('/embed_sitemap', methods=['POST'])
+def route_embed_sitemap():
+    """
+    Crawl a sitemap on the server and stream its pages straight into the vector store.
+    JSON body: {"sitemap_url": "https://example.com/sitemap_index.xml", "incremental": true}
+    With "incremental", pages whose sitemap lastmod is older than their last
+    ingest are not fetched again (default SITEMAP_INCREMENTAL).
+    Returns 202 with a job ID.
+    """
+    data = request.get_json(silent=True) or {}
+    sitemap_url = (data.get('sitemap_url') or '').strip()
+    if not sitemap_url:
+        return jsonify({"error": "No sitemap_url provided"}), 400
+    incremental = data.get('incremental', SITEMAP_INCREMENTAL)
+    if not isinstance(incremental, bool):
+        return jsonify({"error": "incremental must be true or false"}), 400
 
-        return jsonify({"message": f"Successfully embedded {len(docs_to_add)} chunks from CSV"}), 200
+    try:
+        job_id = jobs.submit("embed_sitemap", sitemap_url=sitemap_url, incremental=incremental)
+        return job_accepted(job_id, "Sitemap queued for crawling and embedding")
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def resume_background_work(before=None):
+    """
+    Pick up ingestion jobs that were interrupted by the last shutdown and
+    clear TEMP_FOLDER of files no job needs. `before` (a timestamp) limits
+    both to what predates this server's start, so a worker that runs this
+    late cannot touch work that other workers have accepted meanwhile.
+    """
+    jobs.resume_interrupted(before=before)
+    sweep_temp_folder(keep=jobs.active_input_paths(), before=before)
+
 if __name__ == '__main__':
+    # Development server; use serve.py in production
+    # Load models into Ollama up front so the first request isn't slow
+    warm_up()
+    resume_background_work()
     # Flask on port 8080
-    app.run(host="0.0.0.0", port=8080, debug=True)
\ No newline at end of file
+    app.run(host="0.0.0.0", port=8080, debug=os.getenv('FLASK_DEBUG', 'false').lower() == 'true', threaded=True)
\ No newline at end of file
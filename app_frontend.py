@@ -1,9 +1,120 @@
+import time
+import json
 import streamlit as st
 import requests
 import pandas as pd
 import io
 
-from rotating_user_agent import fetch_sitemap_urls, fetch_page_content
+from rotating_user_agent import iter_crawl
+
+API_URL = "http://localhost:8080"
+
+def wait_for_job(response, label):
+    """
+    Poll /jobs/<id> for a job accepted by the backend (HTTP 202), rendering
+    stage, chunk counts and throughput until the job finishes. A 200 means
+    the backend already finished the work inline (small text files).
+    """
+    try:
+        data = response.json()
+    except requests.exceptions.JSONDecodeError:
+        st.error("Server returned non-JSON response.")
+        st.write(response.text)
+        return
+    if response.status_code == 200:
+        st.success(data.get("message", f"{label} finished!"))
+        return
+    if response.status_code != 202:
+        st.error(f"Error: {data.get('error', 'Something went wrong')}")
+        return
+
+    job_id = data["job_id"]
+    status_box = st.empty()
+    progress_bar = st.progress(0.0)
+    while True:
+        job = requests.get(f"{API_URL}/jobs/{job_id}").json()
+        progress = job.get("progress", {})
+        total = progress.get("total_chunks")
+        if total:
+            progress_bar.progress(min(1.0, progress.get("chunks", 0) / total))
+        status_box.write(
+            f"{label}: **{job['status']}** (stage: {job.get('stage')}) - "
+            f"{progress.get('pages', 0)} pages, {progress.get('chunks', 0)} chunks, "
+            f"{job.get('chunks_per_sec', 0):.1f} chunks/sec"
+        )
+        if job["status"] in ("completed", "failed", "cancelled"):
+            break
+        time.sleep(1)
+
+    progress_bar.progress(1.0)
+    if job["status"] == "completed":
+        not_refetched = sum(
+            progress.get(key, 0) for key in ("skipped_lastmod", "skipped_not_modified", "skipped_unchanged")
+        )
+        st.success(
+            f"{label} finished: {progress.get('chunks', 0)} chunks embedded, "
+            f"{progress.get('skipped', 0)} unchanged sources skipped"
+            + (f", {not_refetched} unchanged pages skipped before parsing." if not_refetched else ".")
+        )
+    elif job["status"] == "failed":
+        st.error(f"{label} failed: {job.get('error')}")
+    else:
+        st.warning(f"{label} was cancelled.")
+
+def iter_sse(response):
+    """Parse a Server-Sent Events response into (event, data) pairs."""
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+        elif not line and data:
+            yield event, json.loads("\n".join(data))
+            event, data = "message", []
+
+def render_stream(url, payload):
+    """
+    POST to a streaming endpoint and write the answer as it arrives. Sources
+    (sent before the first token) are listed above the answer.
+    """
+    with requests.post(url, json=payload, stream=True) as response:
+        if response.status_code != 200:
+            try:
+                st.error(f"Error: {response.json().get('error', 'Something went wrong')}")
+            except requests.exceptions.JSONDecodeError:
+                st.error(response.text)
+            return
+
+        events = iter_sse(response)
+        outcome = {}
+
+        def tokens():
+            for event, data in events:
+                if event == "sources":
+                    sources = data.get("sources", [])
+                    if data.get("cached"):
+                        st.caption("Answer served from cache")
+                    elif sources:
+                        with st.expander(f"Sources ({len(sources)})"):
+                            for source in sources:
+                                name = source.get("filename") or source.get("url") or source.get("domain")
+                                st.write(f"{name} (relevance {source.get('score', 0):.2f})")
+                elif event == "token":
+                    yield data
+                elif event == "error":
+                    outcome["error"] = data.get("error")
+                elif event == "done":
+                    outcome.update(data)
+
+        st.write_stream(tokens())
+        if outcome.get("error"):
+            st.error(f"Error: {outcome['error']}")
+        elif outcome.get("time_to_first_token") is not None:
+            st.caption(
+                f"First token after {outcome['time_to_first_token']:.1f}s, "
+                f"finished in {outcome['elapsed']:.1f}s"
+            )
 
 def main():
     st.set_page_config(page_title="Document Embed & Query App", layout="centered")
@@ -26,19 +137,9 @@ def main():
         
         if file is not None:
             if st.button("Embed File"):
-                with st.spinner("Embedding file..."):
-                    files = {'file': file}
-                    response = requests.post("http://localhost:8080/embed", files=files)
-                    try:
-                        data = response.json()
-                        if response.status_code == 200:
-                            st.success(data.get("message", "File embedded successfully!"))
-                        else:
-                            st.error(f"Error: {data.get('error', 'Something went wrong')}")
-                    except requests.exceptions.JSONDecodeError:
-                        st.error("Server returned non-JSON response.")
-                        st.write("Raw response text:")
-                        st.write(response.text)
+                files = {'file': file}
+                response = requests.post(f"{API_URL}/embed", files=files)
+                wait_for_job(response, "Embedding")
 
     # ----------------------------------------------------------------
     # (2) Query Database Tab
@@ -49,10 +150,20 @@ def main():
         # Load doc lists: pdfDocs, scrapedDomains
         with st.spinner("Loading available documents..."):
             try:
-                doc_resp = requests.get("http://localhost:8080/list_documents")
-                if doc_resp.status_code == 200:
+                # Send the last ETag so unchanged listings come back as an empty 304
+                cached = st.session_state.get("docs_cache")
+                headers = {"If-None-Match": cached["etag"]} if cached else {}
+                doc_resp = requests.get(f"{API_URL}/list_documents", headers=headers)
+                if doc_resp.status_code in (200, 304):
                     # Parse the JSON response
-                    docs_data = doc_resp.json()
+                    if doc_resp.status_code == 304:
+                        docs_data = cached["data"]
+                    else:
+                        docs_data = doc_resp.json()
+                        st.session_state["docs_cache"] = {
+                            "etag": doc_resp.headers.get("ETag"),
+                            "data": docs_data,
+                        }
                     # DEBUG: Show the raw data from the endpoint
                     st.write("DEBUG: response from /list_documents:")
                     st.write(docs_data)
@@ -83,11 +194,16 @@ def main():
 
         selected_doc = st.selectbox("Select a document or domain", doc_options)
         query_input = st.text_input("Enter your query")
+        query_mode = st.radio(
+            "Retrieval mode", ["auto", "fast", "multi"], horizontal=True,
+            help="fast: search with your question as asked. multi: also search LLM rewrites of it. "
+                 "auto: only rewrite when the first search finds nothing close."
+        )
 
         if st.button("Submit Query"):
             if query_input.strip():
-                with st.spinner("Querying database..."):
-                    payload = {"query": query_input}
+                with st.spinner("Retrieving context..."):
+                    payload = {"query": query_input, "mode": query_mode}
 
                     # Determine doc_type & doc_name
                     if selected_doc == "All Documents":
@@ -101,18 +217,7 @@ def main():
                         payload["doc_type"] = "scraped_domain"
                         payload["doc_name"] = domain_name
 
-                    response = requests.post("http://localhost:8080/query", json=payload)
-                    try:
-                        data = response.json()
-                        if response.status_code == 200:
-                            st.success("Query successful!")
-                            st.write(data.get("message", "No response"))
-                        else:
-                            st.error(f"Error: {data.get('error', 'Something went wrong')}")
-                    except requests.exceptions.JSONDecodeError:
-                        st.error("Server returned non-JSON response.")
-                        st.write("Raw response text:")
-                        st.write(response.text)
+                    render_stream(f"{API_URL}/query/stream", payload)
             else:
                 st.warning("Please enter a query before submitting.")
 
@@ -126,21 +231,7 @@ def main():
         if st.button("Send to Model"):
             if no_rag_input.strip():
                 with st.spinner("Talking to the model (NO RAG mode)..."):
-                    response = requests.post(
-                        "http://localhost:8080/no_rag_query",
-                        json={"prompt": no_rag_input}
-                    )
-                    try:
-                        data = response.json()
-                        if response.status_code == 200:
-                            st.success("Model responded:")
-                            st.write(data.get("message", "No response"))
-                        else:
-                            st.error(f"Error: {data.get('error', 'Something went wrong')}")
-                    except requests.exceptions.JSONDecodeError:
-                        st.error("Server returned non-JSON response.")
-                        st.write("Raw response text:")
-                        st.write(response.text)
+                    render_stream(f"{API_URL}/no_rag_query/stream", {"prompt": no_rag_input})
             else:
                 st.warning("Please enter a message before sending.")
 
@@ -156,31 +247,35 @@ def main():
         if "scraped_df" not in st.session_state:
             st.session_state["scraped_df"] = None
 
+        if st.button("Crawl & Embed on Server"):
+            if sitemap_url.strip():
+                response = requests.post(
+                    f"{API_URL}/embed_sitemap",
+                    json={"sitemap_url": sitemap_url.strip()}
+                )
+                wait_for_job(response, "Crawl & embed")
+            else:
+                st.warning("Please enter a valid sitemap URL.")
+
         if st.button("Scrape Sitemap"):
             if sitemap_url.strip():
-                with st.spinner("Recursively parsing sitemap..."):
-                    all_page_urls = fetch_sitemap_urls(sitemap_url.strip())
+                rows = []
+                progress = st.empty()
+                with st.spinner("Crawling sitemap and pages concurrently with rotating user agents..."):
+                    for i, (page_url, content) in enumerate(iter_crawl(sitemap_url.strip()), start=1):
+                        progress.write(f"Scraped {i} pages, latest: {page_url}")
+                        if content:
+                            rows.append((page_url, content))
+                        else:
+                            st.error(f"Failed or empty content for {page_url}")
 
-                if not all_page_urls:
-                    st.warning("No pages found in the sitemap.")
+                if rows:
+                    df = pd.DataFrame(rows, columns=["URL", "Content"])
+                    st.session_state["scraped_df"] = df
+                    st.success(f"Scraped {len(rows)} pages. Preview below:")
+                    st.dataframe(df.head(5))
                 else:
-                    rows = []
-                    with st.spinner(f"Scraping {len(all_page_urls)} pages with rotating user agents..."):
-                        for i, page_url in enumerate(all_page_urls, start=1):
-                            st.write(f"Scraping {i}/{len(all_page_urls)}: {page_url}")
-                            content = fetch_page_content(page_url)
-                            if content:
-                                rows.append((page_url, content))
-                            else:
-                                st.error(f"Failed or empty content for {page_url}")
-
-                    if rows:
-                        df = pd.DataFrame(rows, columns=["URL", "Content"])
-                        st.session_state["scraped_df"] = df
-                        st.success(f"Scraped {len(rows)} pages. Preview below:")
-                        st.dataframe(df.head(5))
-                    else:
-                        st.warning("No content scraped.")
+                    st.warning("No pages found or no content scraped.")
             else:
                 st.warning("Please enter a valid sitemap URL.")
 
@@ -192,18 +287,14 @@ def main():
                 df.to_csv(csv_buffer, index=False)
                 csv_text = csv_buffer.getvalue()
 
-                with st.spinner("Embedding CSV into the vector store..."):
-                    try:
-                        embed_resp = requests.post(
-                            "http://localhost:8080/embed_csv",
-                            data=csv_text.encode("utf-8")  
-                        )
-                        if embed_resp.status_code == 200:
-                            st.success(embed_resp.json().get("message", "Embedding successful!"))
-                        else:
-                            st.error(embed_resp.json().get("error", "Error embedding CSV data."))
-                    except Exception as e:
-                        st.error(f"Error sending CSV to /embed_csv: {e}")
+                try:
+                    embed_resp = requests.post(
+                        f"{API_URL}/embed_csv",
+                        data=csv_text.encode("utf-8")
+                    )
+                    wait_for_job(embed_resp, "CSV embedding")
+                except Exception as e:
+                    st.error(f"Error sending CSV to /embed_csv: {e}")
 
             # Also let the user download the CSV
             if st.button("Download CSV"):
@@ -0,0 +1,741 @@
+"""
+Offline benchmark of ingestion, querying and listing, with no Ollama needed.
+
+    python benchmark.py run [--output benchmark.json] [--md-files 40] [--pdf-files 8]
+                            [--site-pages 2000] [--queries 100] [--list-sizes 10000,100000]
+    python benchmark.py compare old.json new.json
+
+`run` works in a throwaway directory with its own Chroma store and SQLite
+sidecars, starts fake_ollama.py and a synthetic website as subprocesses,
+and drives the real code paths:
+
+  ingest   - generated markdown and PDF files through embed_file_path
+  sitemap  - fetch_sitemap_urls over a sitemap index (plain and .xml.gz
+             sub-sitemaps), then a crawl + ingest and an incremental recrawl
+             through the /embed_sitemap job
+  query    - POST /query per mode and /query/stream time to first token
+  scale    - the store is grown to each --list-sizes chunk count and
+             GET /list_documents and a fast /query are timed at that size
+
+Peak RSS (server process plus parser workers) is sampled per phase. The
+results are written as JSON together with the commit and settings they were
+measured on; `compare` prints the change of every metric between two runs.
+Settings under test (VECTOR_BACKEND, HYBRID_SEARCH, ...) are taken from the
+environment as usual; storage paths and OLLAMA_BASE_URL are always
+redirected to the benchmark's own.
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import gzip
+import socket
+import shutil
+import hashlib
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import psutil
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SEED = 1234
+SETTINGS = (
+    "VECTOR_BACKEND", "VECTOR_SHARDING", "HYBRID_SEARCH", "EMBEDDING_CACHE_ENABLED", "EMBED_BATCH_SIZE",
+    "EMBED_REQUEST_BATCH", "EMBED_MAX_CONCURRENCY", "QUERY_TOP_K", "CONTEXT_TOKEN_BUDGET", "PAGE_DEDUP_ENABLED",
+    "PARSE_WORKERS", "CRAWL_CONCURRENCY",
+)
+# Metrics where a larger value is an improvement; everything else (latency, seconds, memory) is better smaller
+HIGHER_IS_BETTER = re.compile(r"per_sec|recall")
+# Workload sizes and counters: reported, but a change is not a regression
+COUNTS = re.compile(r"\.(n|files|bytes|urls|pages|chunks|errors|duplicate_pages|boilerplate_blocks|skipped_\w+)$")
+
+
+# ----------------------------------------------------------------
+# Synthetic corpus
+# ----------------------------------------------------------------
+
+class Corpus:
+    """Deterministic pseudo-text: a Zipf-distributed vocabulary plus product-code style identifiers."""
+
+    def __init__(self, seed=SEED, vocabulary=6000):
+        self.rng = np.random.default_rng(seed)
+        syllables = ["ka", "lo", "mi", "ne", "ru", "ta", "shi", "vo", "pe", "dra", "quel", "om", "tri", "sa", "ben"]
+        words = set()
+        while len(words) < vocabulary:
+            words.add("".join(self.rng.choice(syllables, size=self.rng.integers(2, 5))))
+        self.words = np.array(sorted(words))
+        ranks = np.arange(1, vocabulary + 1)
+        self.weights = (1 / ranks) / (1 / ranks).sum()
+
+    def sentence(self, rng=None):
+        rng = rng or self.rng
+        words = list(rng.choice(self.words, size=rng.integers(8, 24), p=self.weights))
+        if rng.random() < 0.15:
+            words.insert(rng.integers(len(words)), f"ERR-{rng.integers(1000, 9999)}")
+        return " ".join(words).capitalize() + "."
+
+    def paragraph(self, rng=None):
+        rng = rng or self.rng
+        return " ".join(self.sentence(rng) for _ in range(rng.integers(3, 8)))
+
+    def markdown(self, target_bytes, title):
+        parts = [f"# {title}\n"]
+        size = 0
+        section = 0
+        while size < target_bytes:
+            if size == 0 or self.rng.random() < 0.2:
+                section += 1
+                parts.append(f"\n## Section {section}\n")
+            paragraph = self.paragraph()
+            parts.append(paragraph + "\n")
+            size += len(paragraph) + 1
+        return "\n".join(parts)
+
+
+def write_pdf(path, paragraphs, lines_per_page=48, width=95):
+    """Write a minimal text-only PDF (Helvetica, one content stream per page)."""
+    lines = []
+    for paragraph in paragraphs:
+        words, line = paragraph.split(), ""
+        for word in words:
+            if len(line) + len(word) + 1 > width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines.extend([line, ""])
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page_lines in pages:
+        escaped = [l.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for l in page_lines]
+        stream = "BT /F1 10 Tf 40 800 Td 14 TL " + " ".join(f"({l}) Tj T*" for l in escaped) + " ET"
+        stream = stream.encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842]"
+            b" /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        " ".join(f"{k} 0 R" for k in kids).encode(), len(kids)
+    )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def generate_files(directory, corpus, md_files, pdf_files, max_kb):
+    """Markdown and PDF files with log-normally distributed sizes between 2 KB and max_kb."""
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    sizes = np.clip(corpus.rng.lognormal(mean=math.log(24 * 1024), sigma=1.2, size=md_files + pdf_files),
+                    2 * 1024, max_kb * 1024)
+    for i, size in enumerate(sizes):
+        if i < md_files:
+            path = os.path.join(directory, f"doc-{i:04d}.md")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(corpus.markdown(int(size), f"Document {i}"))
+        else:
+            path = os.path.join(directory, f"doc-{i:04d}.pdf")
+            paragraphs, total = [], 0
+            while total < size:
+                paragraphs.append(corpus.paragraph())
+                total += len(paragraphs[-1])
+            write_pdf(path, paragraphs)
+        files.append(path)
+    return files
+
+
+# ----------------------------------------------------------------
+# Synthetic website
+# ----------------------------------------------------------------
+
+def site_handler(corpus, pages, per_sitemap):
+    sitemaps = math.ceil(pages / per_sitemap)
+    modified = "Mon, 01 Jan 2024 00:00:00 GMT"
+    nav = "<nav><ul><li>Home</li><li>Products</li><li>Support</li><li>About us</li></ul></nav>"
+    footer = "<footer><p>Copyright 2024 Example Corp. All rights reserved.</p><p>Privacy | Terms</p></footer>"
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == "/sitemap_index.xml":
+                entries = "".join(
+                    f"<sitemap><loc>{self.base}/sitemap-{i}.xml{'.gz' if i % 2 else ''}</loc></sitemap>"
+                    for i in range(sitemaps)
+                )
+                return self.reply(
+                    '<?xml version="1.0" encoding="UTF-8"?>'
+                    f'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{entries}</sitemapindex>',
+                    "application/xml",
+                )
+            match = re.fullmatch(r"/sitemap-(\d+)\.xml(\.gz)?", self.path)
+            if match:
+                index = int(match.group(1))
+                # Even sitemaps carry lastmod, odd ones rely on HTTP validators
+                lastmod = "<lastmod>2024-01-01</lastmod>" if index % 2 == 0 else ""
+                urls = "".join(
+                    f"<url><loc>{self.base}/page/{p}.html</loc>{lastmod}</url>"
+                    for p in range(index * per_sitemap, min(pages, (index + 1) * per_sitemap))
+                )
+                body = ('<?xml version="1.0" encoding="UTF-8"?>'
+                        f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>')
+                if match.group(2):
+                    return self.reply(gzip.compress(body.encode("utf-8")), "application/x-gzip")
+                return self.reply(body, "application/xml")
+            match = re.fullmatch(r"/page/(\d+)\.html", self.path)
+            if match and int(match.group(1)) < pages:
+                page = int(match.group(1))
+                rng = np.random.default_rng(SEED + page)
+                paragraphs = "".join(f"<p>{corpus.paragraph(rng)}</p>" for _ in range(rng.integers(3, 9)))
+                body = (f"<html><head><title>Page {page}</title><script>var t = {page};</script></head><body>"
+                        f"{nav}<main><h1>Page {page}</h1>{paragraphs}</main>{footer}</body></html>").encode("utf-8")
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                return self.reply(body, "text/html; charset=utf-8", {"ETag": etag, "Last-Modified": modified})
+            self.reply("not found", "text/plain", status=404)
+
+        @property
+        def base(self):
+            return f"http://{self.headers.get('Host')}"
+
+        def reply(self, body, content_type, headers=None, status=200):
+            data = body if isinstance(body, bytes) else body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def serve_site(port, pages, per_sitemap):
+    server = ThreadingHTTPServer(("127.0.0.1", port), site_handler(Corpus(), pages, per_sitemap))
+    server.daemon_threads = True
+    print(f"Synthetic site listening on http://127.0.0.1:{port}/sitemap_index.xml", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+# ----------------------------------------------------------------
+# Measurement helpers
+# ----------------------------------------------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_process(args, url):
+    """Start a helper server and wait until `url` answers."""
+    process = subprocess.Popen([sys.executable, *args], cwd=HERE, stdout=subprocess.DEVNULL)
+    import requests
+    for _ in range(200):
+        try:
+            requests.get(url, timeout=1)
+            return process
+        except requests.RequestException:
+            if process.poll() is not None:
+                raise RuntimeError(f"{args[0]} exited with code {process.returncode}")
+            time.sleep(0.05)
+    process.terminate()
+    raise RuntimeError(f"{args[0]} did not start")
+
+
+def latency_summary(samples):
+    """Milliseconds: mean and p50/p95/p99 of a list of seconds."""
+    if not samples:
+        return {"n": 0}
+    ms = np.asarray(samples) * 1000
+    return {
+        "n": len(samples),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+class RssSampler:
+    """Samples the RSS of this process and its children (parser workers) in the background."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self.phase_peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self):
+        rss = self.process.memory_info().rss
+        for child in self.process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.Error:
+                pass
+        self.peak = max(self.peak, rss)
+        self.phase_peak = max(self.phase_peak, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except psutil.Error:
+                pass
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class BenchJob:
+    """Minimal stand-in for jobs.Job so job handlers can be timed directly."""
+
+    def __init__(self):
+        self.progress = {}
+
+    def update(self, stage=None, **progress):
+        self.progress.update(progress)
+
+    def is_cancelled(self):
+        return False
+
+
+# ----------------------------------------------------------------
+# Benchmark run
+# ----------------------------------------------------------------
+
+def configure_environment(workdir, ollama_url):
+    """Point every store and cache at the work directory; must run before the app modules are imported."""
+    os.environ.update({
+        "OLLAMA_BASE_URL": ollama_url,
+        "CHROMA_PATH": os.path.join(workdir, "chroma"),
+        "CATALOG_PATH": os.path.join(workdir, "chroma_catalog.sqlite3"),
+        "LEXICAL_INDEX_PATH": os.path.join(workdir, "chroma_lexical.sqlite3"),
+        "PAGE_CACHE_PATH": os.path.join(workdir, "chroma_pages.sqlite3"),
+        "NUMPY_STORE_PATH": os.path.join(workdir, "chroma_numpy"),
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+        "JOBS_DB_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "TEMP_FOLDER": os.path.join(workdir, "_temp"),
+    })
+    # Answers are not reused between timed queries, and the synthetic site may be crawled at full speed
+    os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+    os.environ.setdefault("CRAWL_RATE_PER_HOST", "100000")
+    os.environ.setdefault("CRAWL_PER_HOST_CONCURRENCY", os.environ.get("CRAWL_CONCURRENCY", "32"))
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=HERE,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit or None, dirty
+    except OSError:
+        return None, None
+
+
+def stored_chunks(catalog):
+    from catalog import GROUP_FILENAME, GROUP_DOMAIN
+    total = 0
+    for kind in (GROUP_FILENAME, GROUP_DOMAIN):
+        groups, _ = catalog.list_groups(kind)
+        total += sum(g["chunks"] for g in groups)
+    return total
+
+
+def bench_ingest(files):
+    from embed import embed_file_path
+    results = {}
+    for ext in ("md", "pdf"):
+        paths = [p for p in files if p.endswith("." + ext)]
+        if not paths:
+            continue
+        chunks, size, errors, first_error = 0, 0, 0, None
+        started = time.perf_counter()
+        for path in paths:
+            try:
+                chunks += embed_file_path(path, os.path.basename(path))["chunks"]
+                size += os.path.getsize(path)
+            except Exception as e:
+                errors += 1
+                first_error = first_error or f"{type(e).__name__}: {e}"
+        seconds = time.perf_counter() - started
+        result = {"files": len(paths) - errors, "bytes": size, "chunks": chunks, "seconds": round(seconds, 3)}
+        if chunks:
+            result["chunks_per_sec"] = round(chunks / seconds, 1)
+            result["mb_per_sec"] = round(size / seconds / 1e6, 3)
+        if errors:
+            result["errors"] = errors
+            result["error"] = first_error
+        results[ext] = result
+        print(f"  ingest {ext}: {result}")
+    return results
+
+
+def bench_sitemap(site_url):
+    import app as server
+    from rotating_user_agent import fetch_sitemap_urls
+
+    started = time.perf_counter()
+    urls = sum(1 for _ in fetch_sitemap_urls(site_url))
+    seconds = time.perf_counter() - started
+    results = {"expand": {"urls": urls, "seconds": round(seconds, 3), "urls_per_sec": round(urls / seconds, 1)}}
+
+    for name in ("crawl", "recrawl"):
+        job = BenchJob()
+        started = time.perf_counter()
+        server.run_sitemap_job(job, site_url)
+        seconds = time.perf_counter() - started
+        p = job.progress
+        result = {
+            "seconds": round(seconds, 3),
+            "pages": p.get("pages", 0),
+            "chunks": p.get("chunks", 0),
+            "pages_per_sec": round(p.get("pages", 0) / seconds, 1),
+            "chunks_per_sec": round(p.get("chunks", 0) / seconds, 1),
+        }
+        for key in ("duplicate_pages", "boilerplate_blocks", "skipped_lastmod", "skipped_not_modified",
+                    "skipped_unchanged"):
+            if key in p:
+                result[key] = p[key]
+        results[name] = result
+        print(f"  sitemap {name}: {result}")
+    return results
+
+
+def query_texts(corpus, n, seed):
+    rng = np.random.default_rng(seed)
+    texts = []
+    for i in range(n):
+        words = corpus.sentence(rng).rstrip(".").split()
+        texts.append(" ".join(words[:rng.integers(4, 9)]) + "?")
+    return texts
+
+
+def time_queries(client, texts, mode):
+    samples, failures = [], 0
+    for text in texts:
+        started = time.perf_counter()
+        response = client.post("/query", json={"query": text, "mode": mode})
+        samples.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            failures += 1
+    summary = latency_summary(samples)
+    if failures:
+        summary["failures"] = failures
+    return summary
+
+
+def time_first_tokens(client, texts):
+    samples = []
+    for text in texts:
+        started = time.perf_counter()
+        response = client.post("/query/stream", json={"query": text, "mode": "fast"}, buffered=False)
+        first = None
+        for part in response.response:
+            if first is None and b"event: token" in part:
+                first = time.perf_counter() - started
+        response.close()
+        if first is not None:
+            samples.append(first)
+    return latency_summary(samples)
+
+
+def bench_query(client, corpus, n, modes):
+    results = {}
+    # Warm up connections, the lexical index and the query executors
+    time_queries(client, query_texts(corpus, 3, SEED + 99), "fast")
+    for i, mode in enumerate(modes):
+        results[mode] = time_queries(client, query_texts(corpus, n, SEED + i), mode)
+        print(f"  query {mode}: {results[mode]}")
+    results["stream_first_token"] = time_first_tokens(client, query_texts(corpus, max(10, n // 4), SEED + 50))
+    print(f"  query stream first token: {results['stream_first_token']}")
+    return results
+
+
+def seed_chunks(db, corpus, target, catalog, chunks_per_source=10, sources_per_domain=100, batch_sources=200):
+    """
+    Grow the store to `target` chunks with synthetic scraped pages through
+    the normal upsert path. Returns the ingest rate in chunks/sec, or None
+    if the store was already that large.
+    """
+    from embed import upsert_sources, content_hash
+    from langchain.schema import Document
+
+    have = stored_chunks(catalog)
+    # Every earlier source has at least one chunk, so numbering from `have` never reuses a URL
+    source = have
+    rng = np.random.default_rng(SEED + have)
+    paragraphs = [corpus.paragraph(rng)[:700] for _ in range(2000)]
+    added = 0
+    started = time.perf_counter()
+    while have < target:
+        batch = []
+        missing = target - have
+        # The last batch is cut to size, so the store ends at exactly `target` chunks
+        for _ in range(min(batch_sources, math.ceil(missing / chunks_per_source))):
+            domain = f"seed{source // sources_per_domain}.bench"
+            url = f"https://{domain}/p{source}"
+            picks = rng.integers(len(paragraphs), size=min(chunks_per_source, missing))
+            missing -= len(picks)
+            chunks = [
+                Document(page_content=f"{url} part {i}: {paragraphs[p]}", metadata={"url": url, "domain": domain})
+                for i, p in enumerate(picks)
+            ]
+            batch.append(("url", url, content_hash(url), chunks))
+            source += 1
+        written = upsert_sources(db, batch)["chunks"]
+        have += written
+        added += written
+        print(f"\r  seeding: {have}/{target} chunks ({added / (time.perf_counter() - started):.0f}/s)   ",
+              end="", flush=True)
+    if not added:
+        return None
+    print()
+    return round(added / (time.perf_counter() - started), 1)
+
+
+def bench_scale(client, corpus, sizes, queries, list_requests):
+    from catalog import get_catalog
+    from get_vector_db import get_vector_db
+    catalog = get_catalog()
+    db = get_vector_db()
+    results = []
+    for size in sizes:
+        seed_rate = seed_chunks(db, corpus, size, catalog)
+        listing, page = [], []
+        for _ in range(list_requests):
+            started = time.perf_counter()
+            client.get("/list_documents")
+            listing.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            client.get("/list_documents?limit=50&offset=0")
+            page.append(time.perf_counter() - started)
+        result = {
+            "chunks": stored_chunks(catalog),
+            "seed_chunks_per_sec": seed_rate,
+            "list_documents": latency_summary(listing),
+            "list_documents_page": latency_summary(page),
+            "query_fast": time_queries(client, query_texts(corpus, queries, SEED + size), "fast"),
+        }
+        results.append(result)
+        print(f"  scale {size}: {result}")
+    return results
+
+
+@contextmanager
+def phase(results, name, sampler):
+    sampler.phase_peak = 0
+    sampler.sample()
+    started = time.perf_counter()
+    print(f"[{name}]")
+    yield
+    sampler.sample()
+    results["phases"][name] = {
+        "seconds": round(time.perf_counter() - started, 3),
+        "peak_rss_mb": round(sampler.phase_peak / 2 ** 20, 1),
+    }
+
+
+def run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    ollama_port, site_port = free_port(), free_port()
+    ollama_url = f"http://127.0.0.1:{ollama_port}"
+    site_url = f"http://127.0.0.1:{site_port}/sitemap_index.xml"
+    helpers = []
+    sampler = RssSampler()
+    try:
+        helpers.append(start_process([
+            "fake_ollama.py", "--port", str(ollama_port), "--dim", str(args.dim),
+            "--first-token-latency", str(args.first_token_latency), "--tokens-per-sec", str(args.tokens_per_sec),
+            "--answer-tokens", str(args.answer_tokens), "--embed-latency", str(args.embed_latency),
+        ], f"{ollama_url}/api/version"))
+        if args.site_pages:
+            helpers.append(start_process([
+                os.path.basename(__file__), "serve-site", "--port", str(site_port),
+                "--pages", str(args.site_pages), "--per-sitemap", str(args.per_sitemap),
+            ], site_url))
+        configure_environment(workdir, ollama_url)
+
+        commit, dirty = git_revision()
+        results = {
+            "schema": 1,
+            "meta": {
+                "commit": commit, "dirty": dirty,
+                "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": platform.python_version(), "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "args": {k: v for k, v in vars(args).items() if k not in ("command", "func")},
+                "settings": {k: os.environ[k] for k in SETTINGS if k in os.environ},
+            },
+            "phases": {},
+        }
+        sampler.start()
+        corpus = Corpus()
+
+        with phase(results, "startup", sampler):
+            import app as server
+            client = server.app.test_client()
+        if args.md_files or args.pdf_files:
+            files = generate_files(os.path.join(workdir, "corpus"), corpus, args.md_files, args.pdf_files,
+                                   args.max_file_kb)
+            with phase(results, "ingest", sampler):
+                results["ingest"] = bench_ingest(files)
+        if args.site_pages:
+            with phase(results, "sitemap", sampler):
+                results["sitemap"] = bench_sitemap(site_url)
+        if args.queries:
+            with phase(results, "query", sampler):
+                results["query"] = bench_query(client, corpus, args.queries, args.modes)
+        if args.list_sizes:
+            with phase(results, "scale", sampler):
+                results["scale"] = bench_scale(client, corpus, args.list_sizes, max(10, args.queries // 5),
+                                               args.list_requests)
+
+        sampler.sample()
+        results["peak_rss_mb"] = round(sampler.peak / 2 ** 20, 1)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output} (peak RSS {results['peak_rss_mb']} MB)")
+    finally:
+        sampler.stop()
+        for process in helpers:
+            process.terminate()
+        try:
+            from get_vector_db import close_clients
+            close_clients()
+        except Exception:
+            pass
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+# ----------------------------------------------------------------
+# Comparing runs
+# ----------------------------------------------------------------
+
+def flatten(node, prefix=""):
+    """{"a": {"b": 1}, "scale": [{"chunks": 10, ...}]} -> {"a.b": 1, "scale[10]....": ...}"""
+    flat = {}
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key in ("meta", "schema"):
+                continue
+            flat.update(flatten(value, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(node, list):
+        for i, item in enumerate(node):
+            label = item.get("chunks", i) if isinstance(item, dict) else i
+            flat.update(flatten(item, f"{prefix}[{label}]"))
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        flat[prefix] = node
+    return flat
+
+
+def compare(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(f"old: {old['meta'].get('commit')}  {old['meta'].get('timestamp')}")
+    print(f"new: {new['meta'].get('commit')}  {new['meta'].get('timestamp')}")
+    a, b = flatten(old), flatten(new)
+    width = max((len(k) for k in a.keys() | b.keys()), default=10)
+    for key in sorted(a.keys() | b.keys()):
+        before, after = a.get(key), b.get(key)
+        if before is None or after is None:
+            print(f"{key:<{width}}  {before!s:>12}  {after!s:>12}")
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        verdict = ""
+        if abs(change) >= args.threshold and not COUNTS.search(key):
+            better = change > 0 if HIGHER_IS_BETTER.search(key) else change < 0
+            verdict = "better" if better else "WORSE"
+        print(f"{key:<{width}}  {before:>12.6g}  {after:>12.6g}  {change:+7.1f}%  {verdict}")
+
+
+def sizes(value):
+    return [int(float(v)) for v in value.split(",") if v.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline performance benchmark.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmark and write JSON results")
+    run_parser.add_argument("--output", default="benchmark.json")
+    run_parser.add_argument("--workdir", help="keep stores here instead of a temporary directory")
+    run_parser.add_argument("--keep", action="store_true", help="do not delete the temporary directory")
+    run_parser.add_argument("--md-files", type=int, default=40)
+    run_parser.add_argument("--pdf-files", type=int, default=8)
+    run_parser.add_argument("--max-file-kb", type=int, default=512)
+    run_parser.add_argument("--site-pages", type=int, default=2000, help="pages on the synthetic site (0 = skip)")
+    run_parser.add_argument("--per-sitemap", type=int, default=500, help="URLs per sub-sitemap")
+    run_parser.add_argument("--queries", type=int, default=100, help="timed /query calls per mode")
+    run_parser.add_argument("--modes", type=lambda v: v.split(","), default=["fast", "auto", "multi"])
+    run_parser.add_argument("--list-sizes", type=sizes, default=[10000, 100000],
+                            help="store sizes in chunks for the scale phase, e.g. 10000,100000,1000000")
+    run_parser.add_argument("--list-requests", type=int, default=30)
+    run_parser.add_argument("--dim", type=int, default=768, help="fake embedding dimension")
+    run_parser.add_argument("--first-token-latency", type=float, default=0.05)
+    run_parser.add_argument("--tokens-per-sec", type=float, default=500.0)
+    run_parser.add_argument("--answer-tokens", type=int, default=32)
+    run_parser.add_argument("--embed-latency", type=float, default=0.0)
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="show the change of every metric between two runs")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=5.0, help="percent change worth flagging")
+    compare_parser.set_defaults(func=compare)
+
+    site_parser = commands.add_parser("serve-site", help="serve the synthetic website (used by run)")
+    site_parser.add_argument("--port", type=int, required=True)
+    site_parser.add_argument("--pages", type=int, default=2000)
+    site_parser.add_argument("--per-sitemap", type=int, default=500)
+    site_parser.set_defaults(func=lambda a: serve_site(a.port, a.pages, a.per_sitemap))
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,208 @@
+import os
+import re
+import hashlib
+from collections import namedtuple
+from urllib.parse import urlparse
+
+import numpy as np
+
+PAGE_DEDUP_ENABLED = os.getenv('PAGE_DEDUP_ENABLED', 'true').lower() == 'true'
+BOILERPLATE_WARMUP_PAGES = int(os.getenv('BOILERPLATE_WARMUP_PAGES', '20'))  # pages per domain held back to learn its template
+BOILERPLATE_MIN_PAGES = int(os.getenv('BOILERPLATE_MIN_PAGES', '3'))
+BOILERPLATE_MIN_SHARE = float(os.getenv('BOILERPLATE_MIN_SHARE', '0.3'))  # share of a domain's pages a template block is on
+NEAR_DUPLICATE_BITS = 3  # SimHash Hamming distance; the 4-band index finds anything up to 3
+MAX_TRACKED_BLOCKS = int(os.getenv('MAX_TRACKED_BLOCKS', '200000'))  # per domain
+
+_WORD = re.compile(r"\w+")
+
+# The content PageDeduplicator gives a page dropped as a near-duplicate of the page at `original`
+DuplicatePage = namedtuple("DuplicatePage", "original")
+_YEAR = re.compile(r"\b(?:19|20)\d\d\b")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_blocks(text):
+    """Lines of an extracted page; older single-line scrapes fall back to sentences."""
+    blocks = [line.strip() for line in text.splitlines() if line.strip()]
+    if len(blocks) <= 1:
+        blocks = [s.strip() for s in _SENTENCE.split(text) if s.strip()]
+    return blocks
+
+
+def simhash(features):
+    """64-bit SimHash of a list of string features."""
+    if not features:
+        return 0
+    digests = b"".join(hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest() for f in features)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(len(features), 64)
+    majority = bits.sum(axis=0) * 2 > len(features)
+    return int.from_bytes(np.packbits(majority).tobytes(), "big")
+
+
+def block_fingerprint(block):
+    # Years are masked so "(c) 2023" and "(c) 2024" footers match
+    words = _WORD.findall(_YEAR.sub("0", block.lower()))
+    return simhash(words + [" ".join(pair) for pair in zip(words, words[1:])])
+
+
+def page_fingerprint(text):
+    words = _WORD.findall(text.lower())
+    return simhash([" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))])
+
+
+class SimHashIndex:
+    """
+    Finds a stored fingerprint within NEAR_DUPLICATE_BITS of a new one.
+    Fingerprints are bucketed by four 16-bit bands: two fingerprints that
+    differ in at most 3 bits agree on at least one band, so only that
+    band's bucket needs checking.
+    """
+
+    def __init__(self):
+        self.bands = [{} for _ in range(4)]
+
+    def find(self, fingerprint):
+        for i, band in enumerate(self.bands):
+            for candidate in band.get((fingerprint >> (16 * i)) & 0xFFFF, ()):
+                if bin(candidate ^ fingerprint).count("1") <= NEAR_DUPLICATE_BITS:
+                    return candidate
+        return None
+
+    def add(self, fingerprint):
+        for i, band in enumerate(self.bands):
+            band.setdefault((fingerprint >> (16 * i)) & 0xFFFF, []).append(fingerprint)
+
+
+class DomainState:
+    def __init__(self, templates=()):
+        self.pages = 0
+        self.blocks = SimHashIndex()
+        self.block_pages = {}  # canonical block fingerprint -> pages it appeared on
+        self.seen_pages = SimHashIndex()
+        self.page_urls = {}  # page fingerprint -> URL of the page kept with it
+        self.pending = []
+        # Template blocks learned by earlier crawls: stripped however few pages this crawl sees
+        self.templates = set(templates)
+        for fp in self.templates:
+            self.blocks.add(fp)
+            self.block_pages[fp] = 0
+
+    def canonical(self, fingerprint):
+        match = self.blocks.find(fingerprint)
+        if match is None:
+            self.blocks.add(fingerprint)
+            self.block_pages[fingerprint] = 0
+            return fingerprint
+        return match
+
+    def prune(self):
+        """Forget blocks seen on a single page once the domain tracks too many."""
+        pending = {c for _, _, canon in self.pending for c in canon}
+        self.block_pages = {
+            fp: n for fp, n in self.block_pages.items() if n > 1 or fp in pending or fp in self.templates
+        }
+        self.blocks = SimHashIndex()
+        for fp in self.block_pages:
+            self.blocks.add(fp)
+
+    def threshold(self):
+        return max(BOILERPLATE_MIN_PAGES, BOILERPLATE_MIN_SHARE * self.pages)
+
+    def is_template(self, fp):
+        return fp in self.templates or self.block_pages.get(fp, 1) >= self.threshold()
+
+    def learned_templates(self):
+        """Blocks this crawl counted as template, to seed the next crawl of the domain."""
+        threshold = self.threshold()
+        return {fp for fp, n in self.block_pages.items() if n >= threshold}
+
+
+class PageDeduplicator:
+    """
+    Per-domain cleaning of scraped pages before chunking.
+
+    Every text block (line) of a page is fingerprinted with SimHash and
+    near-identical blocks are counted once per page. Blocks found on at
+    least BOILERPLATE_MIN_PAGES pages and BOILERPLATE_MIN_SHARE of the
+    domain's pages (menus, cookie banners, footers) are stripped. Pages
+    whose remaining text is a near-duplicate of a page already kept are
+    dropped.
+
+    The first BOILERPLATE_WARMUP_PAGES pages of a domain are held back
+    until its template has been learned; flush() releases whatever is
+    still held at the end of a crawl.
+
+    With a `template_store` (page_cache.PageCache), the template blocks
+    learned for a domain are saved by flush() and loaded when the domain is
+    next crawled. A recrawl that only passes the few pages that changed
+    then strips the template at once, without a warm-up.
+    """
+
+    def __init__(self, template_store=None):
+        self.domains = {}
+        self.template_store = template_store
+        self.stats = {"duplicate_pages": 0, "boilerplate_blocks": 0, "boilerplate_chars": 0}
+
+    def _domain(self, domain):
+        state = self.domains.get(domain)
+        if state is None:
+            templates = self.template_store.boilerplate(domain) if self.template_store is not None else ()
+            state = self.domains[domain] = DomainState(templates)
+        return state
+
+    def feed(self, url, content):
+        """
+        Take one page; return the pages that are ready to ingest as (url,
+        cleaned content) pairs. The content is a DuplicatePage for a page
+        dropped as a near-duplicate: whatever it stored before should go.
+        """
+        state = self._domain(urlparse(url).netloc)
+        blocks = split_blocks(content)
+        canon = [state.canonical(block_fingerprint(b)) for b in blocks]
+        for fp in set(canon):
+            state.block_pages[fp] += 1
+        state.pages += 1
+        if len(state.block_pages) > MAX_TRACKED_BLOCKS:
+            state.prune()
+
+        if state.pages <= BOILERPLATE_WARMUP_PAGES and not state.templates:
+            state.pending.append((url, blocks, canon))
+            return self._release(state) if state.pages == BOILERPLATE_WARMUP_PAGES else []
+        return self._finish(state, url, blocks, canon)
+
+    def flush(self):
+        ready = []
+        for domain, state in self.domains.items():
+            ready.extend(self._release(state))
+            if self.template_store is not None:
+                # A crawl that saw enough pages learned the whole template; a smaller one only adds to it
+                self.template_store.store_boilerplate(
+                    domain, state.learned_templates(), replace=state.pages >= BOILERPLATE_WARMUP_PAGES
+                )
+        return ready
+
+    def _release(self, state):
+        pending, state.pending = state.pending, []
+        ready = []
+        for url, blocks, canon in pending:
+            ready.extend(self._finish(state, url, blocks, canon))
+        return ready
+
+    def _finish(self, state, url, blocks, canon):
+        kept = []
+        for block, fp in zip(blocks, canon):
+            if state.is_template(fp):
+                self.stats["boilerplate_blocks"] += 1
+                self.stats["boilerplate_chars"] += len(block)
+            else:
+                kept.append(block)
+        text = "\n".join(kept)
+        if text:
+            fingerprint = page_fingerprint(text)
+            match = state.seen_pages.find(fingerprint)
+            if match is not None:
+                self.stats["duplicate_pages"] += 1
+                return [(url, DuplicatePage(state.page_urls[match]))]
+            state.seen_pages.add(fingerprint)
+            state.page_urls[fingerprint] = url
+        return [(url, text)]
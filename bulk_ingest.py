@@ -0,0 +1,357 @@
+"""
+Load a directory tree or zip / tar archive of documents into the store.
+
+    python bulk_ingest.py PATH [PATH ...] [--workers 8] [--batch-chunks 1024] [--force]
+
+Every pdf, docx, txt and md file (ALLOWED_EXTENSIONS) is parsed and split
+exactly as an upload to /embed would be, several files at a time, and the
+chunks are embedded and written in large batches. Files are named by their
+path inside the directory or archive, prefixed with its name
+("docs/guides/setup.md", "corpus.zip/guides/setup.md"); that name is the
+document's filename in the store.
+
+A manifest (BULK_MANIFEST_PATH) records the size, modification time and
+hash of every file once its chunks are committed. Running the same command
+again skips files that have not changed, so an interrupted run simply
+resumes, and files that failed to parse are retried.
+"""
+import os
+import sys
+import time
+import sqlite3
+import tarfile
+import zipfile
+import argparse
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from werkzeug.utils import secure_filename
+
+from embed import (
+    allowed_file, file_extension, content_hash, file_hash, decode_text, split_text_content,
+    load_chunks, spool_to_temp, upsert_sources, parser_pool, TEXT_EXTENSIONS, PARSE_WORKERS
+)
+from get_vector_db import get_vector_db, close_clients, CHROMA_PATH
+
+BULK_MANIFEST_PATH = os.getenv('BULK_MANIFEST_PATH', CHROMA_PATH.rstrip('/\\') + '_bulk.sqlite3')
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+# open() returns a readable binary stream; path is set for files that are already on disk
+Entry = namedtuple("Entry", "name size mtime path open")
+ManifestRow = namedtuple("ManifestRow", "size mtime sha256 status")
+
+
+class IngestManifest:
+    """Per-file state of bulk ingestion, in an SQLite file next to CHROMA_PATH."""
+
+    def __init__(self, path=BULK_MANIFEST_PATH):
+        self._lock = threading.Lock()
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " name TEXT PRIMARY KEY, size INTEGER, mtime REAL, sha256 TEXT,"
+                " chunks INTEGER, status TEXT NOT NULL, error TEXT, updated_at REAL NOT NULL)"
+            )
+
+    def load(self):
+        """name -> ManifestRow for every file seen before."""
+        with self._lock:
+            rows = self._conn.execute("SELECT name, size, mtime, sha256, status FROM files").fetchall()
+        return {name: ManifestRow(size, mtime, sha256, status) for name, size, mtime, sha256, status in rows}
+
+    def mark_done(self, items):
+        """items: (entry, sha256, chunk count) of files whose chunks are committed."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files (name, size, mtime, sha256, chunks, status, error, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, 'done', NULL, ?)",
+                [(entry.name, entry.size, entry.mtime, digest, chunks, now) for entry, digest, chunks in items]
+            )
+
+    def touch(self, entry):
+        """Record the new size and mtime of a done file whose content turned out unchanged."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE files SET size = ?, mtime = ?, updated_at = ? WHERE name = ?",
+                (entry.size, entry.mtime, time.time(), entry.name)
+            )
+
+    def mark_failed(self, entry, error):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (name, size, mtime, sha256, chunks, status, error, updated_at)"
+                " VALUES (?, ?, ?, NULL, 0, 'failed', ?, ?)",
+                (entry.name, entry.size, entry.mtime, error, time.time())
+            )
+
+    def close(self):
+        self._conn.close()
+
+
+def is_archive(path):
+    return os.path.isfile(path) and path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def wanted(name):
+    # Skip hidden files and the resource forks macOS adds to archives
+    parts = name.split("/")
+    return allowed_file(parts[-1]) and not any(p.startswith(".") or p == "__MACOSX" for p in parts)
+
+
+def iter_directory(root, prefix):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            name = os.path.relpath(path, root).replace(os.sep, "/")
+            if wanted(name):
+                st = os.stat(path)
+                yield Entry(f"{prefix}/{name}", st.st_size, st.st_mtime, path, lambda path=path: open(path, "rb"))
+
+
+def member_name(name):
+    """An archive member's path relative to the archive root: "./a.md" and "/a.md" become "a.md"."""
+    parts = name.replace("\\", "/").split("/")
+    while parts and parts[0] in ("", "."):
+        parts.pop(0)
+    return "/".join(parts)
+
+
+def iter_zip(archive, prefix):
+    for info in archive.infolist():
+        name = member_name(info.filename)
+        if info.is_dir() or not wanted(name):
+            continue
+        mtime = time.mktime(info.date_time + (0, 0, -1))
+        yield Entry(f"{prefix}/{name}", info.file_size, mtime, None,
+                    lambda info=info: archive.open(info))
+
+
+def iter_tar(archive, prefix):
+    for member in archive.getmembers():
+        name = member_name(member.name)
+        if not member.isfile() or not wanted(name):
+            continue
+        yield Entry(f"{prefix}/{name}", member.size, float(member.mtime), None,
+                    lambda member=member: archive.extractfile(member))
+
+
+def collect_entries(paths, archives):
+    """
+    Every ingestible file under `paths`; opened archives are appended to
+    `archives`. A file whose name is already taken by an earlier one (two
+    directories or archives with the same basename, two loose files with the
+    same name) is reported and skipped, since it would replace the other's
+    chunks in the store.
+    """
+    entries = []
+    origins = {}
+    for path in paths:
+        # abspath: "." and "docs/" still get a name
+        prefix = os.path.basename(os.path.abspath(path))
+        if os.path.isdir(path):
+            found = iter_directory(path, prefix)
+        elif is_archive(path):
+            if path.lower().endswith(".zip"):
+                archive = zipfile.ZipFile(path)
+                archives.append(archive)
+                found = iter_zip(archive, prefix)
+            else:
+                archive = tarfile.open(path)
+                archives.append(archive)
+                found = iter_tar(archive, prefix)
+        elif os.path.isfile(path) and wanted(prefix):
+            st = os.stat(path)
+            found = [Entry(prefix, st.st_size, st.st_mtime, path, lambda path=path: open(path, "rb"))]
+        else:
+            print(f"Skipping {path}: not a directory, a zip/tar archive or a pdf/docx/txt/md file")
+            continue
+        for entry in found:
+            if entry.name in origins:
+                print(f"Skipping {entry.name} from {path}: {origins[entry.name]} already has a file of that name")
+                continue
+            origins[entry.name] = path
+            entries.append(entry)
+    return entries
+
+
+def is_unchanged(entry, row):
+    """True when the manifest row shows `entry` committed with the same size and mtime."""
+    return row is not None and row.status == "done" and row.size == entry.size and row.mtime == entry.mtime
+
+
+def materialize(entry):
+    """
+    What a parse worker needs for an entry: the file on disk, its bytes for
+    a txt/md archive member, or a temp copy of any other archive member.
+    Returns (path, data, is_temp). Archive members are read here, in order,
+    because tar archives are sequential and not safe to share between threads.
+    """
+    if entry.path:
+        return entry.path, None, False
+    with entry.open() as stream:
+        if file_extension(entry.name) in TEXT_EXTENSIONS:
+            return None, stream.read(), False
+        return spool_to_temp(stream, secure_filename(os.path.basename(entry.name))), None, True
+
+
+def prepare(entry, path, data, is_temp, known_hash):
+    """Hash and parse one file; returns (sha256, chunks), chunks None when the hash is unchanged."""
+    try:
+        digest = content_hash(data) if data is not None else file_hash(path)
+        if digest == known_hash:
+            return digest, None
+        if data is not None:
+            return digest, split_text_content(decode_text(data), entry.name)
+        return digest, load_chunks(path, entry.name)
+    finally:
+        if is_temp and os.path.exists(path):
+            os.remove(path)
+
+
+class Progress:
+    """Prints counts, throughput and an ETA at most every `interval` seconds."""
+
+    def __init__(self, total, interval):
+        self.total = total
+        self.interval = interval
+        self.started = time.monotonic()
+        self.last = self.started
+        self.files = self.unchanged = self.failed = self.chunks = 0
+
+    def maybe_report(self):
+        if time.monotonic() - self.last >= self.interval:
+            self.report()
+
+    def report(self, final=False):
+        self.last = time.monotonic()
+        elapsed = max(self.last - self.started, 1e-9)
+        handled = self.files + self.unchanged + self.failed
+        rate = handled / elapsed
+        eta = (self.total - handled) / rate if rate and not final else 0
+        print(
+            f"{'Done' if final else 'Progress'}: {handled}/{self.total} files "
+            f"({self.files} ingested, {self.unchanged} unchanged, {self.failed} failed), "
+            f"{self.chunks} chunks in {elapsed:.0f}s, {rate:.1f} files/s, {self.chunks / elapsed:.1f} chunks/s"
+            + (f", ETA {eta / 60:.0f} min" if eta >= 120 else f", ETA {eta:.0f}s" if eta else ""),
+            flush=True
+        )
+
+
+def ingest(paths, workers=PARSE_WORKERS, batch_chunks=1024, force=False, manifest_path=BULK_MANIFEST_PATH,
+           progress_interval=10.0):
+    """Ingest everything under `paths`; returns the Progress counters."""
+    archives = []
+    manifest = IngestManifest(manifest_path)
+    try:
+        entries = collect_entries(paths, archives)
+        seen = {} if force else manifest.load()
+        todo = []
+        skipped = 0
+        for entry in entries:
+            if is_unchanged(entry, seen.get(entry.name)):
+                skipped += 1
+            else:
+                todo.append(entry)
+        print(f"{len(entries)} files found, {skipped} unchanged since the last run, {len(todo)} to check")
+
+        progress = Progress(len(todo), progress_interval)
+        db = get_vector_db()
+        batch, batch_size = [], 0
+
+        def flush():
+            nonlocal batch, batch_size
+            if not batch:
+                return
+            upsert_sources(db, [("filename", entry.name, digest, chunks) for entry, digest, chunks in batch])
+            db.persist()
+            manifest.mark_done([(entry, digest, len(chunks)) for entry, digest, chunks in batch])
+            progress.files += len(batch)
+            progress.chunks += batch_size
+            batch, batch_size = [], 0
+
+        def collect(future, entry):
+            nonlocal batch_size
+            try:
+                digest, chunks = future.result()
+            except Exception as e:
+                print(f"Failed to ingest {entry.name}: {e}")
+                manifest.mark_failed(entry, str(e))
+                progress.failed += 1
+                return
+            if chunks is None:
+                manifest.touch(entry)
+                progress.unchanged += 1
+                return
+            batch.append((entry, digest, chunks))
+            batch_size += len(chunks)
+            if batch_size >= batch_chunks:
+                flush()
+
+        workers = max(1, workers)
+        pending = {}
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk-parse") as pool:
+            try:
+                for entry in todo:
+                    # A small window keeps parsed-but-unwritten chunks (and temp files) bounded
+                    while len(pending) >= workers * 2:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            collect(future, pending.pop(future))
+                        progress.maybe_report()
+                    row = seen.get(entry.name)
+                    known_hash = row.sha256 if row and row.status == "done" else None
+                    try:
+                        path, data, is_temp = materialize(entry)
+                    except Exception as e:
+                        print(f"Failed to read {entry.name}: {e}")
+                        manifest.mark_failed(entry, str(e))
+                        progress.failed += 1
+                        continue
+                    pending[pool.submit(prepare, entry, path, data, is_temp, known_hash)] = entry
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future, pending.pop(future))
+                    progress.maybe_report()
+                flush()
+            except KeyboardInterrupt:
+                for future in pending:
+                    future.cancel()
+                print("Interrupted; files committed so far are in the manifest, run again to resume")
+                raise
+        progress.report(final=True)
+        return progress
+    finally:
+        for archive in archives:
+            archive.close()
+        manifest.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest a directory tree or zip/tar archive of documents.")
+    parser.add_argument("paths", nargs="+", help="directories, archives (.zip, .tar, .tar.gz, ...) or files")
+    parser.add_argument("--workers", type=int, default=max(1, PARSE_WORKERS), help="files parsed at once")
+    parser.add_argument("--batch-chunks", type=int, default=1024, help="chunks embedded and written per batch")
+    parser.add_argument("--force", action="store_true", help="ignore the manifest and re-check every file")
+    parser.add_argument("--manifest", default=BULK_MANIFEST_PATH, help="manifest SQLite file")
+    parser.add_argument("--progress-every", type=float, default=10.0, help="seconds between progress lines")
+    args = parser.parse_args()
+    try:
+        result = ingest(args.paths, workers=args.workers, batch_chunks=args.batch_chunks, force=args.force,
+                        manifest_path=args.manifest, progress_interval=args.progress_every)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    finally:
+        parser_pool.shutdown()
+        close_clients()
+    sys.exit(1 if result.failed else 0)
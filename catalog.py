@@ -0,0 +1,259 @@
+import os
+import time
+import sqlite3
+import threading
+from urllib.parse import urlparse
+
+from get_vector_db import get_vector_db, CHROMA_PATH, TEXT_EMBEDDING_MODEL
+
+CATALOG_PATH = os.getenv('CATALOG_PATH', CHROMA_PATH.rstrip('/\\') + '_catalog.sqlite3')
+
+GROUP_FILENAME = "filename"
+GROUP_DOMAIN = "domain"
+
+
+def source_group(key_field, key_value, chunks):
+    """Which /list_documents entry a source belongs to: its filename, or its page's domain."""
+    if key_field == "filename":
+        return GROUP_FILENAME, key_value
+    for c in chunks:
+        if c.metadata.get("domain"):
+            return GROUP_DOMAIN, c.metadata["domain"]
+    return GROUP_DOMAIN, urlparse(key_value).netloc
+
+
+class Catalog:
+    """
+    Materialized index of what is in the vector store, kept in a SQLite file
+    next to CHROMA_PATH so /list_documents never has to scan the collection.
+
+    `sources` has one row per ingested source (file or page URL); `groups`
+    holds the per-filename / per-domain totals served to clients and is
+    maintained from deltas in the same transaction. `version` is bumped on
+    every write and doubles as the listing's ETag.
+
+    A page dropped as a near-duplicate keeps a `sources` row, with no chunks
+    and `duplicate_of` set, so recrawls know when it was last seen. Such
+    rows are left out of the group totals.
+    """
+
+    def __init__(self, path=CATALOG_PATH, model=TEXT_EMBEDDING_MODEL):
+        self.model = model
+        self._lock = threading.Lock()
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sources ("
+                " key_field TEXT NOT NULL, key_value TEXT NOT NULL,"
+                " group_kind TEXT NOT NULL, group_name TEXT NOT NULL,"
+                " chunk_count INTEGER NOT NULL, byte_size INTEGER NOT NULL,"
+                " source_hash TEXT, embedding_model TEXT, ingested_at REAL NOT NULL,"
+                " duplicate_of TEXT, PRIMARY KEY (key_field, key_value))"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sources)")}
+            if "duplicate_of" not in columns:
+                self._conn.execute("ALTER TABLE sources ADD COLUMN duplicate_of TEXT")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS groups ("
+                " group_kind TEXT NOT NULL, group_name TEXT NOT NULL,"
+                " source_count INTEGER NOT NULL, chunk_count INTEGER NOT NULL,"
+                " byte_size INTEGER NOT NULL, embedding_model TEXT, last_ingested REAL NOT NULL,"
+                " PRIMARY KEY (group_kind, group_name))"
+            )
+            if "duplicate_of" not in columns:
+                # Older catalogs stored dropped duplicates as counted 0-chunk pages;
+                # their original is unknown, so mark them with '' and recount
+                self._conn.execute(
+                    "UPDATE sources SET duplicate_of = '' WHERE key_field = 'url' AND chunk_count = 0"
+                )
+                self._conn.execute("DELETE FROM groups")
+                self._conn.execute(
+                    "INSERT INTO groups (group_kind, group_name, source_count, chunk_count, byte_size,"
+                    " embedding_model, last_ingested)"
+                    " SELECT group_kind, group_name, COUNT(*), SUM(chunk_count), SUM(byte_size),"
+                    " MAX(embedding_model), MAX(ingested_at)"
+                    " FROM sources WHERE duplicate_of IS NULL GROUP BY group_kind, group_name"
+                )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', '0')")
+
+    def record(self, entries):
+        """
+        Apply a batch of ingested sources in one transaction. Each entry is
+        (key_field, key_value, group_kind, group_name, chunk_count, byte_size, source_hash).
+        """
+        if not entries:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            for key_field, key_value, group_kind, group_name, chunks, size, digest in entries:
+                self._forget_counted(key_field, key_value, now)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sources (key_field, key_value, group_kind, group_name,"
+                    " chunk_count, byte_size, source_hash, embedding_model, ingested_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key_field, key_value, group_kind, group_name, chunks, size, digest, self.model, now)
+                )
+                self._apply_group_delta(group_kind, group_name, 1, chunks, size, now)
+            self._conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'")
+
+    def record_duplicates(self, entries):
+        """
+        Record sources dropped as near-duplicates, in one transaction. Each
+        entry is (key_field, key_value, group_kind, group_name, duplicate_of).
+        Their chunks must already be gone from the store.
+        """
+        if not entries:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            for key_field, key_value, group_kind, group_name, duplicate_of in entries:
+                self._forget_counted(key_field, key_value, now)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sources (key_field, key_value, group_kind, group_name,"
+                    " chunk_count, byte_size, source_hash, embedding_model, ingested_at, duplicate_of)"
+                    " VALUES (?, ?, ?, ?, 0, 0, NULL, ?, ?, ?)",
+                    (key_field, key_value, group_kind, group_name, self.model, now, duplicate_of)
+                )
+            self._conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'")
+
+    def _forget_counted(self, key_field, key_value, now):
+        """Take a source's previous version out of its group's totals, if it was counted there."""
+        old = self._conn.execute(
+            "SELECT group_kind, group_name, chunk_count, byte_size FROM sources"
+            " WHERE key_field = ? AND key_value = ? AND duplicate_of IS NULL", (key_field, key_value)
+        ).fetchone()
+        if old:
+            self._apply_group_delta(old[0], old[1], -1, -old[2], -old[3], now)
+
+    def touch(self, keys):
+        """
+        Mark (key_field, key_value) sources that were re-checked and found
+        unchanged as current, so incremental recrawls can skip them.
+        """
+        if not keys:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE sources SET ingested_at = ? WHERE key_field = ? AND key_value = ?",
+                [(now, key_field, key_value) for key_field, key_value in keys]
+            )
+
+    def _apply_group_delta(self, group_kind, group_name, sources, chunks, size, now):
+        self._conn.execute(
+            "INSERT INTO groups (group_kind, group_name, source_count, chunk_count, byte_size,"
+            " embedding_model, last_ingested) VALUES (?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (group_kind, group_name) DO UPDATE SET"
+            " source_count = source_count + excluded.source_count,"
+            " chunk_count = chunk_count + excluded.chunk_count,"
+            " byte_size = byte_size + excluded.byte_size,"
+            " embedding_model = excluded.embedding_model,"
+            " last_ingested = MAX(last_ingested, excluded.last_ingested)",
+            (group_kind, group_name, sources, chunks, size, self.model, now)
+        )
+        self._conn.execute(
+            "DELETE FROM groups WHERE group_kind = ? AND group_name = ? AND source_count <= 0",
+            (group_kind, group_name)
+        )
+
+    def list_groups(self, group_kind, limit=None, offset=0):
+        """Return (page of group dicts ordered by name, total number of groups)."""
+        with self._lock:
+            total = self._conn.execute(
+                "SELECT COUNT(*) FROM groups WHERE group_kind = ?", (group_kind,)
+            ).fetchone()[0]
+            rows = self._conn.execute(
+                "SELECT group_name, source_count, chunk_count, byte_size, embedding_model, last_ingested"
+                " FROM groups WHERE group_kind = ? ORDER BY group_name LIMIT ? OFFSET ?",
+                (group_kind, -1 if limit is None else limit, offset)
+            ).fetchall()
+        return [
+            {
+                "name": name, "sources": sources, "chunks": chunks, "bytes": size,
+                "embedding_model": model, "last_ingested": ingested,
+            }
+            for name, sources, chunks, size, model, ingested in rows
+        ], total
+
+    def version(self):
+        with self._lock:
+            return int(self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0])
+
+    def group_version(self, group_kind, group_name):
+        """Last ingest time of a filename/domain, or None if it is not in the store."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_ingested FROM groups WHERE group_kind = ? AND group_name = ?",
+                (group_kind, group_name)
+            ).fetchone()
+        return row[0] if row else None
+
+    def ingested_at(self, key_field, key_value):
+        """When a source was last ingested (or confirmed unchanged), or None if it is not in the store."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT ingested_at FROM sources WHERE key_field = ? AND key_value = ?",
+                (key_field, key_value)
+            ).fetchone()
+        return row[0] if row else None
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM sources LIMIT 1").fetchone() is None
+
+    def rebuild(self, db, page_size=5000):
+        """
+        Recreate the catalog from the collection's metadata, one page at a
+        time. Only needed for stores that predate the catalog.
+        """
+        totals = {}
+        offset = 0
+        while True:
+            page = db.get(include=["metadatas", "documents"], limit=page_size, offset=offset)
+            metadatas = page.get("metadatas") or []
+            if not metadatas:
+                break
+            for meta, text in zip(metadatas, page.get("documents") or []):
+                if "filename" in meta:
+                    key = ("filename", meta["filename"])
+                    group = (GROUP_FILENAME, meta["filename"])
+                elif "domain" in meta:
+                    key = ("url", meta.get("url", meta["domain"]))
+                    group = (GROUP_DOMAIN, meta["domain"])
+                else:
+                    continue
+                entry = totals.setdefault(key, [group, 0, 0, meta.get("source_hash")])
+                entry[1] += 1
+                entry[2] += len((text or "").encode("utf-8"))
+            offset += len(metadatas)
+
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sources")
+            self._conn.execute("DELETE FROM groups")
+        self.record([
+            (key_field, key_value, group[0], group[1], chunks, size, digest)
+            for (key_field, key_value), (group, chunks, size, digest) in totals.items()
+        ])
+        return len(totals)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """Return the shared catalog, building it from the vector store the first time it is empty."""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            catalog = Catalog()
+            if catalog.is_empty():
+                rebuilt = catalog.rebuild(get_vector_db())
+                if rebuilt:
+                    print(f"Rebuilt document catalog from the vector store ({rebuilt} sources)")
+            _catalog = catalog
+        return _catalog
@@ -0,0 +1,118 @@
+import os
+import re
+import hashlib
+
+from langchain.schema import Document
+
+from embedding_cache import normalize_text
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '3000'))
+CONTEXT_PASSAGE_CHARS = int(os.getenv('CONTEXT_PASSAGE_CHARS', '1200'))
+CONTEXT_MMR_LAMBDA = float(os.getenv('CONTEXT_MMR_LAMBDA', '0.7'))  # 1.0 = relevance only
+CONTEXT_NEAR_DUPLICATE = float(os.getenv('CONTEXT_NEAR_DUPLICATE', '0.8'))  # shingle Jaccard
+CHARS_PER_TOKEN = 4  # rough average for English text with Llama/Mistral tokenizers
+
+_WORD = re.compile(r"\w+")
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def split_passages(text, max_chars=CONTEXT_PASSAGE_CHARS):
+    """Split a chunk at paragraph breaks, merging short paragraphs up to max_chars."""
+    passages = []
+    current = ""
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        # Long paragraphs (e.g. scraped pages without blank lines) are cut at word boundaries
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(" ", 0, max_chars)
+            cut = cut if cut > max_chars // 2 else max_chars
+            if current:
+                passages.append(current)
+                current = ""
+            passages.append(paragraph[:cut].strip())
+            paragraph = paragraph[cut:].strip()
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            passages.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        passages.append(current)
+    return passages
+
+
+def shingles(words, size=3):
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def pack_context(user_query, hits, budget=CONTEXT_TOKEN_BUDGET, mmr_lambda=CONTEXT_MMR_LAMBDA,
+                 near_duplicate=CONTEXT_NEAR_DUPLICATE):
+    """
+    Turn retrieved [(doc, relevance)] into the passages worth sending to the LLM.
+
+    Chunks are split into passages, exact and near-duplicate passages
+    (word-shingle Jaccard >= near_duplicate) are dropped, the rest are
+    ordered by maximal marginal relevance and packed greedily until the
+    token budget is spent. Returns Documents (one per passage, carrying the
+    parent chunk's metadata) in their original document order.
+    """
+    query_terms = set(_WORD.findall(user_query.lower()))
+    candidates = []
+    seen = set()
+    tokens_before = 0
+    for rank, (doc, score) in enumerate(hits):
+        tokens_before += estimate_tokens(doc.page_content)
+        for position, passage in enumerate(split_passages(doc.page_content)):
+            digest = hashlib.sha1(normalize_text(passage).lower().encode("utf-8")).digest()
+            if digest in seen:
+                continue
+            seen.add(digest)
+            words = _WORD.findall(passage.lower())
+            shingle_set = shingles(words)
+            if any(jaccard(shingle_set, c["shingles"]) >= near_duplicate for c in candidates):
+                continue
+            coverage = len(query_terms & set(words)) / len(query_terms) if query_terms else 0.0
+            candidates.append({
+                "text": passage,
+                "metadata": doc.metadata,
+                "order": (rank, position),
+                "tokens": estimate_tokens(passage),
+                "shingles": shingle_set,
+                # Chunk-level vector relevance, nudged towards passages that mention the query's terms
+                "relevance": 0.7 * score + 0.3 * coverage,
+            })
+
+    selected = []
+    used = 0
+    remaining = candidates
+    while remaining and used < budget:
+        def mmr(c):
+            redundancy = max((jaccard(c["shingles"], s["shingles"]) for s in selected), default=0.0)
+            return mmr_lambda * c["relevance"] - (1 - mmr_lambda) * redundancy
+
+        best = max(remaining, key=mmr)
+        remaining = [c for c in remaining if c is not best]
+        if used + best["tokens"] > budget:
+            continue
+        selected.append(best)
+        used += best["tokens"]
+
+    selected.sort(key=lambda c: c["order"])
+    print(
+        f"Packed context: {len(hits)} chunks / ~{tokens_before} tokens -> "
+        f"{len(selected)} of {len(candidates)} unique passages / ~{used} tokens (budget {budget})"
+    )
+    return [Document(page_content=c["text"], metadata=c["metadata"]) for c in selected]
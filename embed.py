@@ -1,46 +1,400 @@
 import os
+import time
+import hashlib
+import threading
+import multiprocessing
 from datetime import datetime
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
 from werkzeug.utils import secure_filename
 
 from langchain_community.document_loaders import UnstructuredFileLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_text_splitters import RecursiveCharacterTextSplitter, MarkdownHeaderTextSplitter
 from get_vector_db import get_vector_db
+from catalog import get_catalog, source_group
+from lexical_index import get_lexical_index
+import metrics
 
 TEMP_FOLDER = os.getenv('TEMP_FOLDER', './_temp')
 ALLOWED_EXTENSIONS = {"pdf", "docx", "txt", "md"}
+TEXT_EXTENSIONS = {"txt", "md"}
+FAST_PATH_MAX_BYTES = int(os.getenv('FAST_PATH_MAX_BYTES', str(1024 * 1024)))
+TEMP_FOLDER_QUOTA_MB = int(os.getenv('TEMP_FOLDER_QUOTA_MB', '2048'))
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', str(os.cpu_count() or 2)))  # 0 = parse in-process
+PARSE_TIMEOUT = float(os.getenv('PARSE_TIMEOUT', '300'))  # seconds per file
+PARSE_MEMORY_LIMIT_MB = int(os.getenv('PARSE_MEMORY_LIMIT_MB', '4096'))  # per parser process
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def embed_any_file(file):
+def content_hash(data):
+    """sha256 of a str or bytes payload."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+def file_hash(file_path):
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def chunk_id(key_field, key_value, index, text):
     """
-    Embeds a file (pdf, docx, txt, md) into Chroma DB, storing 'filename' in metadata.
+    Deterministic chunk ID: the same source, position and text always map
+    to the same ID, so re-ingesting is an upsert rather than an insert.
+    """
+    return content_hash(f"{key_field}={key_value}\0{index}\0{content_hash(text)}")
+
+# An upsert_sources entry for a source dropped as a near-duplicate of `duplicate_of`
+DuplicateSource = namedtuple("DuplicateSource", "key_field key_value duplicate_of")
+
+def source_unchanged(db, key_field, key_value, digest):
+    """True if the stored chunks of this source were built from the same content."""
+    existing = db.get(where={key_field: key_value}, limit=1, include=["metadatas"])
+    metadatas = existing.get("metadatas") or []
+    return bool(metadatas) and metadatas[0].get("source_hash") == digest
+
+def upsert_sources(db, sources):
     """
+    Idempotently write a batch of sources. `sources` is an iterable of
+    (key_field, key_value, digest, chunks) where key_field/key_value identify
+    the source in metadata (e.g. "filename"/"my.pdf" or "url"/"https://...").
+
+    Sources whose stored hash matches `digest` are skipped, everything else is
+    upserted under deterministic IDs, and chunks left over from an older,
+    longer version of a source are deleted. A DuplicateSource entry deletes
+    all of its source's chunks and records it in the catalog as a duplicate.
+    The catalog and lexical index are updated with the same batch.
+    Returns counts of written chunks, deleted chunks and skipped sources.
+    """
+    catalog = get_catalog()
+    lexical = get_lexical_index()
+    docs, ids, stale = [], [], []
+    catalog_entries = []
+    duplicates = []
+    unchanged = []
+
+    # If a batch names the same source twice, the last version wins
+    latest = {}
+    for source in sources:
+        latest[(source[0], source[1])] = source
+
+    lookup_started = time.perf_counter()
+    for (key_field, key_value), source in latest.items():
+        existing = db.get(where={key_field: key_value}, include=["metadatas"])
+        existing_ids = existing.get("ids") or []
+        existing_meta = existing.get("metadatas") or []
+        if isinstance(source, DuplicateSource):
+            if existing_ids:
+                stale.append(({key_field: key_value}, list(existing_ids)))
+            group_kind, group_name = source_group(key_field, key_value, [])
+            duplicates.append((key_field, key_value, group_kind, group_name, source.duplicate_of))
+            continue
+        digest, chunks = source[2], source[3]
+        if existing_ids and all(m.get("source_hash") == digest for m in existing_meta):
+            unchanged.append((key_field, key_value))
+            continue
+
+        new_ids = []
+        for i, c in enumerate(chunks):
+            c.metadata["source_hash"] = digest
+            c.metadata["chunk_index"] = i
+            new_ids.append(chunk_id(key_field, key_value, i, c.page_content))
+        docs.extend(chunks)
+        ids.extend(new_ids)
+        leftover = set(existing_ids) - set(new_ids)
+        if leftover:
+            stale.append(({key_field: key_value}, list(leftover)))
+        group_kind, group_name = source_group(key_field, key_value, chunks)
+        size = sum(len(c.page_content.encode("utf-8")) for c in chunks)
+        catalog_entries.append((key_field, key_value, group_kind, group_name, len(chunks), size, digest))
+
+    metrics.record_stage("upsert", "lookup", time.perf_counter() - lookup_started)
+
+    with metrics.stage("upsert", "embed_store"):
+        if docs:
+            db.add_documents(docs, ids=ids)
+        # The source's filter lets a sharded store route the delete to one shard
+        for where, stale_ids in stale:
+            db.delete(ids=stale_ids, where=where)
+    stale_ids = [i for _, source_ids in stale for i in source_ids]
+    # The catalog and lexical index follow the store: update them only after Chroma accepted the batch
+    with metrics.stage("upsert", "index_update"):
+        if lexical is not None:
+            lexical.upsert(ids, docs)
+            lexical.delete(stale_ids)
+        catalog.record(catalog_entries)
+        catalog.record_duplicates(duplicates)
+        catalog.touch(unchanged)
+    metrics.record_items("upsert", "chunks", len(docs))
+    return {"chunks": len(docs), "deleted": len(stale_ids), "skipped": len(unchanged)}
+
+class ParseError(Exception):
+    """A file could not be parsed: it timed out, ran out of memory or crashed its worker."""
+
+def _limit_worker_memory(limit_mb):
+    # Cap the parser's data segment so one pathological PDF raises
+    # MemoryError in the worker instead of pushing the host into swap.
+    # RLIMIT_DATA rather than RLIMIT_AS: Linux (4.7+) counts the private
+    # writable memory a parser allocates, not the address space that
+    # onnxruntime / torch or memory-mapped models reserve but never touch.
+    try:
+        import resource
+        limit = limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+    except (ImportError, AttributeError, ValueError, OSError):
+        pass  # not supported on this platform
+
+def parse_and_split(file_path, filename):
+    """Load a file with Unstructured and split it into chunks tagged with `filename`."""
+    # Load via UnstructuredFileLoader
+    loader = UnstructuredFileLoader(file_path=file_path)
+    data = loader.load()
+
+    # Chunk if needed
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=7500, chunk_overlap=100)
+    chunks = text_splitter.split_documents(data)
+
+    # Store the original user-facing filename
+    for c in chunks:
+        c.metadata["filename"] = filename
+    return chunks
+
+class ParserPool:
+    """
+    Bounded process pool for the CPU-bound parse + split step.
+
+    Each file gets PARSE_TIMEOUT seconds; a file that overruns has its pool
+    torn down (the only way to stop a stuck worker) and a fresh pool is
+    started. Jobs that were caught in a torn-down or crashed pool are retried
+    once, so one bad document never takes out the server or its neighbours.
+    """
+
+    def __init__(self, workers=PARSE_WORKERS, timeout=PARSE_TIMEOUT, memory_limit_mb=PARSE_MEMORY_LIMIT_MB):
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    # spawn: forking a threaded web server is unsafe
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_limit_worker_memory,
+                    initargs=(self.memory_limit_mb,)
+                )
+            return self._executor
+
+    def _discard(self, executor, kill=False):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        if kill:
+            for process in list((executor._processes or {}).values()):
+                process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def parse(self, file_path, filename):
+        if self.workers <= 0:
+            return parse_and_split(file_path, filename)
+
+        for attempt in range(2):
+            executor = self._get_executor()
+            future = executor.submit(parse_and_split, file_path, filename)
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeout:
+                self._discard(executor, kill=True)
+                raise ParseError(f"Parsing {filename} timed out after {self.timeout:.0f}s")
+            except BrokenProcessPool:
+                self._discard(executor)
+                if attempt:
+                    raise ParseError(f"Parser worker crashed while parsing {filename}")
+            except MemoryError:
+                raise ParseError(f"Parsing {filename} exceeded {self.memory_limit_mb} MB")
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+parser_pool = ParserPool()
+
+class TempQuotaExceeded(Exception):
+    """Accepting an upload would push TEMP_FOLDER past TEMP_FOLDER_QUOTA_MB."""
+
+def file_extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+def temp_folder_usage():
+    """Total bytes currently held in TEMP_FOLDER."""
+    if not os.path.isdir(TEMP_FOLDER):
+        return 0
+    return sum(entry.stat().st_size for entry in os.scandir(TEMP_FOLDER) if entry.is_file())
+
+def spool_to_temp(stream, suffix):
+    """
+    Copy a stream into a new file in TEMP_FOLDER and return its path.
+    The copy is aborted (and the partial file removed) as soon as the
+    folder would exceed TEMP_FOLDER_QUOTA_MB.
+    """
+    quota = TEMP_FOLDER_QUOTA_MB * 1024 * 1024
+    used = temp_folder_usage()
+    if used >= quota:
+        raise TempQuotaExceeded(f"Temp folder quota of {TEMP_FOLDER_QUOTA_MB} MB reached")
+
+    os.makedirs(TEMP_FOLDER, exist_ok=True)
+    file_path = os.path.join(TEMP_FOLDER, str(datetime.now().timestamp()) + "_" + suffix)
+    try:
+        with open(file_path, "wb") as f:
+            for block in iter(lambda: stream.read(1 << 20), b""):
+                used += len(block)
+                if used > quota:
+                    raise TempQuotaExceeded(f"Upload would exceed the {TEMP_FOLDER_QUOTA_MB} MB temp folder quota")
+                f.write(block)
+    except BaseException:
+        os.remove(file_path)
+        raise
+    return file_path
+
+def sweep_temp_folder(keep=(), before=None):
+    """
+    Delete temp files that no queued or running job still needs (e.g. after
+    a crash). With `before`, files modified after that timestamp are kept.
+    """
+    if not os.path.isdir(TEMP_FOLDER):
+        return 0
+    keep = {os.path.abspath(p) for p in keep if p}
+    removed = 0
+    for entry in os.scandir(TEMP_FOLDER):
+        if before is not None and entry.is_file() and entry.stat().st_mtime >= before:
+            continue
+        if entry.is_file() and os.path.abspath(entry.path) not in keep:
+            os.remove(entry.path)
+            removed += 1
+    return removed
+
+def save_upload(file):
+    """Save an uploaded file into TEMP_FOLDER and return its path, or None if not allowed."""
     if file.filename != '' and file and allowed_file(file.filename):
-        # Save locally
-        ts_name = str(datetime.now().timestamp()) + "_" + secure_filename(file.filename)
-        file_path = os.path.join(TEMP_FOLDER, ts_name)
-        os.makedirs(TEMP_FOLDER, exist_ok=True)
-        file.save(file_path)
+        return spool_to_temp(file.stream, secure_filename(file.filename))
+    return None
+
+def decode_text(data):
+    """Decode txt/md bytes: UTF-8 (BOM tolerated), falling back to Latin-1."""
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return data.decode("latin-1")
 
-        # Load via UnstructuredFileLoader
-        loader = UnstructuredFileLoader(file_path=file_path)
-        data = loader.load()
+def split_text_content(text, filename):
+    """
+    Chunk plain text without Unstructured. Markdown is first split on its
+    headings (kept in the text and recorded as h1/h2/h3 metadata) so chunks
+    follow the document's sections.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=7500, chunk_overlap=100)
+    if file_extension(filename) == "md":
+        header_splitter = MarkdownHeaderTextSplitter(
+            headers_to_split_on=[("#", "h1"), ("##", "h2"), ("###", "h3")],
+            strip_headers=False
+        )
+        chunks = text_splitter.split_documents(header_splitter.split_text(text))
+    else:
+        chunks = text_splitter.create_documents([text])
+
+    for c in chunks:
+        c.metadata["filename"] = filename
+    return chunks
+
+def load_chunks(file_path, filename):
+    """Loader dispatch: txt/md are decoded and split directly, everything else goes to the parser pool."""
+    if file_extension(filename) in TEXT_EXTENSIONS:
+        with open(file_path, "rb") as f:
+            return split_text_content(decode_text(f.read()), filename)
+    return parser_pool.parse(file_path, filename)
+
+def is_fast_path(file):
+    """Small txt/md uploads are ingested straight from memory, with no temp file or job."""
+    if file_extension(file.filename) not in TEXT_EXTENSIONS:
+        return False
+    size = file.content_length
+    if not size:
+        # Multipart parts rarely carry their own length; measure the stream
+        pos = file.stream.tell()
+        file.stream.seek(0, os.SEEK_END)
+        size = file.stream.tell()
+        file.stream.seek(pos)
+    return size <= FAST_PATH_MAX_BYTES
+
+def embed_text_upload(file):
+    """Fast path for a small txt/md upload: decode in memory, split, upsert."""
+    data = file.stream.read()
+    db = get_vector_db()
+    digest = content_hash(data)
+    if source_unchanged(db, "filename", file.filename, digest):
+        return {"chunks": 0, "deleted": 0, "skipped": 1}
+    with metrics.stage("embed_file", "parse"):
+        chunks = split_text_content(decode_text(data), file.filename)
+    metrics.record_items("embed_file", "chunks", len(chunks))
+    result = upsert_sources(db, [("filename", file.filename, digest, chunks)])
+    db.persist()
+    return result
+
+def embed_file_path(file_path, filename, on_progress=None):
+    """
+    Parse, chunk and store a file that is already on disk under its
+    user-facing `filename`. `on_progress(stage, **counts)` is called as the
+    work moves through stages. Returns the upsert_sources counts.
+    """
+    def progress(stage, **counts):
+        if on_progress:
+            on_progress(stage, **counts)
 
-        # Chunk if needed
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=7500, chunk_overlap=100)
-        chunks = text_splitter.split_documents(data)
+    db = get_vector_db()
+    with metrics.stage("embed_file", "hash"):
+        digest = file_hash(file_path)
+        unchanged = source_unchanged(db, "filename", filename, digest)
+    if unchanged:
+        progress("done", chunks=0, skipped=1)
+        return {"chunks": 0, "deleted": 0, "skipped": 1}
 
-        # Store the original user-facing filename
-        for c in chunks:
-            c.metadata["filename"] = file.filename
+    # Parse + split (pdf/docx in the process pool); embedding and storage stay here
+    progress("parsing")
+    with metrics.stage("embed_file", "parse"):
+        chunks = load_chunks(file_path, filename)
+    metrics.record_items("embed_file", "chunks", len(chunks))
 
-        db = get_vector_db()
-        db.add_documents(chunks)
-        db.persist()
+    progress("embedding", total_chunks=len(chunks))
+    result = upsert_sources(db, [("filename", filename, digest, chunks)])
+    db.persist()
+    progress("done", **result)
+    return result
 
-        # Optionally remove local file
-        # os.remove(file_path)
+def embed_any_file(file):
+    """
+    Embeds a file (pdf, docx, txt, md) into Chroma DB, storing 'filename' in metadata.
+    Re-uploading an unchanged file is a no-op; a changed file replaces its old chunks.
+    """
+    if not (file and file.filename != '' and allowed_file(file.filename)):
+        return False
 
+    if is_fast_path(file):
+        embed_text_upload(file)
         return True
-    return False
\ No newline at end of file
+
+    with metrics.stage("embed_file", "save_upload"):
+        file_path = save_upload(file)
+    try:
+        embed_file_path(file_path, file.filename)
+    finally:
+        os.remove(file_path)
+    return True
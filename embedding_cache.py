@@ -0,0 +1,192 @@
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+import metrics
+
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', 'embedding_cache.sqlite3')
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '500000'))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Collapse whitespace so cosmetic re-scrape differences still hit the cache."""
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def cache_key(model, kind, text):
+    """Content address for one embedding: model + document/query kind + normalized text."""
+    h = hashlib.sha256()
+    h.update(model.encode("utf-8"))
+    h.update(b"\0")
+    h.update(kind.encode("utf-8"))
+    h.update(b"\0")
+    h.update(normalize_text(text).encode("utf-8"))
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent, size-bounded embedding store in SQLite.
+    Rows carry a last_used timestamp; once the table grows past max_entries
+    the least recently used rows are evicted, down to 90% of max_entries so
+    the next eviction is many writes away. Opening the cache with a
+    different model than the one it was built with clears it.
+
+    The table is counted once when the cache is opened. After that, rows
+    written are added to an estimate, and the table is counted again only
+    when the estimate passes max_entries. The estimate never undercounts
+    this process's own writes: a replaced key counts as a new row.
+    """
+
+    def __init__(self, path, model, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.model = model
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._estimated_rows = 0
+
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'model'").fetchone()
+        if row is None or row[0] != model:
+            if row is not None:
+                print(f"Embedding model changed ({row[0]} -> {model}); clearing embedding cache")
+            self.invalidate()
+        self._estimated_rows = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys):
+        """Return {key: vector} for the keys that are cached, refreshing their LRU position."""
+        found = {}
+        if not keys:
+            return found
+        with self._lock:
+            # SQLite caps bound parameters, so look up in slices
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", part
+                ).fetchall()
+                for key, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[key] = vec.tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, k) for k in found]
+                )
+                self._conn.commit()
+            missed = len(set(keys)) - len(found)
+            self.hits += len(found)
+            self.misses += missed
+        metrics.EMBED_CACHE_LOOKUPS.labels("hit").inc(len(found))
+        metrics.EMBED_CACHE_LOOKUPS.labels("miss").inc(missed)
+        return found
+
+    def put_many(self, items):
+        """Store (key, vector) pairs and evict the oldest rows past max_entries."""
+        if not items:
+            return
+        now = time.time()
+        rows = [(k, array("f", v).tobytes(), now) for k, v in items]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+            )
+            self._estimated_rows += len(rows)
+            if self._estimated_rows > self.max_entries:
+                # Other processes write to the same file, so only a real count decides
+                count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                if count > self.max_entries:
+                    keep = int(self.max_entries * 0.9)
+                    self._conn.execute(
+                        "DELETE FROM embeddings WHERE key IN ("
+                        " SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                        (count - keep,)
+                    )
+                    count = keep
+                self._estimated_rows = count
+            self._conn.commit()
+
+    def invalidate(self):
+        """Drop every cached vector and re-stamp the cache with the current model."""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('model', ?)", (self.model,)
+            )
+            self._conn.commit()
+            self._estimated_rows = 0
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "model": self.model,
+            "entries": size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends cache misses to the underlying model."""
+
+    def __init__(self, inner, cache):
+        self.inner = inner
+        self.cache = cache
+
+    def _embed(self, texts, kind, embed_fn):
+        keys = [cache_key(self.cache.model, kind, t) for t in texts]
+        found = self.cache.get_many(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = embed_fn(list(missing.values()))
+            fresh = list(zip(missing.keys(), vectors))
+            self.cache.put_many(fresh)
+            found.update(fresh)
+        return [found[k] for k in keys]
+
+    def embed_documents(self, texts):
+        return self._embed(texts, "document", self.inner.embed_documents)
+
+    def embed_query(self, text):
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts):
+        if hasattr(self.inner, "embed_queries"):
+            return self._embed(texts, "query", self.inner.embed_queries)
+        return self._embed(texts, "query", lambda ts: [self.inner.embed_query(t) for t in ts])
@@ -0,0 +1,207 @@
+"""
+Deterministic stand-in for the parts of the Ollama HTTP API this project uses.
+
+    python fake_ollama.py [--port 11435] [--dim 768] [--first-token-latency 0.05]
+                          [--tokens-per-sec 500] [--answer-tokens 32] [--embed-latency 0]
+
+Embeddings are hashed bags of words: every word maps to a fixed random
+vector and a text embeds to the normalized sum of its words' vectors, so the
+same text always gets the same vector and texts sharing words are close.
+Chat and generate stream a canned answer at a configurable first-token
+latency and token rate. Prompts asking for "different versions" of a
+question get five rewrites of it, one per line.
+"""
+import re
+import json
+import time
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+try:
+    import orjson  # encodes the embedding arrays much faster than json
+except ImportError:
+    orjson = None
+
+_WORD = re.compile(r"\w+")
+_QUESTION = re.compile(r"Original question:\s*(.+)", re.S)
+
+
+class FakeModel:
+    def __init__(self, dim=768, first_token_latency=0.05, tokens_per_sec=500.0, answer_tokens=32,
+                 embed_latency=0.0):
+        self.dim = dim
+        self.first_token_latency = first_token_latency
+        self.tokens_per_sec = tokens_per_sec
+        self.answer_tokens = answer_tokens
+        self.embed_latency = embed_latency
+        self._words = {}
+        self._lock = threading.Lock()
+
+    def word_vector(self, word):
+        vector = self._words.get(word)
+        if vector is None:
+            seed = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "big")
+            vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+            with self._lock:
+                if len(self._words) > 200000:
+                    self._words.clear()
+                self._words[word] = vector
+        return vector
+
+    def embed(self, text):
+        words = _WORD.findall(text.lower()) or [""]
+        vector = np.sum([self.word_vector(w) for w in words], axis=0)
+        norm = float(np.linalg.norm(vector)) or 1.0
+        return vector / norm
+
+    def answer(self, prompt):
+        """The tokens of the reply to a chat/generate prompt."""
+        if "different versions" in prompt:
+            match = _QUESTION.search(prompt)
+            question = match.group(1).strip() if match else "the question"
+            lines = [question, f"What is {question}?", f"Explain {question}", f"{question} details",
+                     f"Background on {question}"]
+            text = "\n".join(lines)
+            return re.findall(r"\S+\s*", text)
+        words = [w for w in _WORD.findall(prompt.lower()) if len(w) > 3][:self.answer_tokens]
+        words += ["answer"] * (self.answer_tokens - len(words))
+        return [("" if i == 0 else " ") + w for i, w in enumerate(words)]
+
+    def pace(self, index, started):
+        """Sleep until token `index` is due."""
+        due = started + self.first_token_latency
+        if self.tokens_per_sec > 0:
+            due += index / self.tokens_per_sec
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def make_handler(model):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # otherwise small responses wait on delayed ACKs
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                return self.send_json({"models": []})
+            if self.path in ("/", "/api/version"):
+                return self.send_json({"version": "0.0.0-fake"})
+            self.send_json({"error": "not found"}, status=404)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if self.path == "/api/embed":
+                if model.embed_latency:
+                    time.sleep(model.embed_latency)
+                texts = body.get("input") or []
+                texts = [texts] if isinstance(texts, str) else texts
+                return self.send_json({
+                    "model": body.get("model"),
+                    "embeddings": [model.embed(t) for t in texts],
+                    "prompt_eval_count": sum(len(t.split()) for t in texts),
+                })
+            if self.path == "/api/embeddings":
+                if model.embed_latency:
+                    time.sleep(model.embed_latency)
+                return self.send_json({"embedding": model.embed(body.get("prompt") or "").tolist()})
+            if self.path in ("/api/chat", "/api/generate"):
+                return self.generate(body)
+            if self.path == "/api/show":
+                return self.send_json({"details": {"family": "fake"}})
+            self.send_json({"error": "not found"}, status=404)
+
+        def generate(self, body):
+            chat = self.path == "/api/chat"
+            if chat:
+                messages = body.get("messages") or []
+                prompt = "\n".join(str(m.get("content") or "") for m in messages)
+            else:
+                prompt = body.get("prompt") or ""
+            if not prompt:
+                # Warm-up / keep-alive request: load the model, answer nothing
+                return self.send_json({"model": body.get("model"), "response": "", "done": True})
+
+            started = time.monotonic()
+            tokens = model.answer(prompt)
+
+            def part(text, done):
+                data = {"model": body.get("model"), "done": done}
+                if chat:
+                    data["message"] = {"role": "assistant", "content": text}
+                else:
+                    data["response"] = text
+                if done:
+                    data["eval_count"] = len(tokens)
+                return data
+
+            if body.get("stream") is False:
+                model.pace(len(tokens), started)
+                return self.send_json(part("".join(tokens), True))
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for i, token in enumerate(tokens):
+                    model.pace(i, started)
+                    self.send_chunk(json.dumps(part(token, False)) + "\n")
+                self.send_chunk(json.dumps(part("", True)) + "\n")
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True  # the client stopped the generation
+
+        def send_chunk(self, text):
+            data = text.encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def send_json(self, obj, status=200):
+            if orjson is not None:
+                data = orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+            else:
+                data = json.dumps(obj, default=lambda a: a.tolist()).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def serve(port=11435, host="127.0.0.1", **model_options):
+    server = ThreadingHTTPServer((host, port), make_handler(FakeModel(**model_options)))
+    server.daemon_threads = True
+    print(f"Fake Ollama listening on http://{host}:{port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a deterministic fake Ollama API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--dim", type=int, default=768, help="embedding dimension")
+    parser.add_argument("--first-token-latency", type=float, default=0.05, help="seconds before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=500.0, help="generation speed (0 = instant)")
+    parser.add_argument("--answer-tokens", type=int, default=32, help="tokens per generated answer")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="seconds added to every embed request")
+    args = parser.parse_args()
+    serve(
+        port=args.port, host=args.host, dim=args.dim, first_token_latency=args.first_token_latency,
+        tokens_per_sec=args.tokens_per_sec, answer_tokens=args.answer_tokens, embed_latency=args.embed_latency,
+    )
@@ -1,17 +1,572 @@
 import os
+import json
+import time
+import hashlib
+import random
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+import chromadb
 from langchain_community.embeddings import OllamaEmbeddings
 from langchain_community.vectorstores.chroma import Chroma
 
+import metrics
+from embedding_cache import EmbeddingCache, CachedEmbeddings, EMBEDDING_CACHE_PATH
+
 CHROMA_PATH = os.getenv('CHROMA_PATH', 'chroma')
 COLLECTION_NAME = os.getenv('COLLECTION_NAME', 'local-rag')
 TEXT_EMBEDDING_MODEL = os.getenv('TEXT_EMBEDDING_MODEL', 'nomic-embed-text')
+LLM_MODEL = os.getenv('LLM_MODEL', 'mistral')
+OLLAMA_BASE_URL = os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+OLLAMA_POOL_SIZE = int(os.getenv('OLLAMA_POOL_SIZE', '16'))
+EMBED_REQUEST_BATCH = int(os.getenv('EMBED_REQUEST_BATCH', '32'))  # texts per /api/embed call
+EMBED_MAX_CONCURRENCY = int(os.getenv('EMBED_MAX_CONCURRENCY', '4'))  # parallel calls to Ollama
+EMBED_TARGET_LATENCY = float(os.getenv('EMBED_TARGET_LATENCY', '2.0'))  # seconds per batch
+EMBED_RETRIES = int(os.getenv('EMBED_RETRIES', '3'))
+# Chat generations sent to Ollama at once by this process; extra ones wait up to LLM_QUEUE_TIMEOUT
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '4'))
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', '60'))
+OLLAMA_TIMEOUT = int(os.getenv('OLLAMA_TIMEOUT', '300'))  # seconds to wait for Ollama's next response bytes
+LLM_GENERATION_TIMEOUT = float(os.getenv('LLM_GENERATION_TIMEOUT', '300'))  # seconds one chat reply may take; 0 = no limit
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+# 'chroma', or 'numpy' for the memory-mapped quantized store in numpy_store.py
+VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'chroma').lower()
+# One collection per file / scraped domain instead of a single COLLECTION_NAME collection (chroma only)
+VECTOR_SHARDING = os.getenv('VECTOR_SHARDING', 'false').lower() == 'true'
+SHARD_SEARCH_WORKERS = int(os.getenv('SHARD_SEARCH_WORKERS', '8'))
+
+# Process-wide client registry: the Ollama session, the embedding function and
+# the Chroma handles are created once and shared by every handler. Chat needs
+# no client object; stream_chat posts to /api/chat over the pooled session.
+_lock = threading.Lock()
+_session = None
+_embedding = None
+_embedding_cache = None
+_chroma_client = None
+_collections = {}
+_sharded = None
+_shard_executor = ThreadPoolExecutor(max_workers=SHARD_SEARCH_WORKERS, thread_name_prefix="shard")
+
+
+def get_ollama_session():
+    """Return the shared keep-alive HTTP session used to talk to Ollama."""
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=OLLAMA_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that follows the server's measured latency (AIMD):
+    a batch that finishes under the target latency lets one more batch run
+    in parallel, a slow or failed batch halves the limit.
+    """
+
+    def __init__(self, maximum=EMBED_MAX_CONCURRENCY, target_latency=EMBED_TARGET_LATENCY):
+        self.maximum = max(1, maximum)
+        self.target_latency = target_latency
+        self.limit = 1
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None):
+        with self._cond:
+            self.in_flight -= 1
+            if latency is None or latency > self.target_latency * 1.5:
+                self.limit = max(1, self.limit // 2)
+            elif latency < self.target_latency:
+                self.limit = min(self.maximum, self.limit + 1)
+            self._cond.notify_all()
+
+
+class EmbeddingStats:
+    """Running totals for the embedding backend."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.chunks = 0
+        self.tokens = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.seconds = 0.0
+
+    def record(self, chunks, tokens, seconds):
+        with self._lock:
+            self.chunks += chunks
+            self.tokens += tokens
+            self.batches += 1
+            self.seconds += seconds
+        metrics.EMBED_CHUNKS.inc(chunks)
+        metrics.EMBED_TOKENS.inc(tokens)
+        metrics.EMBED_BATCHES.labels("ok").inc()
+        metrics.EMBED_CONCURRENCY.set(_limiter.limit)
+
+    def record_failure(self):
+        with self._lock:
+            self.failed_batches += 1
+        metrics.EMBED_BATCHES.labels("failed").inc()
+        metrics.EMBED_CONCURRENCY.set(_limiter.limit)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "chunks": self.chunks,
+                "tokens": self.tokens,
+                "batches": self.batches,
+                "failed_batches": self.failed_batches,
+                "embed_seconds": self.seconds,
+                "concurrency": _limiter.limit,
+            }
+
+
+class LLMBusy(Exception):
+    """No chat slot became free within LLM_QUEUE_TIMEOUT."""
+
+
+class LLMTimeout(Exception):
+    """A chat reply took longer than LLM_GENERATION_TIMEOUT."""
+
+
+_llm_slots = threading.BoundedSemaphore(max(1, LLM_MAX_CONCURRENCY))
+
+
+@contextmanager
+def llm_slot():
+    """
+    Hold one of the LLM_MAX_CONCURRENCY chat slots. Ollama runs only a few
+    generations in parallel (OLLAMA_NUM_PARALLEL); requests beyond that
+    queue inside Ollama anyway, so they wait here instead, where the wait is
+    bounded and measured.
+    """
+    started = time.monotonic()
+    if not _llm_slots.acquire(timeout=LLM_QUEUE_TIMEOUT):
+        metrics.record_stage("llm", "wait", time.monotonic() - started)
+        raise LLMBusy(f"No LLM slot free after {LLM_QUEUE_TIMEOUT:.0f}s")
+    metrics.record_stage("llm", "wait", time.monotonic() - started)
+    try:
+        yield
+    finally:
+        _llm_slots.release()
+
+
+_limiter = AdaptiveLimiter()
+_embed_stats = EmbeddingStats()
+_embed_executor = ThreadPoolExecutor(max_workers=max(1, EMBED_MAX_CONCURRENCY), thread_name_prefix="embed")
+
+
+class PooledOllamaEmbeddings(OllamaEmbeddings):
+    """
+    OllamaEmbeddings that reuses the shared session instead of a new
+    connection per chunk, and embeds documents in batches through Ollama's
+    /api/embed endpoint with several batches in flight at once.
+    """
+
+    def _process_emb_response(self, input):
+        headers = {"Content-Type": "application/json", **(self.headers or {})}
+        try:
+            res = get_ollama_session().post(
+                f"{self.base_url}/api/embeddings",
+                headers=headers,
+                json={"model": self.model, "prompt": input, **self._default_params},
+                timeout=(10, OLLAMA_TIMEOUT),
+            )
+        except requests.exceptions.RequestException as e:
+            raise ValueError(f"Error raised by inference endpoint: {e}")
+
+        if res.status_code != 200:
+            raise ValueError(
+                "Error raised by inference API HTTP code: %s, %s" % (res.status_code, res.text)
+            )
+        try:
+            return res.json()["embedding"]
+        except requests.exceptions.JSONDecodeError as e:
+            raise ValueError(f"Error raised by inference API: {e}.\nResponse: {res.text}")
+
+    def _post_batch(self, texts):
+        """One /api/embed call; returns (vectors, prompt tokens). Falls back to per-text calls on old servers."""
+        started = time.monotonic()
+        try:
+            result = self._request_batch(texts)
+        except Exception:
+            metrics.record_ollama("embed", time.monotonic() - started, ok=False)
+            raise
+        metrics.record_ollama("embed", time.monotonic() - started)
+        return result
+
+    def _request_batch(self, texts):
+        res = get_ollama_session().post(
+            f"{self.base_url}/api/embed",
+            headers={"Content-Type": "application/json", **(self.headers or {})},
+            json={**self._default_params, "input": texts},
+            timeout=(10, OLLAMA_TIMEOUT),
+        )
+        if res.status_code == 404 and "model" not in res.text:
+            # Ollama < 0.3 has no batch endpoint
+            return [self._process_emb_response(t) for t in texts], 0
+        if res.status_code != 200:
+            raise ValueError(
+                "Error raised by inference API HTTP code: %s, %s" % (res.status_code, res.text)
+            )
+        body = res.json()
+        return body["embeddings"], body.get("prompt_eval_count", 0)
+
+    def _embed_batch(self, texts):
+        for attempt in range(EMBED_RETRIES + 1):
+            _limiter.acquire()
+            started = time.monotonic()
+            latency = None
+            try:
+                vectors, tokens = self._post_batch(texts)
+                latency = time.monotonic() - started
+            except (ValueError, KeyError, requests.exceptions.RequestException) as e:
+                error = e
+            finally:
+                # Whatever went wrong (an unexpected response, an interrupt), the slot goes back
+                _limiter.release(latency)
+                if latency is None:
+                    _embed_stats.record_failure()
+            if latency is not None:
+                _embed_stats.record(len(texts), tokens, latency)
+                return vectors
+            if attempt == EMBED_RETRIES:
+                raise ValueError(f"Embedding batch failed after {attempt + 1} attempts: {error}")
+            time.sleep(min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.5))
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        instructed = [f"{self.embed_instruction}{text}" for text in texts]
+        batches = [instructed[i:i + EMBED_REQUEST_BATCH] for i in range(0, len(instructed), EMBED_REQUEST_BATCH)]
+
+        started = time.monotonic()
+        before = _embed_stats.snapshot()
+        vectors = []
+        for batch_vectors in _embed_executor.map(self._embed_batch, batches):
+            vectors.extend(batch_vectors)
+
+        elapsed = max(time.monotonic() - started, 1e-9)
+        tokens = _embed_stats.snapshot()["tokens"] - before["tokens"]
+        metrics.record_stage("embed", "documents", elapsed)
+        metrics.record_items("embed", "chunks", len(texts))
+        metrics.record_items("embed", "tokens", tokens)
+        print(
+            f"Embedded {len(texts)} chunks in {elapsed:.2f}s "
+            f"({len(texts) / elapsed:.1f} chunks/s, {tokens / elapsed:.0f} tokens/s, "
+            f"concurrency {_limiter.limit})"
+        )
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_queries([text])[0]
 
-def get_vector_db():
-    embedding = OllamaEmbeddings(model=TEXT_EMBEDDING_MODEL, show_progress=True)
+    def embed_queries(self, texts):
+        """Embed several search queries in a single request."""
+        vectors, _ = self._post_batch([f"{self.query_instruction}{text}" for text in texts])
+        return vectors
 
-    db = Chroma(
-        collection_name=COLLECTION_NAME,
-        persist_directory=CHROMA_PATH,
-        embedding_function=embedding
+
+def get_embedding_function():
+    """
+    Return the shared embedding function. Unless EMBEDDING_CACHE_ENABLED is
+    false it is wrapped in the on-disk cache, so unchanged chunks are never
+    sent to Ollama twice.
+    """
+    global _embedding, _embedding_cache
+    with _lock:
+        if _embedding is None:
+            embedding = PooledOllamaEmbeddings(
+                model=TEXT_EMBEDDING_MODEL,
+                base_url=OLLAMA_BASE_URL,
+            )
+            if EMBEDDING_CACHE_ENABLED:
+                _embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, TEXT_EMBEDDING_MODEL)
+                embedding = CachedEmbeddings(embedding, _embedding_cache)
+            _embedding = embedding
+        return _embedding
+
+
+def get_chroma_client():
+    """The persistent Chroma client shared by every collection handle."""
+    global _chroma_client
+    with _lock:
+        if _chroma_client is None:
+            _chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+        return _chroma_client
+
+
+def get_chroma(collection_name=COLLECTION_NAME):
+    """
+    Return the shared Chroma handle for a collection, creating it on first use.
+    Chroma's persistent client is safe to share between threads; the lock only
+    guards creation so two requests never open the same directory twice.
+    """
+    embedding = get_embedding_function()
+    client = get_chroma_client()
+    with _lock:
+        db = _collections.get(collection_name)
+        if db is None:
+            db = Chroma(
+                client=client,
+                collection_name=collection_name,
+                persist_directory=CHROMA_PATH,
+                embedding_function=embedding
+            )
+            _collections[collection_name] = db
+        return db
+
+
+def get_vector_db(collection_name=COLLECTION_NAME):
+    """
+    Return the store the app reads and writes: the NumPy store when
+    VECTOR_BACKEND=numpy, the sharded store when VECTOR_SHARDING is on,
+    otherwise the single Chroma collection.
+    """
+    if VECTOR_BACKEND == "numpy":
+        from numpy_store import get_numpy_store
+        return get_numpy_store(collection_name)
+    if VECTOR_BACKEND != "chroma":
+        raise ValueError(f"Unknown VECTOR_BACKEND: {VECTOR_BACKEND}")
+    if VECTOR_SHARDING and collection_name == COLLECTION_NAME:
+        global _sharded
+        with _lock:
+            if _sharded is None:
+                _sharded = ShardedVectorStore(collection_name)
+            return _sharded
+    return get_chroma(collection_name)
+
+
+class ShardedVectorStore:
+    """
+    Keeps every uploaded file and every scraped domain in its own Chroma
+    collection, so a filtered search or a source rewrite only touches a
+    small index. Implements the part of the Chroma API the app uses:
+    calls whose filter or metadata names a filename, domain or url are
+    routed to that shard, everything else fans out over all shards and
+    merges the results.
+    """
+
+    def __init__(self, prefix=COLLECTION_NAME):
+        # Chroma collection names are capped at 63 characters
+        self.prefix = prefix[:40].rstrip("-_.")
+
+    def shard_name(self, kind, name):
+        digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:16]
+        return f"{self.prefix}-{kind}-{digest}"
+
+    def route(self, fields):
+        """Shard name for a metadata dict or where-filter, or None if it spans shards."""
+        if not fields:
+            return None
+        if isinstance(fields.get("filename"), str):
+            return self.shard_name("file", fields["filename"])
+        if isinstance(fields.get("domain"), str):
+            return self.shard_name("domain", fields["domain"])
+        if isinstance(fields.get("url"), str):
+            return self.shard_name("domain", urlparse(fields["url"]).netloc)
+        return None
+
+    def shards(self):
+        names = sorted(
+            name for name in get_chroma_client().list_collections()
+            if name.startswith(f"{self.prefix}-file-") or name.startswith(f"{self.prefix}-domain-")
+        )
+        return [get_chroma(name) for name in names]
+
+    def _existing_shard(self, name):
+        return get_chroma(name) if name in get_chroma_client().list_collections() else None
+
+    def add_documents(self, documents, ids):
+        groups = {}
+        for doc, doc_id in zip(documents, ids):
+            name = self.route(doc.metadata)
+            if name is None:
+                raise ValueError(f"Cannot route a chunk without filename/domain/url metadata: {doc.metadata}")
+            docs, doc_ids = groups.setdefault(name, ([], []))
+            docs.append(doc)
+            doc_ids.append(doc_id)
+        for name, (docs, doc_ids) in groups.items():
+            get_chroma(name).add_documents(docs, ids=doc_ids)
+        return list(ids)
+
+    def delete(self, ids=None, where=None):
+        name = self.route(where)
+        targets = [self._existing_shard(name)] if name else self.shards()
+        for shard in targets:
+            if shard is None:
+                continue
+            if where:
+                shard.delete(ids=ids, where=where)
+            else:
+                shard.delete(ids=ids)
+
+    def get(self, where=None, limit=None, offset=None, include=("metadatas", "documents")):
+        name = self.route(where)
+        if name:
+            shard = self._existing_shard(name)
+            if shard is None:
+                return {"ids": [], "metadatas": [], "documents": []}
+            return shard.get(where=where, limit=limit, offset=offset, include=list(include))
+
+        merged = {"ids": [], "metadatas": [], "documents": []}
+        if where:
+            # A filter that spans shards: collect the matches, then page
+            for shard in self.shards():
+                page = shard.get(where=where, include=list(include))
+                for key in merged:
+                    merged[key].extend(page.get(key) or [])
+            start = offset or 0
+            end = None if limit is None else start + limit
+            return {key: values[start:end] for key, values in merged.items()}
+
+        # Page over the shards as if they were one collection ordered by shard name
+        skip = offset or 0
+        for shard in self.shards():
+            if limit is not None and len(merged["ids"]) >= limit:
+                break
+            count = shard._collection.count()
+            if skip >= count:
+                skip -= count
+                continue
+            want = None if limit is None else limit - len(merged["ids"])
+            page = shard.get(where=where, limit=want, offset=skip, include=list(include))
+            skip = 0
+            for key in merged:
+                merged[key].extend(page.get(key) or [])
+        return merged
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, filter=None):
+        name = self.route(filter)
+        if name:
+            shard = self._existing_shard(name)
+            # The shard holds only this file/domain, so the metadata filter is dropped
+            return shard.similarity_search_by_vector_with_relevance_scores(embedding, k=k) if shard else []
+
+        def search(shard):
+            return shard.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=filter)
+
+        results = []
+        for hits in _shard_executor.map(search, self.shards()):
+            results.extend(hits)
+        results.sort(key=lambda pair: pair[1])
+        return results[:k]
+
+    def _select_relevance_score_fn(self):
+        shards = self.shards()
+        if shards:
+            return shards[0]._select_relevance_score_fn()
+        return Chroma._euclidean_relevance_score_fn
+
+    def persist(self):
+        """Chroma persists automatically; kept for callers written against the single collection."""
+
+
+def stream_chat(messages, model_name=LLM_MODEL):
+    """
+    Yield the reply to `messages` ([{"role": ..., "content": ...}]) piece by
+    piece as Ollama generates it. Closing the generator closes the HTTP
+    response, which makes Ollama abort the generation. An LLM slot (see
+    llm_slot) is held from the request until the generator finishes.
+
+    A reply still unfinished after LLM_GENERATION_TIMEOUT seconds is cut off
+    with LLMTimeout, so a stalled or runaway generation cannot hold a slot
+    and a server thread forever.
+    """
+    with llm_slot():
+        yield from _stream_chat(messages, model_name)
+
+
+def chat(messages, model_name=LLM_MODEL):
+    """The whole reply to `messages`, through stream_chat so the same slot and deadline apply."""
+    return "".join(stream_chat(messages, model_name))
+
+
+def _stream_chat(messages, model_name):
+    started = time.monotonic()
+    ok = False
+    read_timeout = min(OLLAMA_TIMEOUT, LLM_GENERATION_TIMEOUT) if LLM_GENERATION_TIMEOUT > 0 else OLLAMA_TIMEOUT
+    response = get_ollama_session().post(
+        f"{OLLAMA_BASE_URL}/api/chat",
+        json={"model": model_name, "messages": messages, "stream": True, "keep_alive": OLLAMA_KEEP_ALIVE},
+        stream=True,
+        timeout=(10, read_timeout),
     )
-    return db
\ No newline at end of file
+    try:
+        if response.status_code != 200:
+            raise ValueError(f"Ollama chat failed with status {response.status_code}: {response.text}")
+        for line in response.iter_lines():
+            if LLM_GENERATION_TIMEOUT > 0 and time.monotonic() - started > LLM_GENERATION_TIMEOUT:
+                # Closing the response below makes Ollama stop generating
+                raise LLMTimeout(f"No complete answer from {model_name} within {LLM_GENERATION_TIMEOUT:.0f}s")
+            if not line:
+                continue
+            part = json.loads(line)
+            if part.get("error"):
+                raise ValueError(f"Ollama chat failed: {part['error']}")
+            content = part.get("message", {}).get("content")
+            if content:
+                yield content
+            if part.get("done"):
+                break
+        ok = True
+    except GeneratorExit:
+        ok = True  # the caller stopped reading; not an Ollama failure
+        raise
+    finally:
+        response.close()
+        metrics.record_ollama("chat", time.monotonic() - started, ok)
+
+
+def warm_up(models=(LLM_MODEL,)):
+    """
+    Load the embedding and chat models into Ollama before the first request.
+    A chat request without messages makes Ollama load a model, without
+    generating anything, and keep it resident for OLLAMA_KEEP_ALIVE.
+    Failures are reported but never fatal.
+    """
+    session = get_ollama_session()
+    embedding = get_embedding_function()
+    try:
+        # Bypass the cache, otherwise a warm restart would never touch Ollama
+        getattr(embedding, "inner", embedding).embed_query("warm-up")
+    except Exception as e:
+        print(f"Embedding model warm-up failed: {e}")
+
+    for model_name in models:
+        try:
+            session.post(
+                f"{OLLAMA_BASE_URL}/api/chat",
+                json={"model": model_name, "messages": [], "keep_alive": OLLAMA_KEEP_ALIVE},
+                timeout=(10, OLLAMA_TIMEOUT),
+            ).raise_for_status()
+        except Exception as e:
+            print(f"Chat model warm-up failed for {model_name}: {e}")
+
+
+def close_clients():
+    """Drop every cached client and close the pooled HTTP connections."""
+    global _session, _embedding, _embedding_cache
+    with _lock:
+        _collections.clear()
+        _embedding = None
+        if _embedding_cache is not None:
+            _embedding_cache.close()
+            _embedding_cache = None
+        if _session is not None:
+            _session.close()
+            _session = None
@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+JOBS_DB_PATH = os.getenv('JOBS_DB_PATH', 'jobs.sqlite3')
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', str(os.cpu_count() or 2)))
+
+ACTIVE_STATUSES = ("queued", "running", "cancelling")
+FINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """Raised by Job.check_cancelled() to unwind a handler that was asked to stop."""
+
+
+class Job:
+    """Handle passed to a job handler for reporting progress and checking for cancellation."""
+
+    def __init__(self, manager, job_id, params):
+        self.manager = manager
+        self.id = job_id
+        self.params = params
+
+    def update(self, stage=None, **progress):
+        self.manager._update(self.id, stage=stage, progress=progress)
+
+    def is_cancelled(self):
+        """True if the job was cancelled or the server is shutting down; either way the handler should stop."""
+        return self.manager.stopping.is_set() or self.manager._status(self.id) == "cancelling"
+
+    def is_interrupted(self):
+        """True if a shutdown stopped the job; it will be resumed, so its inputs must be kept."""
+        return self.manager.stopping.is_set()
+
+    def check_cancelled(self):
+        if self.is_cancelled():
+            raise JobCancelled()
+
+
+class JobManager:
+    """
+    Runs ingestion work on a thread pool and keeps every job's state in a
+    small SQLite file so that any worker process can report on it and jobs
+    interrupted by a restart can be resumed.
+
+    Handlers are registered per job kind and called as handler(job, **params).
+    Because ingestion is idempotent, resuming a job simply runs it again:
+    everything that was already committed is skipped.
+    """
+
+    def __init__(self, path=JOBS_DB_PATH, workers=INGEST_WORKERS):
+        self.path = path
+        self.handlers = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        self._lock = threading.Lock()
+        self.stopping = threading.Event()
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL,"
+            " stage TEXT, params TEXT NOT NULL, progress TEXT NOT NULL, error TEXT,"
+            " created_at REAL NOT NULL, started_at REAL, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def register(self, kind, handler):
+        self.handlers[kind] = handler
+
+    def submit(self, kind, **params):
+        """Persist a new job and queue it; returns the job ID."""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, status, stage, params, progress, created_at, updated_at)"
+                " VALUES (?, ?, 'queued', 'queued', ?, '{}', ?, ?)",
+                (job_id, kind, json.dumps(params), now, now)
+            )
+            self._conn.commit()
+        self._executor.submit(self._run, job_id, kind, params)
+        return job_id
+
+    def get(self, job_id):
+        """Return the job as a dict (with derived throughput), or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, kind, status, stage, progress, error, created_at, started_at, updated_at"
+                " FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, kind, status, stage, progress, error, created_at, started_at, updated_at = row
+        progress = json.loads(progress)
+        end = updated_at if status in FINAL_STATUSES else time.time()
+        elapsed = (end - started_at) if started_at else 0.0
+        return {
+            "id": job_id,
+            "kind": kind,
+            "status": status,
+            "stage": stage,
+            "progress": progress,
+            "error": error,
+            "created_at": created_at,
+            "started_at": started_at,
+            "updated_at": updated_at,
+            "elapsed": elapsed,
+            "chunks_per_sec": (progress.get("chunks", 0) / elapsed) if elapsed else 0.0,
+        }
+
+    def cancel(self, job_id):
+        """Ask a job to stop. Returns False if it does not exist or is already finished."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = 'cancelling', updated_at = ?"
+                " WHERE id = ? AND status IN ('queued', 'running')",
+                (time.time(), job_id)
+            )
+            self._conn.commit()
+        return cur.rowcount > 0
+
+    def resume_interrupted(self, before=None):
+        """
+        Re-queue jobs that were queued or running when the process last
+        stopped. With `before`, only jobs last updated before that timestamp
+        are considered, so jobs submitted since (e.g. to another worker
+        process) are left alone.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, kind, status, params FROM jobs WHERE status IN (?, ?, ?) AND updated_at < ?",
+                (*ACTIVE_STATUSES, time.time() if before is None else before)
+            ).fetchall()
+        resumed = 0
+        for job_id, kind, status, params in rows:
+            if status == "cancelling" or kind not in self.handlers:
+                self._finish(job_id, "cancelled")
+                continue
+            with self._lock:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'queued', stage = 'resuming', updated_at = ? WHERE id = ?",
+                    (time.time(), job_id)
+                )
+                self._conn.commit()
+            self._executor.submit(self._run, job_id, kind, json.loads(params))
+            resumed += 1
+        return resumed
+
+    def active_input_paths(self):
+        """File paths referenced by the params of queued or running jobs."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT params FROM jobs WHERE status IN (?, ?, ?)", ACTIVE_STATUSES
+            ).fetchall()
+        paths = []
+        for (params,) in rows:
+            params = json.loads(params)
+            paths.extend(v for k, v in params.items() if k.endswith("_path"))
+        return paths
+
+    def shutdown(self, wait=False):
+        """
+        Stop taking work. Queued jobs stay queued and running handlers are
+        asked to stop at their next checkpoint; their jobs keep an active
+        status so the next start resumes them.
+        """
+        self.stopping.set()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _status(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def _update(self, job_id, stage=None, progress=None, **columns):
+        with self._lock:
+            if progress:
+                row = self._conn.execute("SELECT progress FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                merged = json.loads(row[0]) if row else {}
+                merged.update(progress)
+                columns["progress"] = json.dumps(merged)
+            if stage:
+                columns["stage"] = stage
+            columns["updated_at"] = time.time()
+            assignments = ", ".join(f"{name} = ?" for name in columns)
+            self._conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ?", (*columns.values(), job_id)
+            )
+            self._conn.commit()
+
+    def _finish(self, job_id, status, error=None):
+        self._update(job_id, stage=status, status=status, error=error)
+
+    def _run(self, job_id, kind, params):
+        if self.stopping.is_set():
+            return
+        now = time.time()
+        with self._lock:
+            # Only a still-queued job may start; a cancel may have landed meanwhile
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = 'running', stage = 'starting', started_at = ?, updated_at = ?"
+                " WHERE id = ? AND status = 'queued'",
+                (now, now, job_id)
+            )
+            self._conn.commit()
+        if cur.rowcount == 0:
+            self._finish(job_id, "cancelled")
+            return
+        job = Job(self, job_id, params)
+        try:
+            self.handlers[kind](job, **params)
+        except JobCancelled:
+            if not self.stopping.is_set():
+                self._finish(job_id, "cancelled")
+            return
+        except Exception as e:
+            print(f"Job {job_id} ({kind}) failed: {e}")
+            self._finish(job_id, "failed", error=str(e))
+            return
+        if self.stopping.is_set() and self._status(job_id) == "running":
+            # Stopped by a shutdown, possibly part-way: leave it to be resumed
+            return
+        self._finish(job_id, "cancelled" if job.is_cancelled() else "completed")
@@ -0,0 +1,166 @@
+import os
+import re
+import json
+import sqlite3
+import threading
+
+from langchain.schema import Document
+
+from get_vector_db import get_vector_db, CHROMA_PATH
+
+LEXICAL_INDEX_ENABLED = os.getenv('LEXICAL_INDEX_ENABLED', 'true').lower() == 'true'
+LEXICAL_INDEX_PATH = os.getenv('LEXICAL_INDEX_PATH', CHROMA_PATH.rstrip('/\\') + '_lexical.sqlite3')
+
+# Product codes, error strings and names: keep '-', '.', '/' and ':' inside a term
+_TERM = re.compile(r"\w[\w\-./:]*\w|\w")
+
+
+def identifier_terms(text):
+    """Query terms that look like codes or error strings rather than words (contain a digit or -_./:)."""
+    return [t for t in _TERM.findall(text) if any(ch.isdigit() or ch in "-_./:" for ch in t)]
+
+
+def match_expression(text, operator="OR"):
+    """Build an FTS5 MATCH expression that searches each query term as a quoted phrase."""
+    terms = []
+    for term in _TERM.findall(text):
+        phrase = '"' + term.replace('"', '""') + '"'
+        if phrase not in terms:
+            terms.append(phrase)
+    return f" {operator} ".join(terms)
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over the chunks in the vector store, kept in an
+    SQLite FTS5 table next to CHROMA_PATH. Rows are keyed by the same
+    deterministic chunk IDs as Chroma, so the ingest paths update it
+    incrementally alongside every upsert and delete. filename and domain are
+    stored as plain columns so searches take the same filters as the vector
+    store.
+    """
+
+    def __init__(self, path=LEXICAL_INDEX_PATH):
+        self._lock = threading.Lock()
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+                " text, chunk_id UNINDEXED, filename UNINDEXED, domain UNINDEXED, metadata UNINDEXED,"
+                " tokenize = 'porter unicode61')"
+            )
+            # FTS5 cannot index chunk_id, so deletes go through this rowid map
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunk_rows (chunk_id TEXT PRIMARY KEY, row INTEGER NOT NULL)"
+            )
+
+    def upsert(self, ids, docs):
+        """Index (or re-index) chunks under their store IDs."""
+        if not ids:
+            return
+        with self._lock, self._conn:
+            self._delete(ids)
+            rows = []
+            for chunk_id, d in zip(ids, docs):
+                cur = self._conn.execute(
+                    "INSERT INTO chunks (text, chunk_id, filename, domain, metadata) VALUES (?, ?, ?, ?, ?)",
+                    (d.page_content, chunk_id, d.metadata.get("filename"), d.metadata.get("domain"),
+                     json.dumps(d.metadata))
+                )
+                rows.append((chunk_id, cur.lastrowid))
+            self._conn.executemany("INSERT OR REPLACE INTO chunk_rows (chunk_id, row) VALUES (?, ?)", rows)
+
+    def delete(self, ids):
+        if not ids:
+            return
+        with self._lock, self._conn:
+            self._delete(ids)
+
+    def _delete(self, ids):
+        ids = list(ids)
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            marks = ",".join("?" * len(part))
+            self._conn.execute(
+                f"DELETE FROM chunks WHERE rowid IN (SELECT row FROM chunk_rows WHERE chunk_id IN ({marks}))",
+                part
+            )
+            self._conn.execute(f"DELETE FROM chunk_rows WHERE chunk_id IN ({marks})", part)
+
+    def search(self, text, k=8, metadata_filter=None, operator="OR"):
+        """
+        Return [(doc, bm25)] best first; bm25 is positive, higher is better.
+        metadata_filter takes the vector store's {"filename": ...} / {"domain": ...} form.
+        """
+        expression = match_expression(text, operator)
+        if not expression:
+            return []
+        sql = "SELECT text, metadata, -bm25(chunks) FROM chunks WHERE chunks MATCH ?"
+        params = [expression]
+        for field, value in (metadata_filter or {}).items():
+            if field not in ("filename", "domain"):
+                raise ValueError(f"Unsupported lexical filter: {field}")
+            sql += f" AND {field} = ?"
+            params.append(value)
+        sql += " ORDER BY bm25(chunks) LIMIT ?"
+        params.append(k)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [(Document(page_content=t, metadata=json.loads(m)), score) for t, m, score in rows]
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM chunks LIMIT 1").fetchone() is None
+
+    def rebuild(self, db, page_size=5000):
+        """Index every chunk already in the collection. Only needed for stores that predate the index."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM chunk_rows")
+        indexed = 0
+        offset = 0
+        while True:
+            page = db.get(include=["metadatas", "documents"], limit=page_size, offset=offset)
+            ids = page.get("ids") or []
+            if not ids:
+                break
+            docs = [
+                Document(page_content=text or "", metadata=meta or {})
+                for text, meta in zip(page.get("documents") or [], page.get("metadatas") or [])
+            ]
+            self.upsert(ids, docs)
+            indexed += len(ids)
+            offset += len(ids)
+        return indexed
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_lexical_index():
+    """
+    Return the shared lexical index, building it from the vector store the
+    first time it is empty. Returns None when it is disabled or this SQLite
+    build lacks FTS5.
+    """
+    global _index, LEXICAL_INDEX_ENABLED
+    if not LEXICAL_INDEX_ENABLED:
+        return None
+    with _index_lock:
+        if _index is None:
+            try:
+                index = LexicalIndex()
+            except sqlite3.OperationalError as e:
+                print(f"Lexical index unavailable, using vector search only: {e}")
+                LEXICAL_INDEX_ENABLED = False
+                return None
+            if index.is_empty():
+                rebuilt = index.rebuild(get_vector_db())
+                if rebuilt:
+                    print(f"Built lexical index from the vector store ({rebuilt} chunks)")
+            _index = index
+        return _index
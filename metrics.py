@@ -0,0 +1,165 @@
+import os
+import time
+import uuid
+import contextvars
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+)
+
+TRACE_HEADERS = os.getenv('TRACE_HEADERS', 'true').lower() == 'true'
+SLOW_REQUEST_SECONDS = float(os.getenv('SLOW_REQUEST_SECONDS', '10'))  # 0 = log nothing
+
+# Buckets reach minutes: a multi-query answer on a CPU-only Ollama can take that long
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 100000)
+
+REQUEST_SECONDS = Histogram(
+    "rag_request_seconds", "HTTP request latency", ["endpoint", "method", "status"], buckets=LATENCY_BUCKETS
+)
+STREAM_SECONDS = Histogram(
+    "rag_stream_seconds", "Time until a streamed response finished sending", ["endpoint"], buckets=LATENCY_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds", "Time spent in one stage of an operation", ["operation", "stage"], buckets=LATENCY_BUCKETS
+)
+ITEMS = Histogram(
+    "rag_items", "Items handled per operation (chunks, tokens, variants, ...)", ["operation", "item"],
+    buckets=SIZE_BUCKETS
+)
+OLLAMA_SECONDS = Histogram(
+    "rag_ollama_seconds", "Latency of Ollama API calls", ["call"], buckets=LATENCY_BUCKETS
+)
+OLLAMA_ERRORS = Counter("rag_ollama_errors_total", "Failed Ollama API calls", ["call"])
+EMBED_CHUNKS = Counter("rag_embed_chunks_total", "Chunks embedded by Ollama")
+EMBED_TOKENS = Counter("rag_embed_tokens_total", "Prompt tokens embedded by Ollama")
+EMBED_BATCHES = Counter("rag_embed_batches_total", "Embedding batches sent to Ollama, retries included", ["outcome"])
+EMBED_CONCURRENCY = Gauge(
+    "rag_embed_concurrency", "Embedding batches the adaptive limiter lets run at once", multiprocess_mode="livesum"
+)
+EMBED_CACHE_LOOKUPS = Counter(
+    "rag_embedding_cache_lookups_total", "Embedding cache lookups by result (hit, miss)", ["result"]
+)
+CRAWL_FETCH_SECONDS = Histogram(
+    "rag_crawl_fetch_seconds", "Latency of crawler fetches, retries included", ["kind", "outcome"],
+    buckets=LATENCY_BUCKETS
+)
+
+# livesum: under serve.py with several workers, the sum over the live worker processes
+ADMISSION_ACTIVE = Gauge("rag_admission_active", "Admitted requests in progress", multiprocess_mode="livesum")
+ADMISSION_QUEUED = Gauge("rag_admission_queued", "Requests waiting for admission", multiprocess_mode="livesum")
+ADMISSION_REJECTED = Counter("rag_admission_rejected_total", "Requests refused with 503", ["reason"])
+
+_trace = contextvars.ContextVar("rag_trace", default=None)
+
+
+class Trace:
+    """Stage timings and counts of one request, reported in its headers and the slow-request log."""
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.started = time.monotonic()
+        self.stages = {}
+        self.counts = {}
+
+    def add_stage(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_count(self, name, n):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def server_timing(self):
+        """Server-Timing header value; browsers' dev tools show it as a breakdown."""
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+    def summary(self):
+        return {
+            "request_id": self.request_id,
+            "elapsed": round(self.elapsed(), 4),
+            "stages": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            "counts": dict(self.counts),
+        }
+
+
+def begin_trace(request_id=None):
+    """Start a trace for the current request; returns (trace, token for end_trace)."""
+    trace = Trace(request_id)
+    return trace, _trace.set(trace)
+
+
+def resume_trace(trace):
+    """Make an existing trace current again, e.g. while a streamed body is sent; returns a token for end_trace."""
+    return _trace.set(trace)
+
+
+def end_trace(token):
+    try:
+        _trace.reset(token)
+    except ValueError:
+        pass  # a streamed body finalised from another context; nothing to restore
+
+
+def current_trace():
+    return _trace.get()
+
+
+@contextmanager
+def stage(operation, name, trace=None):
+    """Time a block into rag_stage_seconds and the current (or given) trace."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(operation, name, time.perf_counter() - started, trace)
+
+
+def record_stage(operation, name, seconds, trace=None):
+    STAGE_SECONDS.labels(operation, name).observe(seconds)
+    trace = trace or _trace.get()
+    if trace is not None:
+        trace.add_stage(f"{operation}.{name}", seconds)
+
+
+def record_items(operation, item, n, trace=None):
+    ITEMS.labels(operation, item).observe(n)
+    trace = trace or _trace.get()
+    if trace is not None:
+        trace.add_count(f"{operation}.{item}", n)
+
+
+def record_ollama(call, seconds, ok=True):
+    if ok:
+        OLLAMA_SECONDS.labels(call).observe(seconds)
+    else:
+        OLLAMA_ERRORS.labels(call).inc()
+    trace = _trace.get()
+    if trace is not None:
+        trace.add_count(f"ollama.{call}", 1)
+
+
+def log_if_slow(trace, label):
+    elapsed = trace.elapsed()
+    if SLOW_REQUEST_SECONDS and elapsed >= SLOW_REQUEST_SECONDS:
+        stages = ", ".join(f"{name}={seconds:.2f}s" for name, seconds in
+                           sorted(trace.stages.items(), key=lambda item: item[1], reverse=True))
+        counts = ", ".join(f"{name}={n}" for name, n in trace.counts.items())
+        print(f"Slow request {trace.request_id} {label}: {elapsed:.2f}s [{stages}] [{counts}]")
+
+
+def render():
+    """
+    (body, content type) of the Prometheus exposition. When
+    PROMETHEUS_MULTIPROC_DIR is set (serve.py does so for several workers),
+    the values of every worker process are aggregated.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,69 @@
+"""
+Copy a single-collection store into per-file / per-domain shards.
+
+    python migrate_shards.py [--page-size 1000] [--delete-source]
+
+Stored vectors are copied as they are, so nothing is re-embedded. The copy
+is an upsert, so an interrupted migration can simply be run again. Set
+VECTOR_SHARDING=true once it has finished.
+"""
+import argparse
+import time
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from get_vector_db import get_chroma, get_chroma_client, ShardedVectorStore, COLLECTION_NAME
+
+
+def migrate(page_size=1000, delete_source=False):
+    source = get_chroma(COLLECTION_NAME)
+    store = ShardedVectorStore(COLLECTION_NAME)
+    total = source._collection.count()
+    print(f"Migrating {total} chunks from '{COLLECTION_NAME}' into shards")
+
+    started = time.monotonic()
+    copied, unroutable, offset = 0, 0, 0
+    while True:
+        page = source._collection.get(
+            include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset
+        )
+        ids = page["ids"]
+        if not ids:
+            break
+        groups = {}
+        for chunk_id, vector, text, meta in zip(ids, page["embeddings"], page["documents"], page["metadatas"]):
+            name = store.route(meta)
+            if name is None:
+                unroutable += 1
+                continue
+            group = groups.setdefault(name, {"ids": [], "embeddings": [], "documents": [], "metadatas": []})
+            group["ids"].append(chunk_id)
+            group["embeddings"].append(vector)
+            group["documents"].append(text)
+            group["metadatas"].append(meta)
+        for name, group in groups.items():
+            get_chroma(name)._collection.upsert(**group)
+            copied += len(group["ids"])
+        offset += len(ids)
+        print(f"  {offset}/{total} chunks read, {len(groups)} shards written in this page")
+
+    print(
+        f"Copied {copied} chunks in {time.monotonic() - started:.1f}s"
+        + (f"; {unroutable} chunks without filename/domain/url metadata were left behind" if unroutable else "")
+    )
+    if delete_source:
+        if unroutable:
+            print(f"Keeping '{COLLECTION_NAME}' because some chunks could not be migrated")
+        else:
+            get_chroma_client().delete_collection(COLLECTION_NAME)
+            print(f"Deleted the single collection '{COLLECTION_NAME}'")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split the single Chroma collection into per-source shards.")
+    parser.add_argument("--page-size", type=int, default=1000, help="chunks copied per round trip")
+    parser.add_argument("--delete-source", action="store_true",
+                        help="drop the single collection after a complete migration")
+    args = parser.parse_args()
+    migrate(page_size=args.page_size, delete_source=args.delete_source)
@@ -0,0 +1,567 @@
+"""
+Compact vector store on memory-mapped NumPy arrays.
+
+    python numpy_store.py import [--collection NAME]   # copy a Chroma collection
+    python numpy_store.py build-ivf [--lists N]        # (re)build the IVF coarse index
+    python numpy_store.py compact                      # drop deleted rows from disk
+    python numpy_store.py benchmark [--queries 200]    # recall/latency against Chroma
+"""
+import os
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process write lock
+    fcntl = None
+
+from get_vector_db import CHROMA_PATH, COLLECTION_NAME, get_embedding_function
+
+NUMPY_STORE_PATH = os.getenv('NUMPY_STORE_PATH', CHROMA_PATH.rstrip('/\\') + '_numpy')
+NUMPY_STORE_DTYPE = os.getenv('NUMPY_STORE_DTYPE', 'int8')  # int8 or float16
+NUMPY_IVF_LISTS = int(os.getenv('NUMPY_IVF_LISTS', '0'))  # 0 = brute force only
+NUMPY_IVF_PROBES = int(os.getenv('NUMPY_IVF_PROBES', '8'))
+NUMPY_IVF_MIN_ROWS = int(os.getenv('NUMPY_IVF_MIN_ROWS', '50000'))  # smaller stores are always brute-forced
+
+# Metadata fields that get a columnar (dictionary-encoded) index for filtering
+FILTER_FIELDS = ("filename", "domain", "url")
+SEARCH_BLOCK_ROWS = 65536
+DTYPES = {"int8": np.int8, "float16": np.float16}
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Vectors are L2-normalized and stored as int8 (with a float32 scale per
+    row) or float16 in memory-mapped .npy files that grow by doubling.
+    filename/domain/url are kept as dictionary-encoded int32 columns so
+    filters are a vectorized comparison; ids, texts and full metadata live
+    in an SQLite sidecar keyed by row number. Deleted rows are tombstoned
+    until compact().
+
+    Search is blockwise brute force over the quantized matrix. When an IVF
+    index has been built (build_ivf) and the store is large, only the rows
+    of the NUMPY_IVF_PROBES nearest centroids are scored. Distances are
+    squared L2 between normalized vectors, the same scale Chroma reports.
+    """
+
+    def __init__(self, path, embedding_function, dtype=NUMPY_STORE_DTYPE):
+        self.path = path
+        self._embedding = embedding_function
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(path, "payload.sqlite3"), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS rows ("
+                " row INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, document TEXT, metadata TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS codes ("
+                " field TEXT NOT NULL, value TEXT NOT NULL, code INTEGER NOT NULL, PRIMARY KEY (field, value))"
+            )
+        self._manifest = {"dim": None, "dtype": dtype, "count": 0, "capacity": 0, "ivf_lists": 0}
+        self._manifest_mtime = None
+        self._arrays = {}
+        self._centroids = None
+        self._refresh()
+        if self._manifest["dtype"] != dtype:
+            print(f"{path} stores {self._manifest['dtype']} vectors; ignoring NUMPY_STORE_DTYPE={dtype}")
+
+    # -- files ---------------------------------------------------------------------------
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _array_specs(self):
+        """name -> (dtype, per-row shape, fill value) of every per-row array."""
+        m = self._manifest
+        specs = {
+            "vectors": (DTYPES[m["dtype"]], (m["dim"],), 0),
+            "alive": (np.uint8, (), 0),
+        }
+        if m["dtype"] == "int8":
+            specs["scales"] = (np.float32, (), 0)
+        for field in FILTER_FIELDS:
+            specs[f"col_{field}"] = (np.int32, (), -1)
+        if m["ivf_lists"]:
+            specs["ivf"] = (np.int32, (), -1)
+        return specs
+
+    def _refresh(self):
+        """Reopen the arrays when another process (or compact) rewrote the manifest."""
+        manifest_path = self._file("manifest.json")
+        try:
+            mtime = os.stat(manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._manifest_mtime:
+            return
+        with open(manifest_path) as f:
+            self._manifest = json.load(f)
+        self._manifest_mtime = mtime
+        self._arrays = {}
+        if self._manifest["capacity"]:
+            for name in self._array_specs():
+                self._arrays[name] = open_memmap(self._file(f"{name}.npy"), mode="r+")
+        self._centroids = np.load(self._file("centroids.npy")) if self._manifest["ivf_lists"] else None
+
+    def _write_manifest(self):
+        for array in self._arrays.values():
+            array.flush()
+        tmp = self._file("manifest.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self._manifest, f)
+        os.replace(tmp, self._file("manifest.json"))
+        self._manifest_mtime = os.stat(self._file("manifest.json")).st_mtime_ns
+
+    @contextmanager
+    def _writing(self):
+        """Serialize writers across threads and, where supported, across processes."""
+        with self._lock:
+            lock_file = open(self._file("write.lock"), "w")
+            try:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._refresh()
+                yield
+            finally:
+                lock_file.close()
+
+    def _grow(self, needed):
+        """Make room for `needed` rows, doubling the files' capacity."""
+        m = self._manifest
+        if needed <= m["capacity"]:
+            return
+        capacity = max(1024, m["capacity"] * 2, needed)
+        for name, (dtype, shape, fill) in self._array_specs().items():
+            grown = open_memmap(self._file(f"{name}.npy.tmp"), mode="w+", dtype=dtype, shape=(capacity, *shape))
+            grown[m["count"]:] = fill
+            if name in self._arrays:
+                grown[:m["count"]] = self._arrays[name][:m["count"]]
+            grown.flush()
+            del grown
+            os.replace(self._file(f"{name}.npy.tmp"), self._file(f"{name}.npy"))
+            self._arrays[name] = open_memmap(self._file(f"{name}.npy"), mode="r+")
+        m["capacity"] = capacity
+
+    def _code(self, field, value, create=False):
+        row = self._conn.execute(
+            "SELECT code FROM codes WHERE field = ? AND value = ?", (field, value)
+        ).fetchone()
+        if row or not create:
+            return row[0] if row else None
+        code = self._conn.execute(
+            "SELECT COALESCE(MAX(code), -1) + 1 FROM codes WHERE field = ?", (field,)
+        ).fetchone()[0]
+        self._conn.execute("INSERT INTO codes (field, value, code) VALUES (?, ?, ?)", (field, value, code))
+        return code
+
+    # -- writes --------------------------------------------------------------------------
+
+    def add_vectors(self, ids, vectors, documents, metadatas):
+        """Insert or replace rows whose vectors are already computed."""
+        latest = {}
+        for chunk_id, vector, text, meta in zip(ids, vectors, documents, metadatas):
+            latest[chunk_id] = (vector, text, meta or {})
+        if not latest:
+            return []
+        ids = list(latest)
+        vectors = normalize([v for v, _, _ in latest.values()])
+
+        with self._writing(), self._conn:
+            m = self._manifest
+            if m["dim"] is None:
+                m["dim"] = int(vectors.shape[1])
+            elif vectors.shape[1] != m["dim"]:
+                raise ValueError(f"Vector dimension {vectors.shape[1]} does not match the store ({m['dim']})")
+            replaced = self._drop_payload(ids)
+
+            start, n = m["count"], len(ids)
+            self._grow(start + n)
+            end = start + n
+            if m["dtype"] == "int8":
+                scales = np.abs(vectors).max(axis=1) / 127.0
+                scales[scales == 0] = 1.0
+                self._arrays["vectors"][start:end] = np.round(vectors / scales[:, None]).astype(np.int8)
+                self._arrays["scales"][start:end] = scales
+            else:
+                self._arrays["vectors"][start:end] = vectors.astype(np.float16)
+            self._arrays["alive"][start:end] = 1
+            for field in FILTER_FIELDS:
+                self._arrays[f"col_{field}"][start:end] = [
+                    self._code(field, meta[field], create=True) if isinstance(meta.get(field), str) else -1
+                    for _, _, meta in latest.values()
+                ]
+            if self._centroids is not None:
+                self._arrays["ivf"][start:end] = np.argmax(vectors @ self._centroids.T, axis=1)
+
+            self._conn.executemany(
+                "INSERT INTO rows (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+                [(start + i, chunk_id, text, json.dumps(meta))
+                 for i, (chunk_id, (_, text, meta)) in enumerate(latest.items())]
+            )
+            if replaced:
+                self._arrays["alive"][replaced] = 0
+            m["count"] = end
+            self._write_manifest()
+        return ids
+
+    def _drop_payload(self, ids):
+        """Remove ids from the sidecar and return their rows, which the caller then tombstones."""
+        rows = []
+        for start in range(0, len(ids), 500):
+            part = list(ids[start:start + 500])
+            marks = ",".join("?" * len(part))
+            rows += [r for (r,) in self._conn.execute(f"SELECT row FROM rows WHERE id IN ({marks})", part)]
+            self._conn.execute(f"DELETE FROM rows WHERE id IN ({marks})", part)
+        return rows
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        if ids is None:
+            raise ValueError("NumpyVectorStore needs explicit ids")
+        vectors = self._embedding.embed_documents(texts)
+        return self.add_vectors(ids, vectors, texts, metadatas or [{} for _ in texts])
+
+    def delete(self, ids=None, where=None, **kwargs):
+        with self._writing(), self._conn:
+            if ids is None:
+                if not where:
+                    return
+                ids = [p[0] for p in self._payload(np.flatnonzero(self._mask(where)))]
+            elif where:
+                # Only delete the listed ids that also match the filter
+                allowed = set(self.get(where=where, include=())["ids"])
+                ids = [i for i in ids if i in allowed]
+            rows = self._drop_payload(list(ids))
+            if rows:
+                self._arrays["alive"][rows] = 0
+            self._write_manifest()
+
+    def compact(self):
+        """Rewrite the arrays without tombstoned rows and renumber the sidecar."""
+        with self._writing(), self._conn:
+            m = self._manifest
+            keep = np.flatnonzero(self._arrays["alive"][:m["count"]]) if m["count"] else np.array([], dtype=int)
+            self._conn.execute("CREATE TEMP TABLE remap (old INTEGER PRIMARY KEY, new INTEGER)")
+            self._conn.executemany("INSERT INTO remap VALUES (?, ?)", [(int(o), n) for n, o in enumerate(keep)])
+            self._conn.execute("UPDATE rows SET row = -1 - (SELECT new FROM remap WHERE old = rows.row)")
+            self._conn.execute("UPDATE rows SET row = -1 - row")
+            self._conn.execute("DROP TABLE remap")
+            for name, array in self._arrays.items():
+                array[:len(keep)] = array[keep]
+                array[len(keep):m["count"]] = self._array_specs()[name][2]
+            removed = m["count"] - len(keep)
+            m["count"] = len(keep)
+            self._write_manifest()
+        return removed
+
+    # -- reads ---------------------------------------------------------------------------
+
+    def _mask(self, where):
+        m = self._manifest
+        mask = self._arrays["alive"][:m["count"]].astype(bool) if m["count"] else np.zeros(0, dtype=bool)
+        for field, value in (where or {}).items():
+            if field == "$and":
+                for clause in value:
+                    mask &= self._mask(clause)
+                continue
+            if field not in FILTER_FIELDS:
+                raise ValueError(f"NumpyVectorStore can only filter on {', '.join(FILTER_FIELDS)}")
+            if isinstance(value, dict):
+                value = value.get("$eq")
+            code = self._code(field, value)
+            if code is None:
+                return np.zeros(m["count"], dtype=bool)
+            mask &= self._arrays[f"col_{field}"][:m["count"]] == code
+        return mask
+
+    def _payload(self, rows):
+        found = {}
+        rows = [int(r) for r in rows]
+        for start in range(0, len(rows), 500):
+            part = rows[start:start + 500]
+            marks = ",".join("?" * len(part))
+            for row, chunk_id, text, meta in self._conn.execute(
+                f"SELECT row, id, document, metadata FROM rows WHERE row IN ({marks})", part
+            ):
+                found[row] = (chunk_id, text, json.loads(meta))
+        return [found[r] for r in rows if r in found]
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("metadatas", "documents"), **kwargs):
+        with self._lock:
+            self._refresh()
+            if ids is not None:
+                marks = ",".join("?" * len(ids))
+                rows = [r for (r,) in self._conn.execute(
+                    f"SELECT row FROM rows WHERE id IN ({marks}) ORDER BY row", list(ids)
+                )] if ids else []
+                if where:
+                    mask = self._mask(where)
+                    rows = [r for r in rows if mask[r]]
+            else:
+                rows = np.flatnonzero(self._mask(where)) if self._manifest["count"] else []
+            start = offset or 0
+            rows = rows[start:None if limit is None else start + limit]
+            payload = self._payload(rows)
+        result = {"ids": [p[0] for p in payload]}
+        if "documents" in include:
+            result["documents"] = [p[1] for p in payload]
+        if "metadatas" in include:
+            result["metadatas"] = [p[2] for p in payload]
+        return result
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, filter=None, **kwargs):
+        """Return [(doc, distance)], nearest first."""
+        query = normalize(embedding)
+        with self._lock:
+            self._refresh()
+            m = self._manifest
+            if not m["count"]:
+                return []
+            mask = self._mask(filter)
+            if self._centroids is not None and m["count"] >= NUMPY_IVF_MIN_ROWS:
+                probes = np.argsort(-(self._centroids @ query))[:NUMPY_IVF_PROBES]
+                mask &= np.isin(self._arrays["ivf"][:m["count"]], probes)
+
+            best_rows, best_scores = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+            for start in range(0, m["count"], SEARCH_BLOCK_ROWS):
+                block = mask[start:start + SEARCH_BLOCK_ROWS]
+                if not block.any():
+                    continue
+                rows = np.flatnonzero(block) + start
+                # Contiguous slices read straight from the mapping; sparse ones gather only their rows
+                if len(rows) == len(block):
+                    vectors = self._arrays["vectors"][start:start + len(block)]
+                else:
+                    vectors = self._arrays["vectors"][rows]
+                scores = vectors.astype(np.float32) @ query
+                if m["dtype"] == "int8":
+                    scores *= self._arrays["scales"][rows]
+                best_rows = np.concatenate([best_rows, rows])
+                best_scores = np.concatenate([best_scores, scores])
+                if len(best_rows) > k:
+                    top = np.argpartition(-best_scores, k)[:k]
+                    best_rows, best_scores = best_rows[top], best_scores[top]
+            order = np.argsort(-best_scores)
+            best_rows, best_scores = best_rows[order], best_scores[order]
+            payload = self._payload(best_rows)
+        return [
+            (Document(page_content=text, metadata=meta), float(2.0 - 2.0 * score))
+            for (_, text, meta), score in zip(payload, best_scores)
+        ]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector_with_relevance_scores(
+            self._embedding.embed_query(query), k=k, filter=filter
+        )
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        return self._euclidean_relevance_score_fn
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def count(self):
+        with self._lock:
+            self._refresh()
+            m = self._manifest
+            return int(self._arrays["alive"][:m["count"]].sum()) if m["count"] else 0
+
+    def persist(self):
+        """Writes are flushed as they happen; kept for callers written against Chroma."""
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, path=NUMPY_STORE_PATH, **kwargs):
+        store = cls(path, embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    # -- IVF -----------------------------------------------------------------------------
+
+    def build_ivf(self, lists, iterations=10, sample_size=100000):
+        """Train a spherical k-means coarse quantizer on a sample and assign every row to a list."""
+        with self._writing():
+            m = self._manifest
+            live = np.flatnonzero(self._arrays["alive"][:m["count"]]) if m["count"] else []
+            if len(live) < lists:
+                raise ValueError(f"Need at least {lists} vectors to build {lists} IVF lists")
+            rng = np.random.default_rng(0)
+            sample = np.sort(rng.choice(live, size=min(sample_size, len(live)), replace=False))
+            data = self._dequantize(sample)
+            centroids = data[rng.choice(len(data), size=lists, replace=False)]
+            for _ in range(iterations):
+                assign = np.argmax(data @ centroids.T, axis=1)
+                for c in range(lists):
+                    members = data[assign == c]
+                    if len(members):
+                        centroids[c] = members.mean(axis=0)
+                centroids = normalize(centroids)
+
+            np.save(self._file("centroids.npy"), centroids.astype(np.float32))
+            m["ivf_lists"] = lists
+            path = self._file("ivf.npy")
+            ivf = open_memmap(path, mode="w+", dtype=np.int32, shape=(m["capacity"],))
+            ivf[:] = -1
+            for start in range(0, m["count"], SEARCH_BLOCK_ROWS):
+                rows = np.arange(start, min(start + SEARCH_BLOCK_ROWS, m["count"]))
+                ivf[rows] = np.argmax(self._dequantize(rows) @ centroids.T, axis=1)
+            ivf.flush()
+            self._arrays["ivf"] = ivf
+            self._centroids = centroids.astype(np.float32)
+            self._write_manifest()
+
+    def _dequantize(self, rows):
+        vectors = self._arrays["vectors"][rows].astype(np.float32)
+        if self._manifest["dtype"] == "int8":
+            vectors *= self._arrays["scales"][rows][:, None]
+        return normalize(vectors)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_numpy_store(collection_name=COLLECTION_NAME):
+    with _stores_lock:
+        store = _stores.get(collection_name)
+        if store is None:
+            store = NumpyVectorStore(os.path.join(NUMPY_STORE_PATH, collection_name), get_embedding_function())
+            _stores[collection_name] = store
+        return store
+
+
+def import_chroma(collection_name=COLLECTION_NAME, page_size=1000):
+    """Copy a Chroma collection's stored vectors, texts and metadata into the NumPy store."""
+    from get_vector_db import get_chroma
+    source = get_chroma(collection_name)._collection
+    store = get_numpy_store(collection_name)
+    total, offset = source.count(), 0
+    started = time.monotonic()
+    while True:
+        page = source.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        store.add_vectors(page["ids"], page["embeddings"], page["documents"], page["metadatas"])
+        offset += len(page["ids"])
+        print(f"  {offset}/{total} chunks imported")
+    print(f"Imported {offset} chunks into {store.path} in {time.monotonic() - started:.1f}s")
+    return offset
+
+
+def benchmark(collection_name=COLLECTION_NAME, queries=200, k=10, limit=None):
+    """
+    Measure recall@k and latency of Chroma (HNSW over raw vectors, L2) and
+    of the NumPy store (quantized, cosine), each against exact float32
+    search in its own metric over Chroma's vectors. Query vectors are
+    stored vectors with noise added, so every query has true neighbours.
+    """
+    from get_vector_db import get_chroma
+    chroma = get_chroma(collection_name)._collection
+    store = get_numpy_store(collection_name)
+    page = chroma.get(include=["embeddings", "documents", "metadatas"], limit=limit)
+    ids = np.array(page["ids"])
+    if not len(ids):
+        print("Nothing to benchmark: the Chroma collection is empty")
+        return None
+    raw = np.asarray(page["embeddings"], dtype=np.float32)
+    unit = normalize(raw)
+    by_content = {
+        (text, json.dumps(meta or {}, sort_keys=True)): chunk_id
+        for chunk_id, text, meta in zip(page["ids"], page["documents"], page["metadatas"])
+    }
+
+    rng = np.random.default_rng(0)
+    picks = rng.choice(len(ids), size=min(queries, len(ids)), replace=False)
+    spread = raw.std(axis=0).mean()
+    probes = raw[picks] + rng.normal(scale=0.1 * spread, size=raw[picks].shape).astype(np.float32)
+    l2_truth = [set(ids[np.argsort(((raw - q) ** 2).sum(axis=1))[:k]]) for q in probes]
+    cosine_truth = [set(ids[np.argsort(-(unit @ q))[:k]]) for q in normalize(probes)]
+
+    def measure(name, search, truth):
+        latencies, recalls = [], []
+        for q, expected in zip(probes, truth):
+            started = time.perf_counter()
+            found = search(q)
+            latencies.append((time.perf_counter() - started) * 1000)
+            recalls.append(len(expected & set(found)) / len(expected))
+        row = {
+            "backend": name,
+            "recall": float(np.mean(recalls)),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+        }
+        print(f"{name:>24}  recall@{k} {row['recall']:.3f}  p50 {row['p50_ms']:.2f} ms  p95 {row['p95_ms']:.2f} ms")
+        return row
+
+    def numpy_search(q):
+        results = store.similarity_search_by_vector_with_relevance_scores(q, k=k)
+        # Map hits back to ids through the text + metadata the store returns
+        return [by_content.get((d.page_content, json.dumps(d.metadata, sort_keys=True))) for d, _ in results]
+
+    def chroma_search(q):
+        return chroma.query(query_embeddings=[q.tolist()], n_results=k)["ids"][0]
+
+    print(f"{len(ids)} vectors, {len(probes)} queries, k={k}")
+    rows = [measure("chroma (hnsw)", chroma_search, l2_truth)]
+    rows.append(measure(f"numpy ({store._manifest['dtype']}, brute)", numpy_search, cosine_truth))
+    if store._centroids is not None:
+        global NUMPY_IVF_MIN_ROWS
+        saved, NUMPY_IVF_MIN_ROWS = NUMPY_IVF_MIN_ROWS, 0
+        try:
+            rows.append(measure(f"numpy ({store._manifest['dtype']}, ivf)", numpy_search, cosine_truth))
+        finally:
+            NUMPY_IVF_MIN_ROWS = saved
+    return rows
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Manage the memory-mapped NumPy vector store.")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("import", help="copy a Chroma collection into the NumPy store")
+    ivf = commands.add_parser("build-ivf", help="build the IVF coarse index")
+    ivf.add_argument("--lists", type=int, default=NUMPY_IVF_LISTS or 1024)
+    commands.add_parser("compact", help="drop deleted rows from disk")
+    bench = commands.add_parser("benchmark", help="recall and latency against Chroma")
+    bench.add_argument("--queries", type=int, default=200)
+    bench.add_argument("-k", type=int, default=10)
+    bench.add_argument("--limit", type=int, default=None, help="only use the first N Chroma vectors")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        import_chroma(args.collection)
+    elif args.command == "build-ivf":
+        get_numpy_store(args.collection).build_ivf(args.lists)
+        print(f"Built {args.lists} IVF lists")
+    elif args.command == "compact":
+        print(f"Removed {get_numpy_store(args.collection).compact()} deleted rows")
+    elif args.command == "benchmark":
+        benchmark(args.collection, queries=args.queries, k=args.k, limit=args.limit)
@@ -0,0 +1,93 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import namedtuple
+
+from get_vector_db import CHROMA_PATH
+
+PAGE_CACHE_ENABLED = os.getenv('PAGE_CACHE_ENABLED', 'true').lower() == 'true'
+PAGE_CACHE_PATH = os.getenv('PAGE_CACHE_PATH', CHROMA_PATH.rstrip('/\\') + '_pages.sqlite3')
+
+CachedPage = namedtuple("CachedPage", "etag last_modified content_hash fetched_at")
+
+
+class PageCache:
+    """
+    HTTP validators of scraped pages, kept in an SQLite file next to
+    CHROMA_PATH: the ETag and Last-Modified headers and a hash of the raw
+    body, per URL. Recrawls send them back as If-None-Match /
+    If-Modified-Since, and a 304 or an identical body means the page has not
+    changed. fetched_at is when the cached body was downloaded, so callers
+    can tell whether that version ever made it into the store.
+
+    The same file keeps the template blocks boilerplate.PageDeduplicator
+    learned per domain, as hex SimHash fingerprints.
+    """
+
+    def __init__(self, path=PAGE_CACHE_PATH):
+        self._lock = threading.Lock()
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                " url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT,"
+                " content_hash TEXT NOT NULL, fetched_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS boilerplate ("
+                " domain TEXT NOT NULL, fingerprint TEXT NOT NULL, learned_at REAL NOT NULL,"
+                " PRIMARY KEY (domain, fingerprint))"
+            )
+
+    def get(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, content_hash, fetched_at FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        return CachedPage(*row) if row else None
+
+    def store(self, url, etag, last_modified, content_hash, fetched_at=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (url, etag, last_modified, content_hash, fetched_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (url, etag, last_modified, content_hash, time.time() if fetched_at is None else fetched_at)
+            )
+
+    def boilerplate(self, domain):
+        """Template block fingerprints learned for `domain` by earlier crawls."""
+        with self._lock:
+            rows = self._conn.execute("SELECT fingerprint FROM boilerplate WHERE domain = ?", (domain,)).fetchall()
+        return {int(fp, 16) for fp, in rows}
+
+    def store_boilerplate(self, domain, fingerprints, replace=False):
+        """Save a domain's template blocks; `replace` forgets the ones not among them."""
+        now = time.time()
+        with self._lock, self._conn:
+            if replace:
+                self._conn.execute("DELETE FROM boilerplate WHERE domain = ?", (domain,))
+            # Hex text: SQLite integers are signed and SimHash fingerprints use all 64 bits
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO boilerplate (domain, fingerprint, learned_at) VALUES (?, ?, ?)",
+                [(domain, format(fp, "016x"), now) for fp in fingerprints]
+            )
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_page_cache():
+    """Return the shared page cache, or None when PAGE_CACHE_ENABLED is off."""
+    global _cache
+    if not PAGE_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = PageCache()
+        return _cache
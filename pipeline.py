@@ -0,0 +1,198 @@
+import os
+import queue
+import threading
+import time
+from urllib.parse import urlparse
+
+from langchain.docstore.document import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from embed import upsert_sources, content_hash, DuplicateSource
+from boilerplate import PageDeduplicator, DuplicatePage, PAGE_DEDUP_ENABLED
+from get_vector_db import get_vector_db
+from page_cache import get_page_cache
+import metrics
+
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '64'))
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '256'))  # chunks per embed + write batch
+PAGE_CHUNK_SIZE = 2000
+PAGE_CHUNK_OVERLAP = 100
+
+_DONE = object()
+
+
+class PipelineStopped(Exception):
+    """Raised inside a stage when the pipeline was cancelled or another stage failed."""
+
+
+def _put(q, item, stop):
+    # Bounded put that gives up once the pipeline is stopping, so a dead
+    # downstream stage can never wedge the upstream ones.
+    while True:
+        if stop.is_set():
+            raise PipelineStopped()
+        try:
+            q.put(item, timeout=0.2)
+            return
+        except queue.Full:
+            pass
+
+
+def _get(q, stop):
+    while True:
+        if stop.is_set():
+            raise PipelineStopped()
+        try:
+            return q.get(timeout=0.2)
+        except queue.Empty:
+            pass
+
+
+def page_source(url, content, splitter):
+    """
+    Turn one scraped page into an upsert_sources entry. A page dropped as a
+    near-duplicate becomes a DuplicateSource, which removes the page's old
+    chunks and records it in the catalog without counting it as a document.
+    """
+    if isinstance(content, DuplicatePage):
+        return DuplicateSource("url", url, content.original)
+    domain = urlparse(url).netloc  # e.g. "example.com"
+    docs = [
+        Document(page_content=chunk, metadata={"url": url, "domain": domain})
+        for chunk in splitter.split_text(content)
+    ]
+    return ("url", url, content_hash(content), docs)
+
+
+def run_ingest_pipeline(pages, db=None, batch_size=EMBED_BATCH_SIZE, on_batch=None, should_stop=None,
+                        dedup_pages=PAGE_DEDUP_ENABLED):
+    """
+    Stream (url, content) pages into the vector store in constant memory.
+
+    Three stages connected by bounded queues:
+      reader  - pulls pages from `pages` (a crawler, a CSV reader, ...)
+      chunker - splits pages and groups them into batches of ~batch_size chunks
+      writer  - embeds and upserts each batch as soon as it is full
+    A slow writer fills the queues and the reader stops pulling, so memory
+    stays bounded no matter how large the site is, and every committed batch
+    is searchable immediately.
+
+    With `dedup_pages`, the chunker strips each domain's template blocks
+    (menus, banners, footers) and drops near-duplicate pages first; see
+    boilerplate.PageDeduplicator. Templates are remembered across runs in
+    the page cache, when it is enabled.
+
+    `on_batch(stats)` is called after each committed batch; when
+    `should_stop()` returns True the pipeline stops after the current batch.
+    Returns the final stats dict.
+    """
+    db = db or get_vector_db()
+    splitter = RecursiveCharacterTextSplitter(chunk_size=PAGE_CHUNK_SIZE, chunk_overlap=PAGE_CHUNK_OVERLAP)
+    page_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    batch_q = queue.Queue(maxsize=2)
+    stop = threading.Event()
+    errors = []
+    stats = {
+        "pages": 0, "empty_pages": 0, "duplicate_pages": 0, "batches": 0,
+        "chunks": 0, "deleted": 0, "skipped": 0,
+        "started": time.time(),
+    }
+
+    def reader():
+        try:
+            for url, content in pages:
+                _put(page_q, (url, content), stop)
+            _put(page_q, _DONE, stop)
+        except PipelineStopped:
+            pass
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            # Stops a crawler generator (and its network I/O) on early exit
+            close = getattr(pages, "close", None)
+            if close:
+                close()
+
+    def chunker():
+        try:
+            batch, size = [], 0
+            dedup = PageDeduplicator(get_page_cache()) if dedup_pages else None
+
+            def add(url, content):
+                nonlocal batch, size
+                if isinstance(content, str) and not content.strip():
+                    stats["empty_pages"] += 1
+                    return
+                with metrics.stage("pipeline", "split"):
+                    source = page_source(url, content, splitter)
+                batch.append(source)
+                if not isinstance(source, DuplicateSource):
+                    size += len(source[3])
+                if size >= batch_size:
+                    _put(batch_q, batch, stop)
+                    batch, size = [], 0
+
+            while True:
+                item = _get(page_q, stop)
+                if item is _DONE:
+                    break
+                url, content = item
+                stats["pages"] += 1
+                if not content or not str(content).strip():
+                    stats["empty_pages"] += 1
+                    continue
+                if dedup:
+                    with metrics.stage("pipeline", "dedup"):
+                        ready = dedup.feed(str(url), str(content))
+                else:
+                    ready = [(str(url), str(content))]
+                for url, content in ready:
+                    add(url, content)
+                if dedup:
+                    stats.update(dedup.stats)
+            if dedup:
+                for url, content in dedup.flush():
+                    add(url, content)
+                stats.update(dedup.stats)
+            if batch:
+                _put(batch_q, batch, stop)
+            _put(batch_q, _DONE, stop)
+        except PipelineStopped:
+            pass
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [threading.Thread(target=reader, daemon=True), threading.Thread(target=chunker, daemon=True)]
+    for t in threads:
+        t.start()
+
+    try:
+        while True:
+            if should_stop and should_stop():
+                stats["cancelled"] = True
+                break
+            try:
+                batch = batch_q.get(timeout=0.2)
+            except queue.Empty:
+                if stop.is_set():
+                    break  # an upstream stage failed
+                continue
+            if batch is _DONE:
+                break
+            result = upsert_sources(db, batch)
+            for key in ("chunks", "deleted", "skipped"):
+                stats[key] += result[key]
+            stats["batches"] += 1
+            if on_batch:
+                on_batch({k: v for k, v in stats.items() if k != "started"})
+    finally:
+        stop.set()
+        for t in threads:
+            t.join(timeout=5)
+
+    if errors:
+        raise errors[0]
+    stats["elapsed"] = time.time() - stats.pop("started")
+    return stats
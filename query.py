@@ -1,12 +1,28 @@
 import os
-from langchain_community.chat_models import ChatOllama
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from langchain.prompts import ChatPromptTemplate, PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain.retrievers.multi_query import MultiQueryRetriever
-from get_vector_db import get_vector_db
+from get_vector_db import get_vector_db, get_embedding_function, stream_chat, chat, LLM_MODEL
+from context_packing import pack_context, estimate_tokens
+from lexical_index import get_lexical_index, identifier_terms
+from answer_cache import answer_cache, source_token, ANSWER_CACHE_ENABLED
+import metrics
 
-LLM_MODEL = os.getenv('LLM_MODEL', 'mistral')
+QUERY_MODES = ("fast", "multi", "auto")
+QUERY_MODE = os.getenv('QUERY_MODE', 'auto')
+QUERY_TOP_K = int(os.getenv('QUERY_TOP_K', '4'))
+QUERY_MAX_VARIANTS = int(os.getenv('QUERY_MAX_VARIANTS', '5'))
+QUERY_MAX_CONTEXT_DOCS = int(os.getenv('QUERY_MAX_CONTEXT_DOCS', '12'))  # chunks handed to context packing
+# Best first-pass relevance (0..1) below which 'auto' mode falls back to rewrites
+QUERY_AUTO_MIN_SCORE = float(os.getenv('QUERY_AUTO_MIN_SCORE', '0.5'))
+QUERY_SEARCH_WORKERS = int(os.getenv('QUERY_SEARCH_WORKERS', '8'))
+HYBRID_SEARCH = os.getenv('HYBRID_SEARCH', 'true').lower() == 'true'
+LEXICAL_TOP_K = int(os.getenv('LEXICAL_TOP_K', '8'))
+RRF_K = int(os.getenv('RRF_K', '60'))
+
+_LIST_MARKER = re.compile(r"^\s*(?:[-*\u2022]|\d+[.)])\s*")
+_search_executor = ThreadPoolExecutor(max_workers=QUERY_SEARCH_WORKERS, thread_name_prefix="search")
 
 def get_prompt():
     QUERY_PROMPT = PromptTemplate(
@@ -27,37 +43,243 @@ def get_prompt():
     prompt = ChatPromptTemplate.from_template(template)
     return QUERY_PROMPT, prompt
 
-def query(user_query, doc_type=None, doc_name=None):
+def query(user_query, doc_type=None, doc_name=None, mode=QUERY_MODE):
     """
     If doc_type=='pdf', filter by metadata["filename"] = doc_name
     If doc_type=='scraped_domain', filter by metadata["domain"] = doc_name
     Otherwise, no filter => all docs
+    Answers are served from the answer cache when the same (or, with the
+    semantic path, a near-identical) question was answered over unchanged data.
+    See run_query() for the retrieval modes.
     """
     if not user_query:
         return None
+    if mode not in QUERY_MODES:
+        raise ValueError(f"Unknown query mode: {mode}")
 
-    llm = ChatOllama(model=LLM_MODEL)
-    db = get_vector_db()
-    QUERY_PROMPT, prompt = get_prompt()
+    if not ANSWER_CACHE_ENABLED:
+        return run_query(user_query, doc_type, doc_name, mode)
+
+    # Taken before answering, so an ingest that lands mid-generation invalidates the entry
+    with metrics.stage("query", "cache_lookup"):
+        token = source_token(doc_type, doc_name)
+        cached, query_embedding = answer_cache.lookup(
+            user_query, doc_type, doc_name, LLM_MODEL, mode, token,
+            embed_query=get_embedding_function().embed_query
+        )
+    if cached is not None:
+        metrics.record_items("query", "cache_hits", 1)
+        return cached
+
+    started = time.monotonic()
+    response = run_query(user_query, doc_type, doc_name, mode)
+    if response:
+        answer_cache.store(
+            user_query, doc_type, doc_name, LLM_MODEL, mode, token, response,
+            latency=time.monotonic() - started, embedding=query_embedding
+        )
+    return response
+
+def query_variants(query_prompt, user_query):
+    """Ask the LLM for alternative phrasings of the question, one per line."""
+    with metrics.stage("query", "rewrite"):
+        text = chat([{"role": "user", "content": query_prompt.format(question=user_query)}])
+    variants = []
+    for line in text.splitlines():
+        line = _LIST_MARKER.sub("", line).strip()
+        if line and line != user_query and line not in variants:
+            variants.append(line)
+    return variants[:QUERY_MAX_VARIANTS]
+
+def search_many(db, queries, metadata_filter=None, k=QUERY_TOP_K):
+    """
+    Embed all queries in one request, search them concurrently and merge
+    the hits. Each chunk is kept once with its best relevance score, and
+    the result is ordered best first.
+    """
+    with metrics.stage("query", "embed_queries"):
+        vectors = get_embedding_function().embed_queries(queries)
+    relevance = db._select_relevance_score_fn()
+
+    def search(vector):
+        return db.similarity_search_by_vector_with_relevance_scores(
+            vector, k=k, filter=metadata_filter
+        )
+
+    with metrics.stage("query", "vector_search"):
+        if len(vectors) == 1:
+            result_lists = [search(vectors[0])]
+        else:
+            result_lists = list(_search_executor.map(search, vectors))
+
+    best = {}
+    for results in result_lists:
+        for doc, distance in results:
+            score = relevance(distance)
+            key = doc_key(doc)
+            if key not in best or score > best[key][1]:
+                best[key] = (doc, score)
+    return sorted(best.values(), key=lambda pair: pair[1], reverse=True)
+
+def doc_key(doc):
+    """Identity of a retrieved chunk across vector and lexical results."""
+    meta = doc.metadata
+    return (meta.get("filename") or meta.get("url"), meta.get("chunk_index"), doc.page_content)
+
+def fuse(ranked_lists, k=RRF_K):
+    """
+    Reciprocal rank fusion: each chunk scores sum(1 / (k + rank)) over the
+    lists it appears in. Scores are scaled so a chunk ranked first
+    everywhere gets 1.0.
+    """
+    scores, docs = {}, {}
+    for results in ranked_lists:
+        for rank, (doc, _) in enumerate(results, start=1):
+            key = doc_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            docs.setdefault(key, doc)
+    top = len(ranked_lists) / (k + 1)
+    return sorted(((docs[key], score / top) for key, score in scores.items()),
+                  key=lambda pair: pair[1], reverse=True)
 
-    metadata_filter = None
+def format_docs(docs):
+    return "\n\n".join(doc.page_content for doc in docs)
+
+def metadata_filter_for(doc_type, doc_name):
     if doc_type == "pdf" and doc_name:
-        metadata_filter = {"filename": doc_name}
-    elif doc_type == "scraped_domain" and doc_name:
-        metadata_filter = {"domain": doc_name}
-
-    retriever = MultiQueryRetriever.from_llm(
-        retriever=db.as_retriever(search_kwargs={"filter": metadata_filter}),
-        llm=llm,
-        prompt=QUERY_PROMPT
-    )
+        return {"filename": doc_name}
+    if doc_type == "scraped_domain" and doc_name:
+        return {"domain": doc_name}
+    return None
+
+def retrieve(user_query, doc_type=None, doc_name=None, mode=QUERY_MODE):
+    """
+    Return [(doc, relevance)] for the question, best first.
+    mode='fast' searches with the question as asked, 'multi' adds LLM
+    rewrites of it, and 'auto' only pays for the rewrites when the best
+    first-pass relevance score is below QUERY_AUTO_MIN_SCORE and no chunk
+    contains every code-like term of the question. With HYBRID_SEARCH, BM25 matches from the
+    lexical index are fused with the vector results by reciprocal rank.
+    """
+    if mode not in QUERY_MODES:
+        raise ValueError(f"Unknown query mode: {mode}")
+    db = get_vector_db()
+    QUERY_PROMPT, _ = get_prompt()
+    metadata_filter = metadata_filter_for(doc_type, doc_name)
+
+    started = time.monotonic()
+    lexical = get_lexical_index() if HYBRID_SEARCH else None
+    with metrics.stage("query", "lexical_search"):
+        lexical_hits = lexical.search(user_query, LEXICAL_TOP_K, metadata_filter) if lexical else []
 
-    chain = (
-        {"context": retriever, "question": RunnablePassthrough()}
-        | prompt
-        | llm
-        | StrOutputParser()
+    if mode == "multi":
+        queries = [user_query] + query_variants(QUERY_PROMPT, user_query)
+        hits = search_many(db, queries, metadata_filter)
+    else:
+        hits = search_many(db, [user_query], metadata_filter)
+    if mode == "auto":
+        top_score = hits[0][1] if hits else None
+        weak = top_score is None or top_score < QUERY_AUTO_MIN_SCORE
+        # A chunk containing every code / error string in the question is a strong
+        # enough match on its own, so it spares the LLM rewrite
+        identifiers = identifier_terms(user_query)
+        if weak and lexical_hits and identifiers and \
+                lexical.search(" ".join(identifiers), 1, metadata_filter, operator="AND"):
+            weak = False
+        if weak:
+            variants = query_variants(QUERY_PROMPT, user_query)
+            if variants:
+                hits = search_many(db, [user_query] + variants, metadata_filter)
+            mode = "auto+multi"
+    if lexical_hits:
+        hits = fuse([hits, lexical_hits])
+    hits = hits[:QUERY_MAX_CONTEXT_DOCS]
+    metrics.record_stage("query", "retrieve", time.monotonic() - started)
+    metrics.record_items("query", "retrieved_chunks", len(hits))
+    print(
+        f"Retrieved {len(hits)} chunks in {time.monotonic() - started:.2f}s "
+        f"(mode={mode}, lexical matches={len(lexical_hits)})"
     )
+    return hits
+
+def run_query(user_query, doc_type=None, doc_name=None, mode=QUERY_MODE):
+    """Run retrieval + generation, bypassing the answer cache."""
+    _, prompt = get_prompt()
+    hits = retrieve(user_query, doc_type, doc_name, mode)
+    messages = prompt.format_messages(context=build_context(user_query, hits), question=user_query)
+    with metrics.stage("query", "generate"):
+        answer = chat([{"role": "user", "content": m.content} for m in messages])
+    metrics.record_items("query", "answer_tokens", estimate_tokens(answer))
+    return answer
+
+def build_context(user_query, hits):
+    """Pack the hits into the prompt context, recording its size."""
+    with metrics.stage("query", "pack_context"):
+        docs = pack_context(user_query, hits)
+        context = format_docs(docs)
+    metrics.record_items("query", "context_passages", len(docs))
+    metrics.record_items("query", "context_tokens", estimate_tokens(context))
+    return context
+
+def stream_query(user_query, doc_type=None, doc_name=None, mode=QUERY_MODE):
+    """
+    Streaming form of query(). Yields (event, data) pairs: one "sources"
+    event with the metadata of the retrieved chunks, then a "token" event
+    per generated piece, then "done" with timings. Closing the generator
+    early (e.g. the client went away) stops the Ollama generation.
+    """
+    started = time.monotonic()
+    token = None
+    query_embedding = None
+    if ANSWER_CACHE_ENABLED:
+        with metrics.stage("query", "cache_lookup"):
+            token = source_token(doc_type, doc_name)
+            cached, query_embedding = answer_cache.lookup(
+                user_query, doc_type, doc_name, LLM_MODEL, mode, token,
+                embed_query=get_embedding_function().embed_query
+            )
+        if cached is not None:
+            metrics.record_items("query", "cache_hits", 1)
+            yield "sources", {"sources": [], "cached": True}
+            yield "token", cached
+            yield "done", {"cached": True, "elapsed": time.monotonic() - started}
+            return
+
+    hits = retrieve(user_query, doc_type, doc_name, mode)
+    yield "sources", {
+        "sources": [{**doc.metadata, "score": round(score, 4)} for doc, score in hits],
+        "cached": False,
+    }
+
+    _, prompt = get_prompt()
+    messages = prompt.format_messages(context=build_context(user_query, hits), question=user_query)
+    generate_started = time.monotonic()
+    pieces = []
+    first_token = None
+    tokens = stream_chat([{"role": "user", "content": m.content} for m in messages])
+    try:
+        for piece in tokens:
+            if first_token is None:
+                first_token = time.monotonic() - started
+            pieces.append(piece)
+            yield "token", piece
+    finally:
+        tokens.close()
 
-    response = chain.invoke(user_query)
-    return response
\ No newline at end of file
+    answer = "".join(pieces)
+    elapsed = time.monotonic() - started
+    metrics.record_stage("query", "generate", time.monotonic() - generate_started)
+    metrics.record_items("query", "answer_tokens", len(pieces))
+    if first_token is not None:
+        metrics.record_stage("query", "first_token", first_token)
+    if ANSWER_CACHE_ENABLED and answer:
+        answer_cache.store(
+            user_query, doc_type, doc_name, LLM_MODEL, mode, token, answer,
+            latency=elapsed, embedding=query_embedding
+        )
+    print(f"Streamed answer: first token after {first_token or 0:.2f}s, done in {elapsed:.2f}s")
+    done = {"cached": False, "time_to_first_token": first_token, "elapsed": elapsed}
+    trace = metrics.current_trace()
+    if trace is not None:
+        done["stages"] = trace.summary()["stages"]
+    yield "done", done
@@ -1,7 +1,40 @@
+import os
+import re
+import time
+import hashlib
 import random
+import asyncio
+import threading
+import queue
+import zlib
+from collections import deque, namedtuple
+from datetime import datetime, timedelta, timezone
+from xml.etree import ElementTree
 import requests
+import aiohttp
 from bs4 import BeautifulSoup
 from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+import metrics
+
+CRAWL_CONCURRENCY = int(os.getenv('CRAWL_CONCURRENCY', '32'))
+CRAWL_PER_HOST_CONCURRENCY = int(os.getenv('CRAWL_PER_HOST_CONCURRENCY', '4'))
+CRAWL_RATE_PER_HOST = float(os.getenv('CRAWL_RATE_PER_HOST', '4'))  # requests/sec
+CRAWL_MAX_RETRIES = int(os.getenv('CRAWL_MAX_RETRIES', '4'))
+SITEMAP_INCREMENTAL = os.getenv('SITEMAP_INCREMENTAL', 'true').lower() == 'true'
+SITEMAP_READ_SIZE = 64 * 1024
+NOT_MODIFIED = object()
+GZIP_MAGIC = b"\x1f\x8b"
+
+# How long a page without <lastmod> is assumed unchanged, from its <changefreq>
+CHANGEFREQ_SECONDS = {
+    "always": 0, "hourly": 3600, "daily": 86400, "weekly": 7 * 86400,
+    "monthly": 30 * 86400, "yearly": 365 * 86400, "never": float("inf"),
+}
+
+# Statuses that mean "slow down / try again" rather than "this page is gone"
+RETRY_STATUSES = {403, 429, 500, 502, 503, 504}
 
 # A pool of modern user-agent strings (desktop + mobile).
 USER_AGENTS = [
@@ -36,55 +69,202 @@ def fetch_url_with_rotating_ua(url, timeout=10):
     headers = {
         "User-Agent": get_random_user_agent()
     }
-    resp = requests.get(url, headers=headers, timeout=timeout)
-    resp.raise_for_status()  # raise if 4xx/5xx
+    started = time.monotonic()
+    try:
+        resp = requests.get(url, headers=headers, timeout=timeout)
+        resp.raise_for_status()  # raise if 4xx/5xx
+    except requests.HTTPError:
+        metrics.CRAWL_FETCH_SECONDS.labels("page", "http_error").observe(time.monotonic() - started)
+        raise
+    except requests.RequestException:
+        metrics.CRAWL_FETCH_SECONDS.labels("page", "failed").observe(time.monotonic() - started)
+        raise
+    metrics.CRAWL_FETCH_SECONDS.labels("page", "ok").observe(time.monotonic() - started)
     return resp
 
-def fetch_sitemap_urls(sitemap_url, visited=None):
+class SitemapEntry(namedtuple("SitemapEntry", "kind loc lastmod changefreq")):
+    """One <url> (kind "url") or sitemap index <sitemap> (kind "sitemap") record."""
+
+
+class SitemapParser:
     """
-    Recursively expand a (Yoast) sitemap index or a normal sitemap
-    to get final page URLs.
-    Uses rotating user agents for each request.
+    Incremental sitemap parser. feed() takes the raw bytes as they arrive
+    and returns the entries completed so far, so neither the document nor a
+    tree of it is ever held in memory. Gzipped sitemaps (.xml.gz) are
+    recognized by their magic bytes and inflated on the fly.
     """
-    if visited is None:
-        visited = set()
-    if sitemap_url in visited:
-        return []
 
-    visited.add(sitemap_url)
-    page_urls = []
+    def __init__(self):
+        self._parser = ElementTree.XMLPullParser(events=("start", "end"))
+        self._inflate = None
+        self._head = b""
+        self._sniffed = False
+        self._open = []  # local names of the elements currently open
+        self._root = None
+
+    def feed(self, data):
+        if not self._sniffed:
+            self._head += data
+            if len(self._head) < 2:
+                return []
+            data, self._head, self._sniffed = self._head, b"", True
+            if data[:2] == GZIP_MAGIC:
+                self._inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self._inflate:
+            data = self._inflate.decompress(data)
+        self._parser.feed(data)
+        return self._entries()
+
+    def close(self):
+        if self._head:
+            self._parser.feed(self._head)
+        if self._inflate:
+            self._parser.feed(self._inflate.flush())
+        self._parser.close()
+        return self._entries()
+
+    def _entries(self):
+        entries = []
+        for event, elem in self._parser.read_events():
+            tag = elem.tag.rsplit("}", 1)[-1]
+            if event == "start":
+                if self._root is None:
+                    self._root = elem
+                self._open.append(tag)
+                continue
+            self._open.pop()
+            if tag in ("url", "sitemap"):
+                fields = {c.tag.rsplit("}", 1)[-1]: (c.text or "").strip() for c in elem}
+                if fields.get("loc"):
+                    entries.append(SitemapEntry(
+                        tag, fields["loc"], fields.get("lastmod") or None, fields.get("changefreq") or None
+                    ))
+            elif tag == "loc" and "url" not in self._open and "sitemap" not in self._open and elem.text:
+                # Non-standard sitemaps that are just a list of <loc> tags
+                entries.append(SitemapEntry("url", elem.text.strip(), None, None))
+        # Finished records are no longer needed; the element being built stays referenced by the parser
+        if self._root is not None:
+            self._root.clear()
+        return entries
 
+
+def parse_sitemap(xml):
+    """
+    Parse one complete sitemap document (str or bytes).
+    Returns (sub_sitemap_urls, page_urls): a sitemap index only yields the
+    former, a normal sitemap only the latter.
+    """
+    parser = SitemapParser()
+    entries = parser.feed(xml.encode("utf-8") if isinstance(xml, str) else xml) + parser.close()
+    return (
+        [e.loc for e in entries if e.kind == "sitemap"],
+        [e.loc for e in entries if e.kind == "url"],
+    )
+
+
+def parse_lastmod(value):
+    """
+    Epoch seconds of a W3C datetime lastmod, or None if it cannot be read.
+    Date-only values (and bare years/months) mean the end of that period,
+    since the page may have changed at any time during it.
+    """
+    value = (value or "").strip()
     try:
-        response = fetch_url_with_rotating_ua(sitemap_url)
-    except Exception as e:
-        print(f"Error fetching sitemap {sitemap_url}: {e}")
-        return page_urls
-
-    soup = BeautifulSoup(response.text, "xml")
-    sitemap_index = soup.find("sitemapindex")
-    if sitemap_index:
-        # It's a sitemap index with multiple <sitemap> entries
-        sitemaps = sitemap_index.find_all("sitemap")
-        for sm in sitemaps:
-            loc = sm.find("loc")
-            if loc:
-                sub_sitemap_url = loc.get_text(strip=True)
-                page_urls.extend(fetch_sitemap_urls(sub_sitemap_url, visited=visited))
-    else:
-        # Possibly a normal sitemap with <urlset> or just <loc> tags
-        urls = soup.find_all("url")
-        if urls:
-            for u in urls:
-                loc = u.find("loc")
-                if loc:
-                    page_urls.append(loc.get_text(strip=True))
-        else:
-            # fallback approach: parse all <loc> tags if no <url>
-            loc_tags = soup.find_all("loc")
-            for loc in loc_tags:
-                page_urls.append(loc.get_text(strip=True))
-
-    return page_urls
+        if len(value) == 4:
+            return datetime(int(value) + 1, 1, 1, tzinfo=timezone.utc).timestamp()
+        if len(value) == 7:
+            year, month = int(value[:4]), int(value[5:7])
+            return datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc).timestamp()
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    if len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed.timestamp()
+
+
+def is_unmodified(entry, last_ingested):
+    """
+    True if a sitemap <url> entry has not changed since its page was last
+    ingested. `last_ingested(url)` returns that time in epoch seconds, or
+    None for pages never ingested. Without a lastmod, the changefreq hint
+    decides.
+    """
+    if last_ingested is None:
+        return False
+    ingested = last_ingested(entry.loc)
+    if ingested is None:
+        return False
+    if entry.lastmod:
+        modified = parse_lastmod(entry.lastmod)
+        if modified is not None:
+            return modified < ingested
+    period = CHANGEFREQ_SECONDS.get((entry.changefreq or "").lower())
+    return period is not None and time.time() - ingested < period
+
+BLOCK_TAGS = [
+    "address", "article", "aside", "blockquote", "caption", "dd", "div", "dl", "dt", "figcaption",
+    "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header", "li", "main", "nav", "ol",
+    "p", "pre", "section", "table", "td", "th", "tr", "ul",
+]
+_BLOCK_BREAK = "\u2029"  # Unicode paragraph separator, never significant in HTML source
+_WHITESPACE = re.compile(r"\s+")
+
+def extract_page_text(html):
+    """
+    Return the visible text of an HTML page, one line per block-level
+    element (paragraph, list item, heading, cell, ...). Keeping blocks on
+    their own lines lets the ingest pipeline recognise menus, banners and
+    footers that repeat across a site.
+    """
+    with metrics.stage("crawl", "extract"):
+        soup = BeautifulSoup(html, "html.parser")
+        for tag in soup(["script", "style", "noscript", "template"]):
+            tag.decompose()
+        for br in soup.find_all("br"):
+            br.replace_with(_BLOCK_BREAK)
+        for tag in soup.find_all(BLOCK_TAGS):
+            tag.insert_before(_BLOCK_BREAK)
+            tag.insert_after(_BLOCK_BREAK)
+        # Source newlines inside a block are just whitespace; only block boundaries become lines
+        blocks = (_WHITESPACE.sub(" ", block).strip() for block in soup.get_text().split(_BLOCK_BREAK))
+        return "\n".join(block for block in blocks if block)
+
+def iter_sitemap_entries(sitemap_url, timeout=10):
+    """Stream one sitemap over HTTP and yield its SitemapEntry records as they are parsed."""
+    headers = {"User-Agent": get_random_user_agent()}
+    with requests.get(sitemap_url, headers=headers, timeout=timeout, stream=True) as resp:
+        resp.raise_for_status()
+        parser = SitemapParser()
+        for data in resp.iter_content(SITEMAP_READ_SIZE):
+            yield from parser.feed(data)
+        yield from parser.close()
+
+
+def fetch_sitemap_urls(sitemap_url, last_ingested=None):
+    """
+    Lazily expand a (Yoast) sitemap index or a normal sitemap into page URLs.
+    Sub-sitemaps are walked breadth-first with a visited set, so sitemap
+    loops are harmless. With `last_ingested` (see is_unmodified), pages
+    whose lastmod predates their last ingest are skipped.
+    Uses rotating user agents for each request.
+    """
+    visited = {sitemap_url}
+    pending = deque([sitemap_url])
+    while pending:
+        current = pending.popleft()
+        try:
+            for entry in iter_sitemap_entries(current):
+                if entry.kind == "sitemap":
+                    if entry.loc not in visited:
+                        visited.add(entry.loc)
+                        pending.append(entry.loc)
+                elif not is_unmodified(entry, last_ingested):
+                    yield entry.loc
+        except (requests.RequestException, ElementTree.ParseError, zlib.error) as e:
+            print(f"Error fetching sitemap {current}: {e}")
 
 def fetch_page_content(page_url):
     """
@@ -93,9 +273,376 @@ def fetch_page_content(page_url):
     """
     try:
         resp = fetch_url_with_rotating_ua(page_url)
-        soup = BeautifulSoup(resp.text, "html.parser")
-        content = soup.get_text(separator=" ", strip=True)
-        return content
+        return extract_page_text(resp.text)
     except Exception as e:
         print(f"Failed to fetch {page_url}: {e}")
-        return ""
\ No newline at end of file
+        return ""
+
+
+# ----------------------------------------------------------------
+# Concurrent crawler
+# ----------------------------------------------------------------
+
+class TokenBucket:
+    """
+    Async token bucket for one host. `rate` starts at the configured (or
+    robots.txt Crawl-delay derived) rate, is halved when the host pushes back
+    and creeps back up towards `base_rate` on success.
+    """
+
+    def __init__(self, rate, capacity=1.0):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def slow_down(self):
+        self.rate = max(self.base_rate / 64, self.rate / 2)
+
+    def speed_up(self):
+        self.rate = min(self.base_rate, self.rate * 1.1)
+
+
+class AsyncCrawler:
+    """
+    Sitemap crawler built on one pooled aiohttp session.
+
+    Politeness is enforced per host: a semaphore caps concurrent requests,
+    a token bucket caps the request rate (honoring robots.txt Crawl-delay),
+    and 403/429/5xx answers trigger exponential backoff with a fresh
+    rotating user agent on every attempt.
+
+        async with AsyncCrawler() as crawler:
+            async for url, content in crawler.crawl(sitemap_url):
+                ...
+    """
+
+    def __init__(self, concurrency=CRAWL_CONCURRENCY, per_host_concurrency=CRAWL_PER_HOST_CONCURRENCY,
+                 rate_per_host=CRAWL_RATE_PER_HOST, max_retries=CRAWL_MAX_RETRIES, timeout=10,
+                 last_ingested=None, page_cache=None, stats=None):
+        self.concurrency = concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.rate_per_host = rate_per_host
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.last_ingested = last_ingested  # url -> epoch seconds or None; enables incremental recrawls
+        self.page_cache = page_cache  # page_cache.PageCache; enables conditional re-fetches
+        self.stats = stats if stats is not None else {}
+        for key in ("sitemaps", "skipped_lastmod", "skipped_not_modified", "skipped_unchanged"):
+            self.stats.setdefault(key, 0)
+        self.session = None
+        self._host_slots = {}
+        self._buckets = {}
+        self._robots_lock = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host_concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        self._robots_lock = asyncio.Lock()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def _host_limits(self, url):
+        """Return (semaphore, token bucket) for the URL's host, reading robots.txt once."""
+        parsed = urlparse(url)
+        host = parsed.netloc
+        async with self._robots_lock:
+            if host not in self._buckets:
+                rate = self.rate_per_host
+                delay = await self._crawl_delay(f"{parsed.scheme}://{host}/robots.txt")
+                if delay:
+                    rate = min(rate, 1.0 / delay)
+                self._buckets[host] = TokenBucket(rate)
+                self._host_slots[host] = asyncio.Semaphore(self.per_host_concurrency)
+        return self._host_slots[host], self._buckets[host]
+
+    async def _crawl_delay(self, robots_url):
+        try:
+            headers = {"User-Agent": get_random_user_agent()}
+            async with self.session.get(robots_url, headers=headers) as resp:
+                if resp.status != 200:
+                    return None
+                text = await resp.text(errors="replace")
+        except Exception:
+            return None
+        parser = RobotFileParser()
+        parser.parse(text.splitlines())
+        delay = parser.crawl_delay("*")
+        return float(delay) if delay else None
+
+    async def _fetch(self, url, read, headers=None, kind="page", **request_kwargs):
+        """
+        GET a URL politely and return `await read(resp)` for a successful
+        response, or None after retries are exhausted. The time taken,
+        politeness waits and retries included, is recorded under `kind`.
+        """
+        started = time.monotonic()
+
+        def observe(outcome):
+            metrics.CRAWL_FETCH_SECONDS.labels(kind, outcome).observe(time.monotonic() - started)
+
+        slots, bucket = await self._host_limits(url)
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            retry_after = None
+            try:
+                async with slots:
+                    request_headers = {"User-Agent": get_random_user_agent(), **(headers or {})}
+                    async with self.session.get(url, headers=request_headers, **request_kwargs) as resp:
+                        if resp.status < 400:
+                            body = await read(resp)
+                            bucket.speed_up()
+                            observe("not_modified" if resp.status == 304 else "ok")
+                            return body
+                        if resp.status not in RETRY_STATUSES:
+                            print(f"Failed to fetch {url}: HTTP {resp.status}")
+                            observe("http_error")
+                            return None
+                        retry_after = resp.headers.get("Retry-After")
+                        bucket.slow_down()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Error fetching {url} (attempt {attempt + 1}): {e}")
+
+            if attempt < self.max_retries:
+                delay = min(60.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.5)
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, float(retry_after))
+                await asyncio.sleep(delay)
+        print(f"Giving up on {url} after {self.max_retries + 1} attempts")
+        observe("failed")
+        return None
+
+    async def fetch_text(self, url):
+        """GET a URL politely; returns the body text, or None after retries are exhausted."""
+        return await self._fetch(url, lambda resp: resp.text(errors="replace"))
+
+    async def fetch_sitemap(self, sitemap_url):
+        """
+        Download and parse one sitemap chunk by chunk; returns its
+        SitemapEntry records, or None if it could not be fetched. Large
+        sitemaps may take longer than the page timeout as long as data keeps
+        arriving.
+        """
+        async def read(resp):
+            parser = SitemapParser()
+            entries = []
+            try:
+                async for data in resp.content.iter_chunked(SITEMAP_READ_SIZE):
+                    entries.extend(parser.feed(data))
+                entries.extend(parser.close())
+            except (ElementTree.ParseError, zlib.error) as e:
+                print(f"Error parsing sitemap {sitemap_url}: {e}")
+            return entries
+
+        return await self._fetch(
+            sitemap_url, read, kind="sitemap", timeout=aiohttp.ClientTimeout(sock_read=self.timeout)
+        )
+
+    def _cached_page(self, page_url):
+        """
+        The cached validators of a page, if the body they describe was
+        ingested afterwards. A page fetched by a crawl that never committed
+        it is fetched in full again.
+        """
+        if self.page_cache is None or self.last_ingested is None:
+            return None
+        cached = self.page_cache.get(page_url)
+        if cached is None:
+            return None
+        ingested = self.last_ingested(page_url)
+        return cached if ingested is not None and ingested >= cached.fetched_at else None
+
+    async def fetch_page_content(self, page_url):
+        """
+        Visible text of a page, "" on failure, or None if the page has not
+        changed since it was last ingested (HTTP 304 or an identical body).
+        """
+        cached = self._cached_page(page_url)
+        headers = {}
+        if cached and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+        async def read(resp):
+            if resp.status == 304:
+                return NOT_MODIFIED
+            body = await resp.read()
+            return body, await resp.text(errors="replace"), resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+
+        fetched = await self._fetch(page_url, read, headers=headers)
+        if fetched is NOT_MODIFIED:
+            self.stats["skipped_not_modified"] += 1
+            return None
+        if not fetched:
+            return ""
+        body, html, etag, last_modified = fetched
+        if self.page_cache is not None:
+            digest = hashlib.sha256(body).hexdigest()
+            if cached and digest == cached.content_hash:
+                # Keep fetched_at: it still dates the version that was ingested
+                self.page_cache.store(page_url, etag, last_modified, digest, fetched_at=cached.fetched_at)
+                self.stats["skipped_unchanged"] += 1
+                return None
+            self.page_cache.store(page_url, etag, last_modified, digest)
+        if not html:
+            return ""
+        # BeautifulSoup is CPU-bound; keep it off the event loop
+        return await asyncio.to_thread(extract_page_text, html)
+
+    async def _expand_sitemap(self, sitemap_url, out):
+        """Walk the sitemap tree breadth-first, a few sub-sitemaps at a time."""
+        visited = {sitemap_url}
+        pending = deque([sitemap_url])
+        while pending:
+            wave = [pending.popleft() for _ in range(min(len(pending), self.per_host_concurrency))]
+            for entries in await asyncio.gather(*(self.fetch_sitemap(sm) for sm in wave)):
+                for entry in entries or ():
+                    if entry.kind == "sitemap":
+                        if entry.loc not in visited:
+                            visited.add(entry.loc)
+                            pending.append(entry.loc)
+                    elif is_unmodified(entry, self.last_ingested):
+                        self.stats["skipped_lastmod"] += 1
+                    else:
+                        await out.put(entry.loc)
+            self.stats["sitemaps"] += len(wave)
+
+    async def sitemap_urls(self, sitemap_url):
+        """
+        Async stream of page URLs; sub-sitemaps are expanded a few at a time
+        while earlier pages are already being crawled.
+        """
+        out = asyncio.Queue(maxsize=self.concurrency * 4)
+
+        async def expand():
+            try:
+                await self._expand_sitemap(sitemap_url, out)
+            finally:
+                await out.put(None)
+
+        task = asyncio.create_task(expand())
+        seen = set()
+        try:
+            while True:
+                page_url = await out.get()
+                if page_url is None:
+                    break
+                if page_url not in seen:
+                    seen.add(page_url)
+                    yield page_url
+        finally:
+            task.cancel()
+        stats = self.stats
+        print(
+            f"Sitemap {sitemap_url}: {len(seen)} page URLs from {stats['sitemaps']} sitemaps"
+            + (f", {stats['skipped_lastmod']} unchanged since their last ingest" if stats["skipped_lastmod"] else "")
+        )
+
+    async def crawl(self, sitemap_url):
+        """
+        Async stream of (page_url, content) tuples, yielded as pages finish
+        while the sitemap is still being expanded. Content is "" on failure;
+        pages found unchanged through the page cache are left out.
+        """
+        urls = asyncio.Queue(maxsize=self.concurrency * 2)
+        results = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def feed():
+            async for page_url in self.sitemap_urls(sitemap_url):
+                await urls.put(page_url)
+            for _ in range(self.concurrency):
+                await urls.put(None)
+
+        async def worker():
+            while True:
+                page_url = await urls.get()
+                if page_url is None:
+                    return
+                content = await self.fetch_page_content(page_url)
+                if content is not None:
+                    await results.put((page_url, content))
+
+        async def run():
+            try:
+                await asyncio.gather(feed(), *(worker() for _ in range(self.concurrency)))
+            finally:
+                await results.put(None)
+
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                item = await results.get()
+                if item is None:
+                    break
+                yield item
+        finally:
+            task.cancel()
+
+
+def iter_crawl(sitemap_url, **crawler_kwargs):
+    """
+    Synchronous generator over AsyncCrawler.crawl for callers without an event
+    loop (Streamlit, Flask workers). The crawl runs on a background thread and
+    hands pages over through a small bounded queue; closing the generator
+    stops the crawl.
+    """
+    pages = queue.Queue(maxsize=64)
+    stop = threading.Event()
+    done = object()
+
+    async def produce():
+        async with AsyncCrawler(**crawler_kwargs) as crawler:
+            async for item in crawler.crawl(sitemap_url):
+                # Backpressure: wait for the consumer without blocking the event loop
+                while not stop.is_set():
+                    try:
+                        pages.put_nowait(item)
+                        break
+                    except queue.Full:
+                        await asyncio.sleep(0.05)
+                if stop.is_set():
+                    return
+
+    def run():
+        try:
+            asyncio.run(produce())
+        except Exception as e:
+            print(f"Crawl of {sitemap_url} failed: {e}")
+        finally:
+            while True:
+                try:
+                    pages.put(done, timeout=0.5)
+                    break
+                except queue.Full:
+                    if stop.is_set():
+                        break
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = pages.get()
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
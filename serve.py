@@ -0,0 +1,149 @@
+"""
+Production entry point for the Flask backend.
+
+    python serve.py
+
+Runs app.py under gunicorn with threaded workers (gthread): WEB_WORKERS
+processes of WEB_THREADS threads each. Answering a query is mostly
+waiting on Ollama, so threads give the concurrency and one process is
+usually enough; see the PRODUCTION SERVING section of the README before
+raising WEB_WORKERS.
+
+The master process imports the heavy libraries (LangChain, unstructured,
+BeautifulSoup, ...) once before forking, so workers start fast and share
+those pages. The app itself, and with it chromadb, is loaded in each
+worker after the fork: it opens SQLite files and thread pools that must
+not be shared between processes, and a process that imported chromadb
+before forking leaves children that cannot exit cleanly.
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import importlib
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from gunicorn.app.base import BaseApplication
+
+WEB_HOST = os.getenv('WEB_HOST', '0.0.0.0')
+WEB_PORT = int(os.getenv('WEB_PORT', '8080'))
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', '1'))
+# 0 = enough for every admitted and queued request plus the cheap endpoints (job status, listings, metrics)
+WEB_THREADS = int(os.getenv('WEB_THREADS', '0'))
+# A worker process silent for this long is restarted. Under gthread this is only a heartbeat, never a
+# per-request deadline: LLM_GENERATION_TIMEOUT and LLM_QUEUE_TIMEOUT bound slow requests
+WEB_TIMEOUT = int(os.getenv('WEB_TIMEOUT', '120'))
+WEB_GRACEFUL_TIMEOUT = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '60'))  # time to finish in-flight requests on shutdown
+WEB_KEEPALIVE = int(os.getenv('WEB_KEEPALIVE', '5'))
+WEB_BACKLOG = int(os.getenv('WEB_BACKLOG', '2048'))
+
+# Imported by the master before forking; missing optional ones are skipped. Never chromadb (see above).
+PRELOAD_MODULES = (
+    "numpy",
+    "requests",
+    "bs4",
+    "langchain.prompts",
+    "langchain_core.output_parsers",
+    "langchain_community.embeddings",
+    "langchain_community.vectorstores.chroma",
+    "langchain_community.document_loaders",
+    "langchain_text_splitters",
+    "unstructured.partition.auto",
+)
+
+
+def preload_modules():
+    started = time.monotonic()
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"Preload skipped {name}: {e}")
+    print(f"Preloaded libraries in {time.monotonic() - started:.1f}s")
+
+
+_started_at = None
+
+
+def on_starting(server):
+    global _started_at
+    _started_at = time.time()
+    preload_modules()
+
+
+def post_worker_init(worker):
+    # The first worker loads the models into Ollama and picks up what the
+    # previous run left behind. Only work from before this server started is
+    # touched, so jobs other workers accept meanwhile are not run twice.
+    if worker.age == 1:
+        from app import warm_up, resume_background_work
+        # In the background: loading a model can outlast WEB_TIMEOUT, and the worker must keep checking in
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+        resume_background_work(before=_started_at)
+
+
+def worker_exit(server, worker):
+    from app import jobs
+    # Running ingestion jobs stop after their current batch and are resumed on the next start
+    jobs.shutdown(wait=False)
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+class Server(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app import app
+        return app
+
+
+def main():
+    workers = max(1, WEB_WORKERS)
+    multiproc_dir = None
+    if workers > 1 and not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Must be set before prometheus_client is first imported, so /metrics can sum over workers
+        multiproc_dir = tempfile.mkdtemp(prefix="rag-metrics-")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = multiproc_dir
+    # Imported only now: prometheus_client picks its storage when first loaded
+    from admission import ADMISSION_MAX_ACTIVE, ADMISSION_QUEUE_SIZE
+    threads = WEB_THREADS or ADMISSION_MAX_ACTIVE + ADMISSION_QUEUE_SIZE + 8
+    options = {
+        "bind": f"{WEB_HOST}:{WEB_PORT}",
+        "workers": workers,
+        "worker_class": "gthread",
+        "threads": threads,
+        "timeout": WEB_TIMEOUT,
+        "graceful_timeout": WEB_GRACEFUL_TIMEOUT,
+        "keepalive": WEB_KEEPALIVE,
+        "backlog": WEB_BACKLOG,
+        "preload_app": False,
+        "on_starting": on_starting,
+        "post_worker_init": post_worker_init,
+        "worker_exit": worker_exit,
+        "child_exit": child_exit,
+        "accesslog": "-",
+    }
+    try:
+        Server(options).run()
+    finally:
+        if multiproc_dir:
+            shutil.rmtree(multiproc_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionGate, Overloaded
+
+
+def test_admits_up_to_max_active_then_queues():
+    gate = AdmissionGate(max_active=2, queue_size=1, timeout=5)
+    gate.acquire()
+    gate.acquire()
+    admitted = threading.Event()
+
+    def waiter():
+        gate.acquire()
+        admitted.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    for _ in range(100):
+        if gate.stats()["queued"] == 1:
+            break
+        time.sleep(0.01)
+    assert gate.stats() == {"active": 2, "queued": 1, "max_active": 2, "queue_size": 1}
+    assert not admitted.is_set()
+
+    gate.release()
+    thread.join(timeout=5)
+    assert admitted.is_set()
+    assert gate.stats()["active"] == 2 and gate.stats()["queued"] == 0
+
+
+def test_full_queue_is_refused_at_once():
+    gate = AdmissionGate(max_active=1, queue_size=0, timeout=5)
+    gate.acquire()
+    started = time.monotonic()
+    with pytest.raises(Overloaded, match="queue is full"):
+        gate.acquire()
+    assert time.monotonic() - started < 1
+
+
+def test_queued_request_times_out():
+    gate = AdmissionGate(max_active=1, queue_size=1, timeout=0.1)
+    gate.acquire()
+    with pytest.raises(Overloaded, match="no slot free"):
+        gate.acquire()
+    assert gate.stats()["queued"] == 0
+    gate.release()
+    gate.acquire()  # the slot is still usable after a timed-out waiter
+
+
+def test_waiters_are_admitted_in_arrival_order():
+    gate = AdmissionGate(max_active=1, queue_size=3, timeout=5)
+    gate.acquire()
+    order = []
+    threads = []
+    for i in range(3):
+        def waiter(i=i):
+            gate.acquire()
+            order.append(i)
+            gate.release()
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        threads.append(thread)
+        # Queue them one after another
+        for _ in range(100):
+            if gate.stats()["queued"] == i + 1:
+                break
+            time.sleep(0.01)
+    gate.release()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert order == [0, 1, 2]
+    assert gate.stats()["active"] == 0
@@ -0,0 +1,33 @@
+import numpy as np
+
+from answer_cache import AnswerCache
+
+TOKEN = ("all", 1)
+
+
+def embed(text):
+    # Same direction for every query, so any semantic lookup in scope is a match
+    return np.ones(8, dtype=np.float32)
+
+
+def test_exact_hit_needs_same_mode():
+    cache = AnswerCache(semantic=False)
+    cache.store("What is X?", None, None, "mistral", "fast", TOKEN, "fast answer", latency=1.0)
+    assert cache.lookup("what is  x?", None, None, "mistral", "fast", TOKEN)[0] == "fast answer"
+    assert cache.lookup("What is X?", None, None, "mistral", "multi", TOKEN)[0] is None
+    assert cache.lookup("What is X?", None, None, "mistral", "auto", TOKEN)[0] is None
+
+
+def test_semantic_hit_stays_within_mode():
+    cache = AnswerCache(semantic=True, similarity=0.9)
+    _, vector = cache.lookup("What is X?", None, None, "mistral", "multi", TOKEN, embed_query=embed)
+    cache.store("What is X?", None, None, "mistral", "multi", TOKEN, "multi answer", latency=1.0, embedding=vector)
+    assert cache.lookup("Tell me about X", None, None, "mistral", "multi", TOKEN, embed_query=embed)[0] == "multi answer"
+    assert cache.lookup("Tell me about X", None, None, "mistral", "fast", TOKEN, embed_query=embed)[0] is None
+
+
+def test_stale_token_misses():
+    cache = AnswerCache(semantic=False)
+    cache.store("What is X?", "pdf", "a.pdf", "mistral", "fast", TOKEN, "answer", latency=1.0)
+    assert cache.lookup("What is X?", "pdf", "a.pdf", "mistral", "fast", ("all", 2))[0] is None
+    assert cache.stats()["misses"] == 1
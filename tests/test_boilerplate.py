@@ -0,0 +1,83 @@
+import pytest
+
+from boilerplate import PageDeduplicator, DuplicatePage, BOILERPLATE_WARMUP_PAGES
+from page_cache import PageCache
+
+NAV = "Home Products Pricing Blog Contact us today"
+FOOTER = "Copyright 2024 Example Corp all rights reserved worldwide"
+
+
+def page(i):
+    body = f"Article number {i} explains topic {i} with unique details about subject {i * 7919} and more words {i}"
+    return f"{NAV}\n{body}\n{FOOTER}"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PageCache(str(tmp_path / "pages.sqlite3"))
+
+
+def crawl(dedup, pages):
+    ready = []
+    for url, content in pages:
+        ready.extend(dedup.feed(url, content))
+    return ready + dedup.flush()
+
+
+def test_template_blocks_are_stripped():
+    ready = dict(crawl(PageDeduplicator(), [(f"https://example.com/{i}", page(i)) for i in range(25)]))
+    assert len(ready) == 25
+    for text in ready.values():
+        assert NAV not in text and FOOTER not in text
+        assert text.startswith("Article number")
+
+
+def test_near_duplicate_page_gives_a_marker():
+    pages = [(f"https://example.com/{i}", page(i)) for i in range(BOILERPLATE_WARMUP_PAGES)]
+    pages.append(("https://example.com/copy", page(3).replace("more words", "more  words")))
+    dedup = PageDeduplicator()
+    ready = crawl(dedup, pages)
+    assert ("https://example.com/copy", DuplicatePage("https://example.com/3")) in ready
+    assert sum(isinstance(content, DuplicatePage) for _, content in ready) == 1
+    assert dedup.stats["duplicate_pages"] == 1
+
+
+def test_learned_templates_seed_the_next_crawl(store):
+    crawl(PageDeduplicator(store), [(f"https://example.com/{i}", page(i)) for i in range(25)])
+    assert len(store.boilerplate("example.com")) == 2
+
+    # An incremental recrawl passes only a changed page or two: released at once, template stripped
+    dedup = PageDeduplicator(store)
+    ready = dedup.feed("https://example.com/3", page(1003).replace("2024", "2025"))
+    assert len(ready) == 1
+    assert ready[0][1].startswith("Article number 1003")
+    assert NAV not in ready[0][1] and "Copyright" not in ready[0][1]
+    assert dedup.domains["example.com"].pending == []
+
+
+def test_templates_are_per_domain(store):
+    crawl(PageDeduplicator(store), [(f"https://example.com/{i}", page(i)) for i in range(25)])
+    ready = PageDeduplicator(store).feed("https://other.org/a", page(1))
+    assert ready == []  # other.org has no stored template, so its first pages wait for the warm-up
+
+
+def test_small_crawl_adds_to_stored_template(store):
+    store.store_boilerplate("example.com", {1, 2})
+    crawl(PageDeduplicator(store), [(f"https://example.com/{i}", page(i)) for i in range(4)])
+    learned = store.boilerplate("example.com")
+    assert {1, 2} <= learned and len(learned) == 4
+
+
+def test_full_crawl_replaces_stored_template(store):
+    store.store_boilerplate("example.com", {1, 2})
+    crawl(PageDeduplicator(store), [(f"https://example.com/{i}", page(i)) for i in range(25)])
+    learned = store.boilerplate("example.com")
+    assert 1 not in learned and 2 not in learned and len(learned) == 2
+
+
+def test_store_round_trips_64_bit_fingerprints(store):
+    fingerprints = {0, 1, 2 ** 63, 2 ** 64 - 1}
+    store.store_boilerplate("example.com", fingerprints)
+    assert store.boilerplate("example.com") == fingerprints
+    store.store_boilerplate("example.com", {5}, replace=True)
+    assert store.boilerplate("example.com") == {5}
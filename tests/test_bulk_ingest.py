@@ -0,0 +1,163 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from bulk_ingest import (
+    IngestManifest, ManifestRow, Entry, collect_entries, is_unchanged, iter_tar, iter_zip, member_name, wanted
+)
+
+
+def add_tar_member(archive, name, data=b"# title\n\nbody\n"):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = 1700000000
+    archive.addfile(info, io.BytesIO(data))
+
+
+def test_member_name_strips_leading_dot_and_slash():
+    assert member_name("./a.md") == "a.md"
+    assert member_name("./docs/b.txt") == "docs/b.txt"
+    assert member_name("/docs/b.txt") == "docs/b.txt"
+    assert member_name(".") == ""
+
+
+def test_wanted_skips_hidden_and_macos_metadata():
+    assert wanted("docs/a.md")
+    assert not wanted("docs/.a.md")
+    assert not wanted(".git/a.md")
+    assert not wanted("__MACOSX/docs/a.md")
+    assert not wanted("docs/image.png")
+    assert not wanted("")
+
+
+def test_iter_tar_handles_dot_slash_prefix(tmp_path):
+    # What `tar -C dir -czf x.tgz .` produces
+    path = tmp_path / "x.tgz"
+    with tarfile.open(path, "w:gz") as archive:
+        dot = tarfile.TarInfo(".")
+        dot.type = tarfile.DIRTYPE
+        archive.addfile(dot)
+        add_tar_member(archive, "./a.md")
+        add_tar_member(archive, "./guides/setup.txt")
+        add_tar_member(archive, "./.hidden.md")
+        add_tar_member(archive, "./logo.png")
+    with tarfile.open(path) as archive:
+        entries = list(iter_tar(archive, "x.tgz"))
+        assert [e.name for e in entries] == ["x.tgz/a.md", "x.tgz/guides/setup.txt"]
+        assert entries[0].mtime == 1700000000.0
+        with entries[0].open() as stream:
+            assert stream.read() == b"# title\n\nbody\n"
+
+
+def test_iter_zip_lists_wanted_files(tmp_path):
+    path = tmp_path / "corpus.zip"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("docs/", "")
+        archive.writestr("docs/a.md", "alpha")
+        archive.writestr("docs/b.pdf", "%PDF-")
+        archive.writestr("__MACOSX/docs/._a.md", "fork")
+        archive.writestr("notes.csv", "a,b")
+        archive.writestr("./c.txt", "gamma")
+    with zipfile.ZipFile(path) as archive:
+        entries = list(iter_zip(archive, "corpus.zip"))
+        assert [e.name for e in entries] == ["corpus.zip/docs/a.md", "corpus.zip/docs/b.pdf", "corpus.zip/c.txt"]
+        assert entries[0].size == 5
+        with entries[2].open() as stream:
+            assert stream.read() == b"gamma"
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = IngestManifest(str(tmp_path / "bulk.sqlite3"))
+    yield manifest
+    manifest.close()
+
+
+def entry(name, size=10, mtime=1.0):
+    return Entry(name, size, mtime, None, None)
+
+
+def test_manifest_records_done_and_failed(manifest):
+    manifest.mark_done([(entry("a.md"), "h1", 3), (entry("b.md", 20, 2.0), "h2", 5)])
+    manifest.mark_failed(entry("c.pdf"), "boom")
+    assert manifest.load() == {
+        "a.md": ManifestRow(10, 1.0, "h1", "done"),
+        "b.md": ManifestRow(20, 2.0, "h2", "done"),
+        "c.pdf": ManifestRow(10, 1.0, None, "failed"),
+    }
+
+
+def test_manifest_failure_is_replaced_by_later_success(manifest):
+    manifest.mark_failed(entry("c.pdf"), "boom")
+    manifest.mark_done([(entry("c.pdf"), "h3", 4)])
+    assert manifest.load()["c.pdf"] == ManifestRow(10, 1.0, "h3", "done")
+
+
+def test_manifest_touch_keeps_hash_and_chunks(manifest):
+    manifest.mark_done([(entry("a.md"), "h1", 3)])
+    manifest.touch(entry("a.md", 11, 5.0))
+    assert manifest.load()["a.md"] == ManifestRow(11, 5.0, "h1", "done")
+    chunks = manifest._conn.execute("SELECT chunks FROM files WHERE name = 'a.md'").fetchone()[0]
+    assert chunks == 3
+
+
+def test_is_unchanged_only_for_done_files_with_same_stat(manifest):
+    manifest.mark_done([(entry("a.md"), "h1", 3)])
+    manifest.mark_failed(entry("b.pdf"), "boom")
+    seen = manifest.load()
+    assert is_unchanged(entry("a.md"), seen.get("a.md"))
+    assert not is_unchanged(entry("a.md", size=11), seen.get("a.md"))
+    assert not is_unchanged(entry("a.md", mtime=2.0), seen.get("a.md"))
+    assert not is_unchanged(entry("b.pdf"), seen.get("b.pdf"))
+    assert not is_unchanged(entry("new.md"), seen.get("new.md"))
+
+
+def test_manifest_survives_reopen(tmp_path):
+    path = str(tmp_path / "bulk.sqlite3")
+    first = IngestManifest(path)
+    first.mark_done([(entry("a.md"), "h1", 3)])
+    first.close()
+    second = IngestManifest(path)
+    try:
+        assert second.load()["a.md"].sha256 == "h1"
+    finally:
+        second.close()
+
+
+def write(path, text="# notes\n\nbody\n"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return path
+
+
+def test_directory_entries_are_prefixed_with_the_root_name(tmp_path):
+    write(tmp_path / "docs" / "guides" / "setup.md")
+    write(tmp_path / "docs" / ".git" / "x.md")
+    entries = collect_entries([str(tmp_path / "docs") + "/"], [])
+    assert [e.name for e in entries] == ["docs/guides/setup.md"]
+
+
+def test_roots_with_different_names_keep_same_relative_paths_apart(tmp_path):
+    write(tmp_path / "a" / "notes" / "x.md", "alpha")
+    write(tmp_path / "b" / "notes" / "x.md", "beta")
+    entries = collect_entries([str(tmp_path / "a"), str(tmp_path / "b")], [])
+    assert [e.name for e in entries] == ["a/notes/x.md", "b/notes/x.md"]
+
+
+def test_colliding_names_are_reported_and_skipped(tmp_path, capsys):
+    first = write(tmp_path / "p" / "docs" / "notes" / "x.md", "first")
+    write(tmp_path / "q" / "docs" / "notes" / "x.md", "second")
+    write(tmp_path / "q" / "docs" / "other.md")
+    readme_p = write(tmp_path / "p" / "readme.md")
+    write(tmp_path / "q" / "readme.md")
+    paths = [str(tmp_path / "p" / "docs"), str(tmp_path / "q" / "docs"),
+             str(tmp_path / "p" / "readme.md"), str(tmp_path / "q" / "readme.md")]
+    entries = collect_entries(paths, [])
+    assert [(e.name, e.path) for e in entries] == [
+        ("docs/notes/x.md", str(first)), ("docs/other.md", str(tmp_path / "q" / "docs" / "other.md")),
+        ("readme.md", str(readme_p)),
+    ]
+    out = capsys.readouterr().out
+    assert "Skipping docs/notes/x.md from" in out and "Skipping readme.md from" in out
@@ -0,0 +1,83 @@
+import sqlite3
+
+import pytest
+
+from catalog import Catalog, GROUP_DOMAIN
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "catalog.sqlite3")
+
+
+def page(url, chunks=2, size=100):
+    return ("url", url, GROUP_DOMAIN, "example.com", chunks, size, "hash-" + url)
+
+
+def domain(catalog):
+    groups, total = catalog.list_groups(GROUP_DOMAIN)
+    return groups[0] if total else None
+
+
+def test_duplicates_are_not_counted(path):
+    catalog = Catalog(path, "m")
+    catalog.record([page("https://example.com/1"), page("https://example.com/2")])
+    catalog.record_duplicates([
+        ("url", "https://example.com/copy", GROUP_DOMAIN, "example.com", "https://example.com/1"),
+    ])
+    group = domain(catalog)
+    assert (group["sources"], group["chunks"], group["bytes"]) == (2, 4, 200)
+    assert catalog.ingested_at("url", "https://example.com/copy") is not None
+
+
+def test_page_turning_into_a_duplicate_leaves_the_totals(path):
+    catalog = Catalog(path, "m")
+    catalog.record([page("https://example.com/1"), page("https://example.com/2")])
+    catalog.record_duplicates([
+        ("url", "https://example.com/2", GROUP_DOMAIN, "example.com", "https://example.com/1"),
+    ])
+    assert domain(catalog)["sources"] == 1
+    catalog.record_duplicates([
+        ("url", "https://example.com/1", GROUP_DOMAIN, "example.com", "https://example.com/2"),
+    ])
+    assert domain(catalog) is None
+
+
+def test_duplicate_that_changes_is_counted_again(path):
+    catalog = Catalog(path, "m")
+    catalog.record([page("https://example.com/1")])
+    catalog.record_duplicates([
+        ("url", "https://example.com/copy", GROUP_DOMAIN, "example.com", "https://example.com/1"),
+    ])
+    catalog.record([page("https://example.com/copy", chunks=3, size=50)])
+    group = domain(catalog)
+    assert (group["sources"], group["chunks"], group["bytes"]) == (2, 5, 150)
+
+
+def test_old_catalog_drops_empty_pages_from_the_totals(path):
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute(
+            "CREATE TABLE sources (key_field TEXT NOT NULL, key_value TEXT NOT NULL,"
+            " group_kind TEXT NOT NULL, group_name TEXT NOT NULL,"
+            " chunk_count INTEGER NOT NULL, byte_size INTEGER NOT NULL,"
+            " source_hash TEXT, embedding_model TEXT, ingested_at REAL NOT NULL,"
+            " PRIMARY KEY (key_field, key_value))"
+        )
+        conn.execute(
+            "CREATE TABLE groups (group_kind TEXT NOT NULL, group_name TEXT NOT NULL,"
+            " source_count INTEGER NOT NULL, chunk_count INTEGER NOT NULL,"
+            " byte_size INTEGER NOT NULL, embedding_model TEXT, last_ingested REAL NOT NULL,"
+            " PRIMARY KEY (group_kind, group_name))"
+        )
+        conn.executemany(
+            "INSERT INTO sources VALUES (?, ?, 'domain', 'example.com', ?, ?, 'h', 'm', 1.0)",
+            [("url", "https://example.com/1", 2, 100), ("url", "https://example.com/copy", 0, 0)]
+        )
+        conn.execute("INSERT INTO groups VALUES ('domain', 'example.com', 2, 2, 100, 'm', 1.0)")
+    conn.close()
+
+    catalog = Catalog(path, "m")
+    group = domain(catalog)
+    assert (group["sources"], group["chunks"], group["bytes"]) == (1, 2, 100)
+    assert catalog.ingested_at("url", "https://example.com/copy") == 1.0
@@ -0,0 +1,45 @@
+from langchain.schema import Document
+
+from context_packing import pack_context, split_passages, estimate_tokens
+
+
+def hit(text, score=0.9, **metadata):
+    return Document(page_content=text, metadata=metadata), score
+
+
+def test_split_passages_merges_short_and_cuts_long_paragraphs():
+    assert split_passages("one\n\ntwo\n\n\nthree", max_chars=100) == ["one\n\ntwo\n\nthree"]
+    long = " ".join(["word"] * 60)  # 299 characters
+    passages = split_passages(long, max_chars=100)
+    assert all(len(p) <= 100 for p in passages)
+    assert " ".join(passages).split() == long.split()
+
+
+def test_exact_and_near_duplicate_passages_are_dropped():
+    text = "The reset button is on the back of the router next to the power socket."
+    docs = pack_context("reset button", [
+        hit(text, filename="a.pdf"),
+        hit(text, filename="b.pdf"),
+        hit(text.replace("socket.", "socket!"), filename="c.pdf"),
+    ])
+    assert [d.metadata["filename"] for d in docs] == ["a.pdf"]
+
+
+def test_budget_is_respected_and_document_order_kept():
+    paragraphs = [f"Paragraph {i} talks about subject {i} in its own distinct words number {i}." for i in range(10)]
+    hits = [hit(p, score=1 - i / 20, url=f"u{i}") for i, p in enumerate(paragraphs)]
+    budget = estimate_tokens(paragraphs[0]) * 3
+    docs = pack_context("subject", hits, budget=budget)
+    assert sum(estimate_tokens(d.page_content) for d in docs) <= budget
+    assert len(docs) == 3
+    urls = [d.metadata["url"] for d in docs]
+    assert urls == sorted(urls, key=lambda u: int(u[1:]))
+
+
+def test_most_relevant_passages_win_the_budget():
+    hits = [
+        hit("Unrelated text about gardening and tomatoes in the summer.", score=0.2, url="low"),
+        hit("Router firmware updates are installed from the admin page.", score=0.95, url="high"),
+    ]
+    budget = estimate_tokens(hits[1][0].page_content)
+    assert [d.metadata["url"] for d in pack_context("router firmware", hits, budget=budget)] == ["high"]
@@ -0,0 +1,71 @@
+import pytest
+
+from embedding_cache import EmbeddingCache, CachedEmbeddings, cache_key
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(t)), 1.0] for t in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "cache.sqlite3")
+
+
+def count(cache):
+    return cache._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+def test_only_misses_reach_the_model(path):
+    cache = EmbeddingCache(path, "m")
+    inner = CountingEmbeddings()
+    embeddings = CachedEmbeddings(inner, cache)
+    assert embeddings.embed_documents(["a", "bb"]) == [[1.0, 1.0], [2.0, 1.0]]
+    assert embeddings.embed_documents(["bb", "ccc", "a  "]) == [[2.0, 1.0], [3.0, 1.0], [1.0, 1.0]]
+    assert inner.calls == [["a", "bb"], ["ccc"]]
+    assert (cache.hits, cache.misses) == (2, 3)
+    cache.close()
+
+
+def test_eviction_keeps_most_recently_used(path):
+    cache = EmbeddingCache(path, "m", max_entries=10)
+    cache.put_many([(f"k{i}", [float(i)]) for i in range(10)])
+    assert count(cache) == 10
+    cache.get_many(["k0"])  # k0 becomes the most recently used
+    cache.put_many([("k10", [10.0])])
+    assert count(cache) == 9
+    assert set(cache.get_many(["k0", "k10", "k1", "k2"])) == {"k0", "k10"}
+    cache.close()
+
+
+def test_replacing_keys_does_not_evict(path):
+    cache = EmbeddingCache(path, "m", max_entries=5)
+    for _ in range(4):
+        cache.put_many([(f"k{i}", [1.0]) for i in range(5)])
+    assert count(cache) == 5
+
+
+def test_count_survives_reopen_and_model_change(path):
+    cache = EmbeddingCache(path, "m", max_entries=5)
+    cache.put_many([(f"k{i}", [1.0]) for i in range(5)])
+    cache.close()
+    reopened = EmbeddingCache(path, "m", max_entries=5)
+    reopened.put_many([("k5", [1.0])])
+    assert count(reopened) == 4
+    reopened.close()
+    other = EmbeddingCache(path, "other-model", max_entries=5)
+    assert count(other) == 0 and other._estimated_rows == 0
+
+
+def test_keys_depend_on_model_kind_and_normalized_text():
+    assert cache_key("m", "document", "a  b") == cache_key("m", "document", " a b ")
+    assert cache_key("m", "document", "a") != cache_key("m", "query", "a")
+    assert cache_key("m", "document", "a") != cache_key("n", "document", "a")
@@ -0,0 +1,59 @@
+import pytest
+
+import get_vector_db
+from get_vector_db import AdaptiveLimiter, PooledOllamaEmbeddings
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = AdaptiveLimiter(maximum=4, target_latency=1.0)
+    monkeypatch.setattr(get_vector_db, "_limiter", limiter)
+    monkeypatch.setattr(get_vector_db, "EMBED_RETRIES", 1)
+    monkeypatch.setattr(get_vector_db.time, "sleep", lambda seconds: None)
+    return limiter
+
+
+@pytest.fixture
+def embeddings():
+    return PooledOllamaEmbeddings(model="test", base_url="http://127.0.0.1:9")
+
+
+def test_limiter_grows_on_fast_batches_and_halves_on_failures():
+    limiter = AdaptiveLimiter(maximum=4, target_latency=1.0)
+    for _ in range(5):
+        limiter.acquire()
+        limiter.release(0.1)
+    assert limiter.limit == 4
+    limiter.acquire()
+    limiter.release(None)
+    assert limiter.limit == 2 and limiter.in_flight == 0
+
+
+def test_unexpected_error_releases_the_slot(limiter, embeddings, monkeypatch):
+    def broken(self, texts):
+        raise TypeError("unexpected response")
+
+    monkeypatch.setattr(PooledOllamaEmbeddings, "_post_batch", broken)
+    for _ in range(10):
+        with pytest.raises(TypeError):
+            embeddings._embed_batch(["a"])
+    assert limiter.in_flight == 0
+
+
+def test_retryable_error_is_retried_then_reported(limiter, embeddings, monkeypatch):
+    calls = []
+
+    def failing(self, texts):
+        calls.append(texts)
+        raise ValueError("HTTP 500")
+
+    monkeypatch.setattr(PooledOllamaEmbeddings, "_post_batch", failing)
+    with pytest.raises(ValueError, match="failed after 2 attempts: HTTP 500"):
+        embeddings._embed_batch(["a"])
+    assert len(calls) == 2 and limiter.in_flight == 0
+
+
+def test_success_returns_vectors(limiter, embeddings, monkeypatch):
+    monkeypatch.setattr(PooledOllamaEmbeddings, "_post_batch", lambda self, texts: ([[1.0]] * len(texts), 3))
+    assert embeddings._embed_batch(["a", "b"]) == [[1.0], [1.0]]
+    assert limiter.in_flight == 0
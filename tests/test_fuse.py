@@ -0,0 +1,29 @@
+from langchain.schema import Document
+
+from query import fuse
+
+
+def doc(url, index=0):
+    return Document(page_content=f"text of {url} {index}", metadata={"url": url, "chunk_index": index})
+
+
+def test_chunk_ranked_first_everywhere_scores_one():
+    a, b = doc("a"), doc("b")
+    fused = fuse([[(a, 0.9), (b, 0.5)], [(a, 3.0), (b, 1.0)]])
+    assert fused[0][0] is a
+    assert fused[0][1] == 1.0
+    assert fused[1][1] < 1.0
+
+
+def test_chunk_in_both_lists_beats_one_list_leader():
+    a, b, c = doc("a"), doc("b"), doc("c")
+    fused = fuse([[(a, 0.9), (b, 0.8)], [(c, 5.0), (b, 4.0)]])
+    assert [d.metadata["url"] for d, _ in fused] == ["b", "a", "c"]
+
+
+def test_same_chunk_from_both_searches_is_merged():
+    vector_hit = doc("a", 2)
+    lexical_hit = Document(page_content=vector_hit.page_content, metadata=dict(vector_hit.metadata))
+    fused = fuse([[(vector_hit, 0.9)], [(lexical_hit, 7.0)]])
+    assert len(fused) == 1
+    assert fused[0][0] is vector_hit
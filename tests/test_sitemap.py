@@ -0,0 +1,53 @@
+import gzip
+
+from rotating_user_agent import SitemapParser, SitemapEntry, parse_sitemap
+
+URLSET = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>https://example.com/a</loc><lastmod>2024-05-01</lastmod><changefreq>weekly</changefreq></url>
+  <url><loc> https://example.com/b </loc></url>
+  <url><lastmod>2024-05-01</lastmod></url>
+</urlset>
+"""
+
+INDEX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>https://example.com/pages.xml.gz</loc><lastmod>2024-06-01</lastmod></sitemap>
+</sitemapindex>
+"""
+
+EXPECTED = [
+    SitemapEntry("url", "https://example.com/a", "2024-05-01", "weekly"),
+    SitemapEntry("url", "https://example.com/b", None, None),
+]
+
+
+def feed_in_pieces(data, size):
+    parser = SitemapParser()
+    entries = []
+    for i in range(0, len(data), size):
+        entries.extend(parser.feed(data[i:i + size]))
+    return entries + parser.close()
+
+
+def test_plain_sitemap():
+    assert feed_in_pieces(URLSET, len(URLSET)) == EXPECTED
+
+
+def test_gzipped_sitemap_fed_byte_by_byte():
+    # One-byte pieces also exercise the two-byte gzip sniffing
+    assert feed_in_pieces(gzip.compress(URLSET), 1) == EXPECTED
+
+
+def test_gzipped_sitemap_in_chunks():
+    assert feed_in_pieces(gzip.compress(URLSET), 7) == EXPECTED
+
+
+def test_sitemap_index():
+    assert parse_sitemap(INDEX) == (["https://example.com/pages.xml.gz"], [])
+    assert parse_sitemap(URLSET.decode()) == ([], ["https://example.com/a", "https://example.com/b"])
+
+
+def test_bare_loc_list():
+    xml = b"<urls><loc>https://example.com/x</loc><loc>https://example.com/y</loc></urls>"
+    assert parse_sitemap(xml) == ([], ["https://example.com/x", "https://example.com/y"])